@@ -0,0 +1,88 @@
+# benchmarks/bench_content.py
+"""
+内容に基づく推薦 (content.ContentIndex) の索引の作成時間と、1ユーザーあたりの推薦の待ち時間を測る (Datastore 不要)。
+番組はジャンルごとの語彙から作ったタイトル・補足と、人気に偏りのある出演者で合成する。
+比較として、候補を絞らずに全番組とのコサイン類似度を計算した場合の待ち時間と、上位の一致率も表示する。
+
+    cd backend
+    python benchmarks/bench_content.py --programs 100000
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from content import ContentIndex  # noqa: E402
+
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KANJI = "日本東京大阪旅行料理音楽映画歴史科学自然動物世界生活健康経済政治野球相撲将棋囲碁家族学校"
+
+
+def make_programs(n_programs: int, n_genres: int, n_cast: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    alphabet = np.array(list(KANA + KANJI))
+    genres = [["".join(rng.choice(alphabet, rng.integers(2, 5))) for _ in range(30)] for _ in range(n_genres)]
+    programs = []
+    for i in range(n_programs):
+        words = genres[rng.integers(n_genres)]
+        title = "".join(rng.choice(words, 3))
+        supplement = "、".join(rng.choice(words, 8))
+        cast = [f"出演者{c}" for c in (rng.zipf(1.5, rng.integers(1, 6)) % n_cast)]
+        programs.append({"program_id": f"program{i}", "title": title, "supplement": supplement,
+                         "cast_names": cast})
+    return programs
+
+
+def brute_force(index: ContentIndex, seeds: dict, n: int):
+    features, values = index.profile(seeds)
+    scores = index.score(np.arange(len(index)), features, values)
+    for pid in seeds:
+        scores[index.program_index[pid]] = -np.inf
+    top = np.argsort(-scores)[:n]
+    return [(index.program_ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+def report(name: str, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>12}: p50 {statistics.median(latencies) * 1000:7.3f} ms  p99 {p99 * 1000:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--programs", type=int, default=100000)
+    parser.add_argument("--genres", type=int, default=50)
+    parser.add_argument("--cast", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--n", type=int, default=10)
+    args = parser.parse_args()
+
+    programs = make_programs(args.programs, args.genres, args.cast)
+    start = time.perf_counter()
+    index = ContentIndex(programs)
+    print(f"索引の作成: {time.perf_counter() - start:.2f}s  "
+          f"{len(index)} programs, {len(index.features)} features, nnz={len(index.data)}")
+
+    rng = np.random.default_rng(1)
+    users = [{index.program_ids[i]: float(rng.choice([2.0, 1.5, -1.5]))
+              for i in rng.integers(0, len(index), rng.integers(1, 5))} for _ in range(args.users)]
+    results = {}
+    for name, fn in (("索引", index.recommend), ("全件", lambda seeds, n: brute_force(index, seeds, n))):
+        latencies, results[name] = [], []
+        for seeds in users:
+            start = time.perf_counter()
+            results[name].append(fn(seeds, args.n))
+            latencies.append(time.perf_counter() - start)
+        report(name, latencies)
+    overlap = [len({p for p, _ in a} & {p for p, _ in b}) / max(1, len(b))
+               for a, b in zip(results["索引"], results["全件"])]
+    print(f"上位{args.n}件の一致率: {statistics.mean(overlap):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# benchmarks/bench_hot_paths.py
+"""
+よく呼ばれる処理を、合成データ (MemoryStorage) とローカルの HTML だけで測る (Datastore・bangumi.org 不要)。
+- recommend_programs: 事前計算済み / その場でモデルから計算 / レビューの少ないユーザー (内容・人気番組)
+- get_popular_programs: 集計の種類 (all / 24h / 7d / decayed) ごと
+- スクレイピングの解析: 検索結果・詳細ページの HTML の解析と、fixture_server を相手にした HTTP エンジンの検索
+結果は --out に JSON で保存でき、compare_results.py で前回と比べられる。
+
+    cd backend
+    python benchmarks/bench_hot_paths.py --reviews 1000000 --out results/hot_paths.json
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import install_storage, isolated_env, prepare_models  # noqa: E402
+
+isolated_env(SCRAPER_ENGINE="http", MODEL_ITERATIONS="5")
+
+import numpy as np  # noqa: E402
+
+import config  # noqa: E402
+import recommendation  # noqa: E402
+import scraper  # noqa: E402
+from fixture_server import FIXTURES_DIR, FixtureServer  # noqa: E402
+from http_scraper import parse_program_detail, parse_program_links  # noqa: E402
+from popularity import MODES as POPULARITY_MODES  # noqa: E402
+from results import latency_summary, save_results  # noqa: E402
+from synthetic import SyntheticData  # noqa: E402
+
+
+def measure(fn, args_list, warmup: int = 3) -> dict:
+    """
+    args_list の引数で fn を1回ずつ呼び、待ち時間の要約と1秒あたりの回数を返す
+    """
+    for args in args_list[:warmup]:
+        fn(*args)
+    latencies = []
+    start = time.perf_counter()
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t)
+    summary = latency_summary(latencies)
+    summary["calls_per_s"] = len(latencies) / (time.perf_counter() - start)
+    return summary
+
+
+def report(name: str, summary: dict):
+    print(f"{name:>24}: p50 {summary['p50_ms']:8.3f} ms  p99 {summary['p99_ms']:8.3f} ms"
+          f"  {summary['calls_per_s']:10.1f} 回/s")
+
+
+def bench_recommendations(calls: int, n: int, rng) -> dict:
+    scorer = recommendation.model_manager.current["scorer"]
+    warm = [u for u in scorer.user_ids if scorer.n_seen(u) >= 5]
+    cold = [f"newuser{i}" for i in range(calls)]
+    users = [(warm[i], n) for i in rng.integers(0, len(warm), calls)] if warm else []
+    results = {}
+    if users:
+        results["precomputed"] = measure(recommendation.recommend_programs, users)
+
+        def from_model(user_id, n):
+            recommendation.recommendation_store.invalidate(user_id)
+            return recommendation.recommend_programs(user_id, n)
+        results["model"] = measure(from_model, users)
+    results["cold_user"] = measure(recommendation.recommend_programs, [(u, n) for u in cold])
+    return results
+
+
+def bench_popular(calls: int, n: int) -> dict:
+    return {mode: measure(recommendation.get_popular_programs, [(n, mode)] * calls) for mode in POPULARITY_MODES}
+
+
+def bench_parse(calls: int, n: int) -> dict:
+    search_html = (FIXTURES_DIR / "search.html").read_text(encoding="utf-8")
+    detail_html = (FIXTURES_DIR / "tv_event.html").read_text(encoding="utf-8")
+    results = {
+        "search_page": measure(parse_program_links, [(search_html, "http://localhost")] * calls),
+        "detail_page": measure(parse_program_detail, [(detail_html, "http://localhost/tv_events/x")] * calls),
+    }
+    with FixtureServer() as base_url:
+        config.BANGUMI_BASE_URL = base_url
+        engine = scraper.get_engine("http")
+        # フォールバックせず、HTTP だけの性能を測る
+        engine.fallback = None
+        queries = [(f"ドラマ{i}", n, None, engine) for i in range(max(10, calls // 20))]
+        results["http_search"] = measure(scraper.scrape_programs, queries)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reviews", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--programs", type=int, default=None)
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="結果を保存する JSON のパス")
+    args = parser.parse_args()
+
+    data = SyntheticData(args.reviews, args.users, args.programs, seed=args.seed)
+    install_storage(data)
+    prepare_models()
+    rng = np.random.default_rng(args.seed)
+
+    results = {
+        "recommend_programs": bench_recommendations(args.calls, args.n, rng),
+        "get_popular_programs": bench_popular(args.calls, args.n),
+        "parse": bench_parse(args.calls, config.SEARCH_DEFAULT_RESULTS),
+    }
+    for group, cases in results.items():
+        print(group)
+        for name, summary in cases.items():
+            report(name, summary)
+    if args.out:
+        save_results(args.out, "hot_paths", results, args)
+
+
+if __name__ == "__main__":
+    main()
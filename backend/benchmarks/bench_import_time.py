@@ -0,0 +1,101 @@
+# benchmarks/bench_import_time.py
+"""
+`import main` にかかる時間 (コンテナの起動・オートスケールの初回応答に効く) を新しいプロセスで繰り返し測り、
+予算 (--budget 秒) を超えるか、使うまで読み込まないはずの重いモジュールが読み込まれていれば終了コード 1 で終わる。
+-X importtime の結果から、時間のかかっている main 直下の import も表示する。
+
+    cd backend
+    python benchmarks/bench_import_time.py --runs 10 --budget 1.0 --out results/import_time.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import isolated_env  # noqa: E402
+from results import save_results  # noqa: E402
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# 使うときに関数の中で読み込むモジュール (import main の時点では読み込まれていないこと)
+LAZY_MODULES = ("selenium", "webdriver_manager", "google.cloud.datastore", "pyarrow", "lxml")
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_once() -> dict:
+    result = subprocess.run([sys.executable, "-c", MEASURE], cwd=BACKEND_DIR, capture_output=True, text=True,
+                            env=os.environ, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int):
+    """
+    -X importtime の出力から、main が直接 import するモジュールを累積時間の長い順に返す
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, env=os.environ, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 字下げが2文字のものが main の直下の import
+        if name.startswith("   ") and not name.startswith("    ") and cumulative.strip().isdigit():
+            rows.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(rows, key=lambda row: -row[1])[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=1.0, help="import main の中央値の上限 (秒)")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--out", default=None, help="結果を保存する JSON のパス")
+    args = parser.parse_args()
+
+    # モデル・ジョブなどのファイルを作らないよう、一時ディレクトリに向ける
+    isolated_env()
+    runs = [measure_once() for _ in range(args.runs)]
+    seconds = [run["seconds"] for run in runs]
+    loaded = sorted({m for run in runs for m in run["loaded"]})
+    results = {
+        "import_main": {
+            "median_s": statistics.median(seconds),
+            "min_s": min(seconds),
+            "max_s": max(seconds),
+            "runs": len(seconds),
+        },
+        "lazy_modules_loaded": loaded,
+        "top_imports_s": dict(top_imports(args.top)),
+    }
+    print(f"import main: 中央値 {results['import_main']['median_s'] * 1000:.0f} ms"
+          f"  最小 {results['import_main']['min_s'] * 1000:.0f} ms  ({args.runs} 回)")
+    for name, cumulative in results["top_imports_s"].items():
+        print(f"  {name:<24} {cumulative * 1000:7.1f} ms")
+    if args.out:
+        save_results(args.out, "import_time", results, args)
+
+    failures = []
+    if results["import_main"]["median_s"] > args.budget:
+        failures.append(f"予算 {args.budget}s を超えました")
+    if loaded:
+        failures.append(f"import 時に読み込まれています: {', '.join(loaded)}")
+    if failures:
+        print("失敗: " + " / ".join(failures))
+        sys.exit(1)
+    print("予算内です")
+
+
+if __name__ == "__main__":
+    main()
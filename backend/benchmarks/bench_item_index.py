@@ -0,0 +1,97 @@
+# benchmarks/bench_item_index.py
+"""
+番組ベクトルの索引 (item_index.ModelIndex) の recall と1件あたりの待ち時間を、全件を調べる場合と比べる
+(Datastore 不要)。番組の因子はいくつかのジャンル (クラスタ) の周りに散らばるように合成する。
+
+    cd backend
+    python benchmarks/bench_item_index.py --items 200000 --probes 4,8,16,32
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from item_index import ModelIndex  # noqa: E402
+from scoring import FactorScorer, build_seen_index  # noqa: E402
+
+
+def make_scorer(n_users: int, n_items: int, n_factors: int, n_genres: int, seen_per_user: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    genres = rng.normal(0, 1, (n_genres, n_factors))
+    item_factors = genres[rng.integers(0, n_genres, n_items)] + rng.normal(0, 0.5, (n_items, n_factors))
+    user_factors = genres[rng.integers(0, n_genres, n_users)] + rng.normal(0, 0.5, (n_users, n_factors))
+    user_ids = [f"user{u}" for u in range(n_users)]
+    item_ids = [f"program{i}" for i in range(n_items)]
+    history = {uid: {item_ids[i] for i in rng.integers(0, n_items, seen_per_user)} for uid in user_ids}
+    indptr, indices = build_seen_index(user_ids, history, {iid: i for i, iid in enumerate(item_ids)})
+    return FactorScorer(user_ids, item_ids, user_factors * 0.1, item_factors * 0.1,
+                        rng.normal(0, 0.1, n_users), rng.normal(0, 0.1, n_items), 3.5, indptr, indices)
+
+
+def measure(fn, queries):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(fn(q))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def recall(results, truth) -> float:
+    hits = sum(len({pid for pid, _ in r} & {pid for pid, _ in t}) for r, t in zip(results, truth))
+    return hits / max(1, sum(len(t) for t in truth))
+
+
+def report(name: str, latencies, value: float = None):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>22}: p50 {statistics.median(latencies) * 1000:7.3f} ms  p99 {p99 * 1000:7.3f} ms"
+          + (f"  recall {value:.3f}" if value is not None else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--genres", type=int, default=100)
+    parser.add_argument("--seen", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lists", type=int, default=0, help="0 なら √番組数")
+    parser.add_argument("--probes", default="4,8,16,32")
+    args = parser.parse_args()
+
+    scorer = make_scorer(args.users, args.items, args.factors, args.genres, args.seen)
+    rng = np.random.default_rng(1)
+    users = [scorer.user_ids[u] for u in rng.integers(0, args.users, args.queries)]
+    programs = [scorer.item_ids[i] for i in rng.integers(0, args.items, args.queries)]
+
+    start = time.perf_counter()
+    exact = ModelIndex(scorer, min_items=args.items + 1)
+    print(f"全件 (厳密) の索引: {time.perf_counter() - start:.2f}s")
+    truth_users, latencies = measure(lambda u: exact.candidates(u, args.k), users)
+    report("exact candidates", latencies)
+    truth_similar, latencies = measure(lambda p: exact.similar(p, args.k), programs)
+    report("exact similar", latencies)
+    _, latencies = measure(lambda u: scorer.top_n(u, args.k), users)
+    report("scorer.top_n", latencies)
+
+    start = time.perf_counter()
+    index = ModelIndex(scorer, n_lists=args.lists, min_items=0)
+    print(f"IVF の索引 ({index.candidate_index.n_lists} lists): {time.perf_counter() - start:.2f}s")
+    for probe in [int(p) for p in args.probes.split(",")]:
+        index.similar_index.n_probe = index.candidate_index.n_probe = probe
+        results, latencies = measure(lambda u: index.candidates(u, args.k), users)
+        report(f"ivf candidates p={probe}", latencies, recall(results, truth_users))
+        results, latencies = measure(lambda p: index.similar(p, args.k), programs)
+        report(f"ivf similar p={probe}", latencies, recall(results, truth_similar))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/bench_metrics.py
+"""
+計測 (metrics.py) のオーバーヘッドを測る。
+- 何もしない関数を、そのまま / timed で包んで (有効・無効) / with span (有効・無効) で呼んだときの1回あたりの時間
+- /metrics の出力 (REGISTRY.render) にかかる時間
+
+    cd backend
+    python benchmarks/bench_metrics.py --calls 1000000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import metrics  # noqa: E402
+
+
+def noop():
+    return None
+
+
+def per_call(fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000000)
+    parser.add_argument("--stages", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {"そのまま": per_call(noop, args.calls)}
+    for enabled in (False, True):
+        metrics.ENABLED = enabled
+        label = "有効" if enabled else "無効"
+        results[f"timed ({label})"] = per_call(metrics.timed("bench.timed")(noop), args.calls)
+
+        def with_span():
+            with metrics.span("bench.span"):
+                return None
+        results[f"span ({label})"] = per_call(with_span, args.calls)
+    base = results["そのまま"]
+    for name, seconds in results.items():
+        print(f"{name:>14}: {seconds * 1e9:8.1f} ns/回  (+{(seconds - base) * 1e9:7.1f} ns)")
+
+    # ルート・段階が多いときの /metrics の出力時間
+    for i in range(args.stages):
+        metrics.stage_seconds.observe(0.01 * i, f"bench.stage{i}")
+        metrics.http_seconds.observe(0.01 * i, "GET", f"/bench/{i}", "200")
+    start = time.perf_counter()
+    text = metrics.REGISTRY.render()
+    print(f"/metrics の出力: {(time.perf_counter() - start) * 1000:.2f} ms ({len(text.splitlines())} 行)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# benchmarks/bench_model_store.py
+"""
+保存した推薦モデルを複数のプロセス (uvicorn の worker の代わり) で読み込んだときのメモリと推薦の速さを測る
+(Datastore 不要)。ランダムな因子のモデルを ModelStore で保存し、--workers の各プロセス数について
+- mmap: 今の形式 (model-<version>/*.npy を mmap で読む。ページキャッシュを共有する)
+- pickle: 古い形式 (model-<version>.pkl。プロセスごとにコピーを持つ)
+で読み込み、各プロセスが --duration 秒 top_n を呼び続ける。プロセスあたりの PSS (共有ページを頭割りしたメモリ)・
+プロセスだけが持つメモリ・合計の1秒あたりの推薦数を表示する。PSS は Linux の /proc/self/smaps_rollup から読む。
+
+    cd backend
+    python benchmarks/bench_model_store.py --items 100000 --users 100000 --workers 1,2,4
+"""
+import argparse
+import multiprocessing
+import pickle
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_scoring import make_scorer  # noqa: E402
+from item_index import ModelIndex  # noqa: E402
+from model_manager import ModelStore  # noqa: E402
+from results import save_results  # noqa: E402
+from scoring import FactorScorer  # noqa: E402
+
+FORMATS = ("mmap", "pickle")
+
+
+def make_store(directory: str) -> ModelStore:
+    return ModelStore(directory, loaders={
+        "scorer": lambda arrays, meta, model: FactorScorer.from_arrays(arrays, meta),
+        "index": lambda arrays, meta, model: ModelIndex.from_arrays(model["scorer"], arrays, model.get("version")),
+    })
+
+
+def memory_kb() -> dict:
+    """
+    このプロセスの Rss / Pss / 自分だけが持つページ (Private_*) を kB で返す
+    """
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def worker(directory: str, version: str, n: int, duration: float, start_at: float, seed: int, out):
+    store = make_store(directory)
+    model = store.load(version)
+    scorer = model["scorer"]
+    n_users = len(scorer.user_ids)
+    # 全プロセスの読み込みが終わってから一斉に測る
+    time.sleep(max(0.0, start_at - time.time()))
+    calls = 0
+    k = seed
+    stop_at = time.monotonic() + duration
+    while time.monotonic() < stop_at:
+        scorer.top_n(scorer.user_ids[k % n_users], n)
+        k += 7919
+        calls += 1
+    out.put({"calls": calls, **memory_kb()})
+
+
+def run(directory: str, version: str, n_workers: int, n: int, duration: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    start_at = time.time() + 5.0 + n_workers
+    processes = [ctx.Process(target=worker, args=(directory, version, n, duration, start_at, i, out))
+                 for i in range(n_workers)]
+    for process in processes:
+        process.start()
+    reports = [out.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        "workers": n_workers,
+        "top_n_per_s": sum(r["calls"] for r in reports) / duration,
+        "pss_mb_per_worker": sum(r["pss"] for r in reports) / len(reports) / 1024,
+        "private_mb_per_worker": sum(r["private"] for r in reports) / len(reports) / 1024,
+        "rss_mb_per_worker": sum(r["rss"] for r in reports) / len(reports) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--seen", type=int, default=20)
+    parser.add_argument("--workers", default="1,2,4", help="プロセス数 (カンマ区切り)")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--out", default=None, help="結果を保存する JSON のパス")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="tvsearch-bench-models-")
+    start = time.perf_counter()
+    scorer = make_scorer(args.users, args.items, args.factors, args.seen)
+    model = {
+        "scorer": scorer,
+        "index": ModelIndex(scorer),
+        "version": "bench",
+        "trained_at": datetime.utcnow(),
+        "n_reviews": args.users * args.seen,
+    }
+    print(f"モデルを作りました ({time.perf_counter() - start:.1f}s)")
+
+    store = make_store(directory)
+    start = time.perf_counter()
+    store.save(model)
+    saved_s = time.perf_counter() - start
+    start = time.perf_counter()
+    store.load("bench")
+    loaded_s = time.perf_counter() - start
+    # 古い形式: 同じモデルを pickle にして model-<version>.pkl として置く
+    with open(Path(directory) / "model-bench-pickle.pkl", "wb") as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    start = time.perf_counter()
+    store.load("bench-pickle")
+    pickle_loaded_s = time.perf_counter() - start
+    print(f"保存 {saved_s * 1000:.0f} ms  読み込み: mmap {loaded_s * 1000:.1f} ms"
+          f"  pickle {pickle_loaded_s * 1000:.1f} ms")
+
+    results = {"save_s": saved_s, "load_mmap_s": loaded_s, "load_pickle_s": pickle_loaded_s}
+    versions = {"mmap": "bench", "pickle": "bench-pickle"}
+    for fmt in args.formats.split(","):
+        for n_workers in (int(w) for w in args.workers.split(",")):
+            summary = run(directory, versions[fmt], n_workers, args.n, args.duration)
+            results[f"{fmt}_{n_workers}_workers"] = summary
+            print(f"{fmt:>6} x {n_workers:2d}: PSS {summary['pss_mb_per_worker']:8.1f} MB/worker"
+                  f"  private {summary['private_mb_per_worker']:8.1f} MB/worker"
+                  f"  {summary['top_n_per_s']:8.1f} 回/s")
+    if args.out:
+        save_results(args.out, "model_store", results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# benchmarks/bench_scoring.py
+"""
+FactorScorer の上位N件計算の速度を、ランダムな因子で測る (Datastore 不要)。
+
+    cd backend
+    python benchmarks/bench_scoring.py --items 100000 --users 10000
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scoring import FactorScorer, build_seen_index  # noqa: E402
+
+
+def make_scorer(n_users: int, n_items: int, n_factors: int, seen_per_user: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    user_ids = [f"user{u}" for u in range(n_users)]
+    item_ids = [f"program{i}" for i in range(n_items)]
+    history = {uid: {item_ids[i] for i in rng.integers(0, n_items, seen_per_user)} for uid in user_ids}
+    item_index = {iid: i for i, iid in enumerate(item_ids)}
+    indptr, indices = build_seen_index(user_ids, history, item_index)
+    return FactorScorer(
+        user_ids, item_ids,
+        rng.normal(0, 0.1, (n_users, n_factors)), rng.normal(0, 0.1, (n_items, n_factors)),
+        rng.normal(0, 0.1, n_users), rng.normal(0, 0.1, n_items),
+        3.5, indptr, indices,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--factors", type=int, default=100)
+    parser.add_argument("--seen", type=int, default=50)
+    parser.add_argument("-n", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    scorer = make_scorer(args.users, args.items, args.factors, args.seen)
+    user_ids = scorer.user_ids
+
+    timings = []
+    for k in range(args.runs):
+        start = time.perf_counter()
+        scorer.top_n(user_ids[k % len(user_ids)], args.n)
+        timings.append(time.perf_counter() - start)
+    print(f"top_n       ({args.items} items): p50 {statistics.median(timings) * 1000:.2f} ms"
+          f"  max {max(timings) * 1000:.2f} ms")
+
+    start = time.perf_counter()
+    scorer.top_n_batch(user_ids, args.n)
+    elapsed = time.perf_counter() - start
+    print(f"top_n_batch ({args.users} users): {elapsed:.2f} s"
+          f"  ({elapsed / len(user_ids) * 1000:.3f} ms/user)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# benchmarks/bench_scraper_engines.py
+"""
+selenium エンジンと http エンジンの検索時間を、保存済み HTML を返す
+ローカルサーバーに対して比較する (ネットワーク不要)。
+
+    cd backend
+    python benchmarks/bench_scraper_engines.py --runs 20 -n 10
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+import scraper  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+
+
+def run_engine(engine, runs: int, n: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = scraper.scrape_programs("ドラマ", limit=n, engine=engine)
+        timings.append(time.perf_counter() - start)
+        assert len(result["programs"]) == n, result
+    return timings
+
+
+def summarize(name: str, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:>9}: mean {statistics.mean(timings) * 1000:8.1f} ms"
+          f"  p50 {statistics.median(timings) * 1000:8.1f} ms"
+          f"  p95 {p95 * 1000:8.1f} ms  ({len(timings)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("-n", type=int, default=config.SEARCH_DEFAULT_RESULTS)
+    parser.add_argument("--engines", default="http,selenium")
+    args = parser.parse_args()
+
+    with FixtureServer() as base_url:
+        config.BANGUMI_BASE_URL = base_url
+        for name in args.engines.split(","):
+            try:
+                engine = scraper.get_engine(name)
+                if name == "http":
+                    # フォールバックせず、HTTP だけの性能を測る
+                    engine.fallback = None
+                run_engine(engine, 1, args.n)  # ウォームアップ (ブラウザ起動など)
+                summarize(name, run_engine(engine, args.runs, args.n))
+            except Exception as e:
+                print(f"{name:>9}: skipped ({e.__class__.__name__}: {e})")
+    scraper.shutdown_browser_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/bench_search_index.py
+"""
+検索の索引 (search_index.SearchIndex) の作成時間・1件ずつの更新時間・検索の待ち時間を、合成した番組とレビューで測る
+(Datastore・ブラウザ不要)。クエリは番組のタイトルの一部 (2〜6文字) を使う。
+
+    cd backend
+    python benchmarks/bench_search_index.py --programs 50000 --reviews 200000
+"""
+import argparse
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_content import make_programs  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+
+def report(name: str, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>16}: p50 {statistics.median(latencies) * 1000:7.3f} ms  p99 {p99 * 1000:7.3f} ms"
+          f"  ({len(latencies)} 回)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--programs", type=int, default=50000)
+    parser.add_argument("--reviews", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-n", type=int, default=10)
+    args = parser.parse_args()
+
+    programs = make_programs(args.programs, 50, 20000)
+    now = datetime.utcnow()
+    for i, program in enumerate(programs):
+        program["url"] = f"https://bangumi.org/tv_events/{program['program_id']}"
+        program["scraped_at"] = now
+    rng = np.random.default_rng(2)
+    reviews = [{"review_id": f"r{i}", "program_id": programs[p]["program_id"],
+                "review_text": programs[rng.integers(len(programs))]["supplement"][:20]}
+               for i, p in enumerate(rng.integers(0, len(programs), args.reviews))]
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.add_programs(programs)
+    for review in reviews:
+        index.add_review(review)
+    print(f"索引の作成: {time.perf_counter() - start:.2f}s  {index.info()}")
+
+    latencies = []
+    for program in programs[:args.queries]:
+        program = dict(program, supplement=program["supplement"][::-1])
+        start = time.perf_counter()
+        index.add_programs([program])
+        latencies.append(time.perf_counter() - start)
+    report("番組の更新", latencies)
+
+    titles = [programs[i]["title"] for i in rng.integers(0, len(programs), args.queries)]
+    for length in (2, 4, 6):
+        latencies, found = [], 0
+        for title in titles:
+            start = rng.integers(0, max(1, len(title) - length + 1))
+            query = title[start:start + length]
+            begin = time.perf_counter()
+            found += bool(index.search(query, args.n))
+            latencies.append(time.perf_counter() - begin)
+        report(f"{length}文字の検索", latencies)
+        print(f"{'':>16}  結果があったクエリ {found}/{len(titles)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/bench_training.py
+"""
+推薦モデルの学習 (CSR 行列の作成と ALS) の時間とメモリを、合成したレビューで測る (Datastore 不要)。
+ユーザー・番組の潜在因子からレビューを作り、番組の人気には偏り (Zipf) を付ける。
+スレッド数を変えて、1反復あたりの時間・学習全体の時間・学習中のメモリのピーク (tracemalloc) と
+プロセスの最大 RSS を表示する。最後に --holdout の割合を検証用にしたときの RMSE も表示する。
+
+    cd backend
+    python benchmarks/bench_training.py --ratings 1000000 --users 100000 --items 20000 --workers 1,4
+"""
+import argparse
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from factorization import ALSModel, RatingMatrix, split_holdout  # noqa: E402
+
+
+def make_ratings(n_ratings: int, n_users: int, n_items: int, rank: int = 8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.5, (n_users, rank)).astype(np.float32)
+    item_factors = rng.normal(0, 0.5, (n_items, rank)).astype(np.float32)
+    user_codes = rng.integers(0, n_users, n_ratings).astype(np.int32)
+    item_codes = ((rng.zipf(1.2, n_ratings) - 1) % n_items).astype(np.int32)
+    ratings = np.empty(n_ratings, dtype=np.float32)
+    for lo in range(0, n_ratings, 1_000_000):
+        hi = lo + 1_000_000
+        dot = np.einsum("rk,rk->r", user_factors[user_codes[lo:hi]], item_factors[item_codes[lo:hi]])
+        ratings[lo:hi] = np.clip(np.round(3.5 + dot + rng.normal(0, 0.5, len(dot))), 1, 5)
+    user_ids = [f"user{u}" for u in range(n_users)]
+    item_ids = [f"program{i}" for i in range(n_items)]
+    return user_codes, item_codes, ratings, user_ids, item_ids
+
+
+def mb(n_bytes) -> str:
+    return f"{n_bytes / 1024 / 1024:8.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ratings", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--items", type=int, default=20_000)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--regularization", type=float, default=0.1)
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    user_codes, item_codes, ratings, user_ids, item_ids = make_ratings(args.ratings, args.users, args.items)
+    print(f"ratings={args.ratings} users={args.users} items={args.items} factors={args.factors}")
+    print(f"入力 (コード+評価の列): {mb(user_codes.nbytes + item_codes.nbytes + ratings.nbytes)}")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    matrix = RatingMatrix.from_codes(user_codes, item_codes, ratings, user_ids, item_ids)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"CSR 作成: {elapsed:6.2f}s  nnz={matrix.nnz}  CSR {mb(matrix.nbytes)}  ピーク {mb(peak)}")
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        model = ALSModel(factors=args.factors, regularization=args.regularization,
+                         iterations=args.iterations, workers=workers)
+        tracemalloc.start()
+        start = time.perf_counter()
+        model.fit(matrix)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        per_iteration = np.median(model.timings)
+        print(f"ALS workers={workers:>2}: 合計 {elapsed:6.2f}s  1反復 {per_iteration:5.2f}s"
+              f"  学習中のピーク {mb(peak)}  train RMSE {model.rmse(matrix):.4f}")
+
+    factors_bytes = (model.user_factors.nbytes + model.item_factors.nbytes
+                     + model.user_bias.nbytes + model.item_bias.nbytes)
+    print(f"モデル (因子+バイアス): {mb(factors_bytes)}")
+
+    if args.holdout > 0:
+        train, test = split_holdout(user_codes, item_codes, ratings, fraction=args.holdout)
+        train_matrix = RatingMatrix.from_codes(*train, user_ids, item_ids)
+        test_matrix = RatingMatrix.from_codes(*test, user_ids, item_ids)
+        model.fit(train_matrix)
+        errors = model.predict(test_matrix.row_codes(), test_matrix.indices).clip(1, 5) - test_matrix.data
+        baseline = test_matrix.data - model.global_mean
+        print(f"holdout {args.holdout:.0%}: RMSE {np.sqrt(np.mean(errors ** 2)):.4f}"
+              f" (全体平均で予測: {np.sqrt(np.mean(baseline ** 2)):.4f})")
+
+    # Linux は KB 単位、macOS はバイト単位
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"最大 RSS: {mb(max_rss if sys.platform == 'darwin' else max_rss * 1024)}")
+
+
+if __name__ == "__main__":
+    main()
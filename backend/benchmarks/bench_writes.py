@@ -0,0 +1,122 @@
+# benchmarks/bench_writes.py
+"""
+レビュー・お気に入りの書き込みを direct / batched / write_behind で比較する。
+Datastore エミュレータ (または一時ファイルの SQLite) に対して、複数スレッドから同時に書き込んだときの
+スループットと1件あたりの待ち時間 (p50 / p99) を表示する。ユーザー登録 (get→put→get と
+1回のトランザクション) も比較する。
+
+    gcloud beta emulators datastore start --no-store-on-disk
+    cd backend
+    $(gcloud beta emulators datastore env-init)
+    python benchmarks/bench_writes.py --writes 2000 --clients 32
+
+    # エミュレータ無しで測る場合
+    python benchmarks/bench_writes.py --storage sqlite
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import storage  # noqa: E402
+from write_pipeline import WritePipeline  # noqa: E402
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(name: str, elapsed: float, latencies):
+    print(f"{name:>14}: {len(latencies) / elapsed:8.0f} writes/s"
+          f"  p50 {statistics.median(latencies) * 1000:7.1f} ms"
+          f"  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  ({len(latencies)} writes)")
+
+
+def run_clients(fn, n: int, clients: int):
+    def timed(i):
+        start = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = list(executor.map(timed, range(n)))
+    return time.perf_counter() - start, latencies
+
+
+def bench_pipeline(mode: str, n: int, clients: int, window: float, queue_path: str):
+    pipeline = WritePipeline(mode=mode, window=window, queue_path=queue_path)
+    pipeline.start()
+    run_id = uuid.uuid4().hex[:8]
+
+    def write(i):
+        if i % 2:
+            pipeline.submit("favorite", {"user_id": f"bench-{run_id}-{i % 100}",
+                                         "program_id": f"program-{i}"}).result()
+        else:
+            fields = database.new_review(f"program-{i % 500}", "ベンチマーク", f"bench-{run_id}-{i % 100}",
+                                         3, "bench")
+            pipeline.submit("review", fields).result()
+
+    elapsed, latencies = run_clients(write, n, clients)
+    summarize(mode, elapsed, latencies)
+    start = time.perf_counter()
+    # write_behind は応答後に保存されるので、キューが空になるまでの時間も測る
+    while pipeline.queue is not None and pipeline.queue.pending():
+        time.sleep(0.01)
+    pipeline.stop()
+    if mode == "write_behind":
+        print(f"{'':>14}  キューが空になるまで {time.perf_counter() - start:.2f}s")
+    print(f"{'':>14}  {pipeline.info()}")
+
+
+def bench_users(n: int, clients: int):
+    run_id = uuid.uuid4().hex[:8]
+
+    def get_put_get(i):
+        user_id = f"bench-{run_id}-old-{i}"
+        if database.get_user(user_id) is None:
+            database.add_user(user_id, "bench")
+            database.get_user(user_id)
+
+    def transactional(i):
+        database.create_user(f"bench-{run_id}-tx-{i}", "bench")
+
+    summarize("user get/put", *run_clients(get_put_get, n, clients))
+    summarize("user txn", *run_clients(transactional, n, clients))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--window", type=float, default=0.005)
+    parser.add_argument("--modes", default="direct,batched,write_behind")
+    parser.add_argument("--storage", choices=("datastore", "sqlite"), default="datastore")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.storage == "datastore":
+            if not os.getenv("DATASTORE_EMULATOR_HOST"):
+                sys.exit("DATASTORE_EMULATOR_HOST が設定されていません (エミュレータを起動してください)")
+            storage.set_storage(storage.create_storage("datastore"))
+        else:
+            from storage_sqlite import SqliteStorage
+            storage.set_storage(SqliteStorage(os.path.join(tmp, "bench.db")))
+        for mode in args.modes.split(","):
+            bench_pipeline(mode, args.writes, args.clients, args.window, os.path.join(tmp, "queue.db"))
+        bench_users(args.users, args.clients)
+
+
+if __name__ == "__main__":
+    main()
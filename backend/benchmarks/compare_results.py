@@ -0,0 +1,87 @@
+# benchmarks/compare_results.py
+"""
+results.py で保存した2つの結果 (基準・今回) を比べ、閾値より悪くなった値があれば終了コード 1 で終わる (CI 用)。
+*_ms / *_s は小さいほど良い、*_per_s は大きいほど良いとみなす。それ以外の数値 (件数など) は表示だけする。
+
+    cd backend
+    python benchmarks/compare_results.py baseline.json current.json --threshold 0.1
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from results import load_results  # noqa: E402
+
+LOWER_IS_BETTER = ("_ms", "_s")
+HIGHER_IS_BETTER = ("_per_s",)
+
+
+def flatten(value, prefix: str = ""):
+    """
+    入れ子の dict を {"a.b.c": 数値} にする
+    """
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from flatten(child, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, float(value)
+
+
+def direction(key: str) -> int:
+    """
+    1: 大きいほど良い / -1: 小さいほど良い / 0: 比べない
+    """
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """
+    (キー, 基準, 今回, 変化率, 悪化したか) のリストを返す。変化率は良くなる向きを正にする
+    """
+    base_values = dict(flatten(baseline["results"]))
+    rows = []
+    for key, value in flatten(current["results"]):
+        if key not in base_values:
+            continue
+        base = base_values[key]
+        sign = direction(key)
+        change = sign * (value - base) / base if base else 0.0
+        rows.append((key, base, value, change, sign != 0 and change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="これ以上悪くなったら失敗 (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    baseline, current = load_results(args.baseline), load_results(args.current)
+    if baseline.get("benchmark") != current.get("benchmark"):
+        print(f"別のベンチマークの結果です: {baseline.get('benchmark')} / {current.get('benchmark')}")
+        sys.exit(2)
+    print(f"基準: {baseline['meta'].get('commit')} ({baseline['meta'].get('created_at')})")
+    print(f"今回: {current['meta'].get('commit')} ({current['meta'].get('created_at')})")
+
+    rows = compare(baseline, current, args.threshold)
+    width = max((len(key) for key, *_ in rows), default=10)
+    for key, base, value, change, regressed in rows:
+        mark = "悪化" if regressed else ("" if direction(key) else "-")
+        print(f"{key:<{width}}  {base:12.3f} -> {value:12.3f}  {change * 100:+7.1f}%  {mark}")
+    regressions = [key for key, *_, regressed in rows if regressed]
+    if regressions:
+        print(f"{len(regressions)} 件が {args.threshold * 100:.0f}% 以上悪くなりました: {', '.join(regressions)}")
+        sys.exit(1)
+    print("悪化はありません")
+
+
+if __name__ == "__main__":
+    main()
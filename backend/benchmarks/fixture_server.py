@@ -0,0 +1,99 @@
+# benchmarks/fixture_server.py
+"""
+保存済みの HTML を bangumi.org の代わりに返すローカル HTTP サーバー。
+- /search?q=...      -> fixtures/search.html (検索語と、検索語ごとに異なる番組IDに置き換える)
+- /tv_events/<id>    -> fixtures/tv_event.html (タイトルに番組IDを入れる)
+delay を指定すると、応答ごとにその秒数だけ待つ (本物のサイトの応答時間の代わり)。
+server.requests に種類 (search / tv_event) ごとの回数を数える。
+"""
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+# 保存済みの HTML の中の検索語・番組ID・タイトル
+FIXTURE_QUERY = "ドラマ".encode()
+FIXTURE_ID_PREFIX = b"AhXYZ"
+FIXTURE_TITLE = "ドラマ 第1話".encode()
+
+
+def program_id_prefix(query: str) -> str:
+    """
+    検索語ごとに異なる番組IDの接頭辞 (同じ検索語なら同じ番組が返る)
+    """
+    return f"Q{zlib.crc32(query.encode()):08x}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive を有効にする
+    wbufsize = 64 * 1024  # ヘッダーと本文をまとめて送る (Nagle による遅延を避ける)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/search":
+            query = parse_qs(url.query).get("q", [""])[0]
+            body = (self.server.pages["search.html"]
+                    .replace(FIXTURE_QUERY, query.encode())
+                    .replace(FIXTURE_ID_PREFIX, program_id_prefix(query).encode()))
+            kind = "search"
+        elif url.path.startswith("/tv_events/"):
+            program_id = unquote(url.path[len("/tv_events/"):])
+            body = self.server.pages["tv_event.html"].replace(FIXTURE_TITLE, f"番組 {program_id}".encode())
+            kind = "tv_event"
+        else:
+            self.send_error(404)
+            return
+        with self.server.lock:
+            self.server.requests[kind] += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """
+    with FixtureServer() as base_url: で起動し、抜けると停止する
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.pages = {p.name: p.read_bytes() for p in FIXTURES_DIR.glob("*.html")}
+        self.httpd.delay = delay
+        self.httpd.requests = Counter()
+        self.httpd.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> Counter:
+        return self.httpd.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self.base_url
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    server = FixtureServer(port=8765)
+    print(f"Serving fixtures on {server.base_url}")
+    server.httpd.serve_forever()
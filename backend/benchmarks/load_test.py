@@ -0,0 +1,236 @@
+# benchmarks/load_test.py
+"""
+FastAPI アプリ全体への負荷試験 (Datastore・bangumi.org・Chrome 不要)。
+- 保存先: 合成データを入れた MemoryStorage (--latency で1回の呼び出しごとの待ち時間を足せる)
+- bangumi.org: fixture_server (--site-delay で応答ごとの待ち時間を足せる)。スクレイピングは HTTP エンジンだけを使う
+- アプリは uvicorn で同じプロセスの別スレッドに起動し、--clients 個のスレッドが --duration 秒の間リクエストを送り続ける
+送るリクエストは検索・レビュー一覧・/batch・推薦・人気番組・似ている番組・レビュー投稿を重み付きで混ぜる。
+エンドポイントごとの件数・エラー数・p50/p99・1秒あたりの件数を表示し、--out に JSON で保存できる。
+
+    cd backend
+    python benchmarks/load_test.py --reviews 100000 --clients 16 --duration 30 --out results/load.json
+"""
+import argparse
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import install_storage, isolated_env, prepare_models  # noqa: E402
+
+isolated_env(SCRAPER_ENGINE="http", MODEL_ITERATIONS="5")
+
+import numpy as np  # noqa: E402
+import requests  # noqa: E402
+import uvicorn  # noqa: E402
+
+import config  # noqa: E402
+import main as app_main  # noqa: E402
+import scraper  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+from results import latency_summary, save_results  # noqa: E402
+from synthetic import SyntheticData  # noqa: E402
+
+# エンドポイントごとの重み (1リクエストごとにこの割合で選ぶ)
+MIX = {
+    "search": 10,
+    "reviews": 25,
+    "batch": 15,
+    "recommendations": 20,
+    "popular": 10,
+    "similar": 10,
+    "post_review": 10,
+}
+
+
+class Workload:
+    """
+    合成データの ID から、人気の偏り (Zipf) に沿ってリクエストを作る
+    """
+
+    def __init__(self, data: SyntheticData, titles: dict, mix: dict, seed: int = 0):
+        self.n_users = data.n_users
+        self.n_programs = data.n_programs
+        self.titles = titles
+        self.names = list(mix)
+        weights = np.array([mix[name] for name in self.names], dtype=float)
+        self.weights = weights / weights.sum()
+        self.seed = seed
+
+    def rng(self, client: int):
+        return np.random.default_rng(self.seed + client)
+
+    def _program(self, rng) -> str:
+        return f"program{(rng.zipf(1.2) - 1) % self.n_programs}"
+
+    def _user(self, rng) -> str:
+        return f"user{rng.integers(self.n_users)}"
+
+    def next(self, rng):
+        """
+        (名前, メソッド, パス, パラメータ, 本文) を返す
+        """
+        name = self.names[rng.choice(len(self.names), p=self.weights)]
+        if name == "search":
+            # 同じ検索語が繰り返されるよう、検索語も偏らせる (初回はスクレイピング、以降はキャッシュ)
+            return name, "GET", "/search", {"q": f"ドラマ{rng.zipf(1.5)}"}, None
+        if name == "reviews":
+            return name, "GET", f"/reviews/program/{self._program(rng)}", {"limit": 20}, None
+        if name == "batch":
+            ids = sorted({self._program(rng) for _ in range(10)})
+            return name, "GET", "/batch", {"program_ids": ids, "user_id": self._user(rng)}, None
+        if name == "recommendations":
+            return name, "GET", f"/recommendations/{self._user(rng)}", {"n": 10}, None
+        if name == "popular":
+            return name, "GET", "/programs/popular", {"n": 10, "mode": rng.choice(["all", "24h", "decayed"])}, None
+        if name == "similar":
+            return name, "GET", f"/programs/{self._program(rng)}/similar", {"n": 10}, None
+        pid = self._program(rng)
+        review = {"program_id": pid, "program_title": self.titles.get(pid, pid), "user_id": self._user(rng),
+                  "rating": int(rng.integers(1, 6)), "review_text": "負荷試験"}
+        return name, "POST", "/reviews", None, review
+
+
+class AppServer:
+    """
+    uvicorn でアプリを別スレッドに起動する。with で起動して /readyz が 200 になるまで待ち、
+    抜けると lifespan の終了処理まで待って止める
+    """
+
+    def __init__(self, app, host: str = "127.0.0.1"):
+        with socket.socket() as s:
+            s.bind((host, 0))
+            self.port = s.getsockname()[1]
+        self.base_url = f"http://{host}:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=self.port, log_level="warning",
+                                                   access_log=False))
+        self.thread = threading.Thread(target=self.server.run, name="uvicorn", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 120
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("アプリの起動に失敗しました")
+            time.sleep(0.05)
+        # 起動時の準備 (保存先のクライアント・推薦モデルの読み込みなど) が終わるまで待つ
+        while requests.get(self.base_url + "/readyz", timeout=10).status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError("アプリの準備が終わりませんでした")
+            time.sleep(0.05)
+        return self.base_url
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=60)
+
+
+def run_clients(base_url: str, workload: Workload, clients: int, duration: float, warmup: float):
+    """
+    clients 個のスレッドで duration 秒リクエストを送り、{名前: [(待ち時間, 状態コード)]} と計測した秒数を返す。
+    最初の warmup 秒の結果は捨てる
+    """
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def client(index: int):
+        rng = workload.rng(index)
+        http = requests.Session()
+        local = defaultdict(list)
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            name, method, path, params, body = workload.next(rng)
+            t = time.perf_counter()
+            try:
+                status = http.request(method, base_url + path, params=params, json=body, timeout=60).status_code
+            except requests.RequestException:
+                status = 0
+            if now >= measure_from:
+                local[name].append((time.perf_counter() - t, status))
+        with lock:
+            for name, values in local.items():
+                samples[name].extend(values)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - measure_from
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    results = {}
+    everything = []
+    for name in sorted(samples):
+        values = samples[name]
+        everything.extend(values)
+        summary = latency_summary([latency for latency, _ in values])
+        summary["errors"] = sum(1 for _, status in values if not 200 <= status < 300)
+        summary["requests_per_s"] = len(values) / elapsed
+        results[name] = summary
+    total = latency_summary([latency for latency, _ in everything])
+    total["errors"] = sum(1 for _, status in everything if not 200 <= status < 300)
+    total["requests_per_s"] = len(everything) / elapsed
+    return {"endpoints": results, "total": total}
+
+
+def report(results: dict):
+    rows = list(results["endpoints"].items()) + [("total", results["total"])]
+    for name, s in rows:
+        if not s["count"]:
+            continue
+        print(f"{name:>16}: {s['count']:7d} 件  エラー {s['errors']:5d}  p50 {s['p50_ms']:8.2f} ms"
+              f"  p99 {s['p99_ms']:8.2f} ms  {s['requests_per_s']:8.1f} 件/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reviews", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--programs", type=int, default=None)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="保存先の1回の呼び出しごとの待ち時間 (秒)")
+    parser.add_argument("--site-delay", type=float, default=0.0, help="fixture_server の応答ごとの待ち時間 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="結果を保存する JSON のパス")
+    args = parser.parse_args()
+
+    data = SyntheticData(args.reviews, args.users, args.programs, seed=args.seed)
+    storage = install_storage(data, latency=args.latency)
+    prepare_models()
+    workload = Workload(data, data.titles(), MIX, seed=args.seed)
+
+    # HTTP エンジンだけでスクレイピングするので、Chrome は起動しない
+    app_main.init_browser_pool = lambda: None
+    scraper.get_engine("http").fallback = None
+
+    site = FixtureServer(delay=args.site_delay)
+    with site as site_url:
+        config.BANGUMI_BASE_URL = site_url
+        with AppServer(app_main.app) as base_url:
+            print(f"clients={args.clients} duration={args.duration}s warmup={args.warmup}s "
+                  f"latency={args.latency}s site_delay={args.site_delay}s")
+            samples, elapsed = run_clients(base_url, workload, args.clients, args.duration, args.warmup)
+
+    results = summarize(samples, elapsed)
+    results["storage_calls"] = storage.calls
+    results["site_requests"] = dict(site.requests)
+    report(results)
+    if args.out:
+        save_results(args.out, "load_test", results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# benchmarks/memory_storage.py
+"""
+database.py の保存先 (storage.Storage) をメモリ上の dict で実装したもの (ベンチマーク・負荷試験用)。
+storage.set_storage(MemoryStorage()) で差し替えると、Datastore も SQLite も使わずにアプリ全体を動かせる。
+latency を指定すると、1回の呼び出しごとにその秒数だけ待つ (Datastore の往復時間の代わり)。
+レビュー1件あたり数百バイトを使うので、数百万件までを目安にする。
+"""
+import bisect
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import RECORD_KINDS, RatingBatch, Storage, dedupe_records, to_utc_naive  # noqa: E402
+
+_REVIEW_FIELDS = ("review_id", "program_id", "program_title", "user_id", "rating", "review_text", "created_at")
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.RLock()
+        self._users = {}            # user_id -> user_name
+        self._reviews = {}          # review_id -> レビュー
+        self._by_program = {}       # program_id -> [(created_at, review_id)] (古い順。後ろから読む)
+        self._by_user = {}          # user_id -> [review_id]
+        self._favorites = {}        # user_id -> {program_id: None} (登録順)
+        self._programs = {}         # program_id -> 番組
+        self._watermarks = {}
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    # -------------------
+    # ユーザー関連
+    # -------------------
+    def create_user(self, user_id: str, user_name: str):
+        self._call()
+        with self._lock:
+            if user_id in self._users:
+                return (user_id, self._users[user_id], False)
+            self._users[user_id] = user_name
+            return (user_id, user_name, True)
+
+    def get_user(self, user_id: str):
+        self._call()
+        name = self._users.get(user_id)
+        return (user_id, name) if name is not None else None
+
+    # -------------------
+    # 書き込み
+    # -------------------
+    def put_records(self, records: List[tuple]):
+        self._call()
+        with self._lock:
+            for kind, fields in dedupe_records(records):
+                if kind == "user":
+                    self._users[fields["user_id"]] = fields["user_name"]
+                elif kind == "review":
+                    self._put_review(fields)
+                elif kind == "favorite":
+                    self._favorites.setdefault(fields["user_id"], {})[fields["program_id"]] = None
+                else:
+                    raise ValueError(f"Unknown record kind: {kind}")
+
+    def _put_review(self, fields: dict):
+        review = {name: fields.get(name) for name in _REVIEW_FIELDS}
+        review["created_at"] = to_utc_naive(review["created_at"] or datetime.utcnow())
+        review_id = review["review_id"]
+        if review_id in self._reviews:
+            self._remove_review(self._reviews[review_id])
+        self._reviews[review_id] = review
+        bisect.insort(self._by_program.setdefault(review["program_id"], []), self._order(review))
+        self._by_user.setdefault(review["user_id"], []).append(review_id)
+
+    def _remove_review(self, review: dict):
+        self._by_program[review["program_id"]].remove(self._order(review))
+        self._by_user[review["user_id"]].remove(review["review_id"])
+
+    @staticmethod
+    def _order(review: dict):
+        return (review["created_at"], review["review_id"])
+
+    def _newest(self, program_id: str, offset: int = 0, limit: int = None):
+        # created_at DESC, review_id DESC の順に offset 件目から limit 件
+        entries = self._by_program.get(program_id, [])
+        end = len(entries) - offset
+        start = 0 if limit is None else max(0, end - limit)
+        return [dict(self._reviews[review_id]) for _, review_id in reversed(entries[start:max(0, end)])]
+
+    def bulk_load(self, users=(), reviews=(), favorites=(), programs=()):
+        """
+        合成データをまとめて入れる (put_records より速い。latency は掛けない)
+        """
+        with self._lock:
+            for user in users:
+                self._users[user["user_id"]] = user["user_name"]
+            for review in reviews:
+                review = {name: review.get(name) for name in _REVIEW_FIELDS}
+                review["created_at"] = to_utc_naive(review["created_at"])
+                self._reviews[review["review_id"]] = review
+                self._by_program.setdefault(review["program_id"], []).append(self._order(review))
+                self._by_user.setdefault(review["user_id"], []).append(review["review_id"])
+            for entries in self._by_program.values():
+                entries.sort()
+            for favorite in favorites:
+                self._favorites.setdefault(favorite["user_id"], {})[favorite["program_id"]] = None
+            self._upsert_programs(programs)
+
+    # -------------------
+    # レビュー関連
+    # -------------------
+    def get_reviews_by_program(self, program_id: str) -> List[dict]:
+        self._call()
+        with self._lock:
+            return self._newest(program_id)
+
+    def get_review_page(self, program_id: str, limit: int, cursor: Optional[str] = None):
+        self._call()
+        try:
+            offset = int(cursor) if cursor is not None else 0
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        with self._lock:
+            rows = self._newest(program_id, offset, limit)
+            more = offset + limit < len(self._by_program.get(program_id, ()))
+        return rows, (str(offset + limit) if more else None)
+
+    def get_user_ratings(self, user_id: str) -> List[tuple]:
+        self._call()
+        with self._lock:
+            reviews = [self._reviews[review_id] for review_id in self._by_user.get(user_id, ())]
+        return [(review["program_id"], review["rating"]) for review in reviews]
+
+    # -------------------
+    # お気に入り関連
+    # -------------------
+    def get_favorites(self, user_id: str) -> List[str]:
+        self._call()
+        with self._lock:
+            return list(self._favorites.get(user_id, ()))
+
+    # -------------------
+    # 番組関連
+    # -------------------
+    def upsert_programs(self, programs: List[dict]):
+        self._call()
+        with self._lock:
+            self._upsert_programs(programs)
+
+    def _upsert_programs(self, programs):
+        for p in programs:
+            self._programs[p["program_id"]] = {
+                'program_id': p["program_id"],
+                'url': p.get("url"),
+                'title': p.get("title"),
+                'supplement': p.get("supplement"),
+                'cast_names': list(p.get("cast_names") or []),
+                'updated_at': to_utc_naive(p.get("scraped_at") or p.get("updated_at") or datetime.utcnow()),
+            }
+
+    def get_programs(self, program_ids: List[str]) -> Dict[str, dict]:
+        self._call()
+        with self._lock:
+            return {pid: dict(self._programs[pid]) for pid in program_ids if pid in self._programs}
+
+    def scan_programs(self, batch_size: int = 1000):
+        with self._lock:
+            programs = list(self._programs.values())
+        for i in range(0, len(programs), batch_size):
+            self._call()
+            yield [dict(p) for p in programs[i:i + batch_size]]
+
+    # -------------------
+    # 読み込み (集計・学習・エクスポート用)
+    # -------------------
+    def _reviews_in_order(self):
+        with self._lock:
+            reviews = list(self._reviews.values())
+        reviews.sort(key=lambda r: (r["created_at"], r["review_id"]))
+        return reviews
+
+    def iter_review_events(self):
+        self._call()
+        with self._lock:
+            reviews = list(self._reviews.values())
+        for r in reviews:
+            yield (r["review_id"], r["program_id"], r["program_title"], r["created_at"])
+
+    def scan_ratings(self, batch_size: int = 1000, since: Optional[datetime] = None):
+        reviews = self._reviews_in_order()
+        if since is not None:
+            since = to_utc_naive(since)
+            reviews = reviews[bisect.bisect_right([r["created_at"] for r in reviews], since):]
+        for i in range(0, len(reviews), batch_size):
+            self._call()
+            chunk = [r for r in reviews[i:i + batch_size] if r["user_id"] and r["program_id"] and r["rating"]]
+            if chunk:
+                yield RatingBatch([r["user_id"] for r in chunk], [r["program_id"] for r in chunk],
+                                  np.asarray([r["rating"] for r in chunk], dtype=np.float32),
+                                  reviews[min(i + batch_size, len(reviews)) - 1]["created_at"],
+                                  [r["review_id"] for r in chunk], [r["created_at"] for r in chunk])
+
+    def scan_rows(self, kind: str, batch_size: int = 1000, cursor: Optional[str] = None):
+        if kind not in RECORD_KINDS:
+            raise ValueError(f"Unknown record kind: {kind}")
+        with self._lock:
+            if kind == "user":
+                rows = [{"user_id": u, "user_name": n} for u, n in sorted(self._users.items())]
+            elif kind == "review":
+                rows = [dict(self._reviews[r]) for r in sorted(self._reviews)]
+            else:
+                rows = [{"user_id": u, "program_id": p} for u in sorted(self._favorites)
+                        for p in sorted(self._favorites[u])]
+        start = int(cursor) if cursor is not None else 0
+        for i in range(start, len(rows), batch_size):
+            self._call()
+            more = i + batch_size < len(rows)
+            yield rows[i:i + batch_size], (str(i + batch_size) if more else None)
+
+    def get_watermark(self, name: str) -> Optional[datetime]:
+        self._call()
+        return self._watermarks.get(name)
+
+    def set_watermark(self, name: str, created_at: datetime):
+        self._call()
+        self._watermarks[name] = created_at
@@ -0,0 +1,70 @@
+# benchmarks/results.py
+"""
+ベンチマークの結果を JSON に保存する (compare_results.py で2回分を比べる)。
+結果と一緒に、コミット・日時・Python・OS・CPU 数・コマンドライン引数を書く。
+数値のキー名は、小さいほど良いものを *_ms / *_s、大きいほど良いものを *_per_s にする。
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def save_results(path, benchmark: str, results: dict, args=None) -> dict:
+    """
+    {"benchmark", "meta", "args", "results"} を path に書き、書いた内容を返す
+    """
+    document = {
+        "benchmark": benchmark,
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "argv": sys.argv,
+        },
+        "args": vars(args) if args is not None else {},
+        "results": results,
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(document, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+    print(f"結果を保存しました: {path}")
+    return document
+
+
+def load_results(path) -> dict:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def latency_summary(latencies) -> dict:
+    """
+    待ち時間 (秒) のリストを件数・平均・p50・p90・p99・最大 (ミリ秒) にまとめる
+    """
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0}
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+
+    return {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": latencies[-1] * 1000,
+    }
@@ -0,0 +1,167 @@
+# benchmarks/synthetic.py
+"""
+ベンチマーク・負荷試験用の合成データ (ユーザー・番組・レビュー・お気に入り) を作る。
+レビューの評価は bench_training と同じくユーザー・番組の潜在因子から作り、番組の人気には偏り (Zipf) を付ける。
+番組のタイトル・補足・出演者は bench_content と同じ作り方。投稿日時は直近 --days 日に散らばる。
+1万件から1000万件まで、チャンクごとに作るので、NDJSON への書き出しはメモリをほとんど使わない。
+(MemoryStorage に入れる場合はレビュー100万件あたり 1GB 程度を使う)
+
+    cd backend
+    # bulk_io.py のインポート形式 (NDJSON) で書き出す
+    python benchmarks/synthetic.py --reviews 1000000 --out data/synthetic
+    python bulk_io.py import reviews data/synthetic/reviews.ndjson
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_content import make_programs  # noqa: E402
+from bench_training import make_ratings  # noqa: E402
+
+WORDS = ["面白かった", "感動した", "また見たい", "微妙だった", "出演者が良い", "展開が早い", "録画した", "家族で見た"]
+
+
+class SyntheticData:
+    """
+    reviews 件のレビューと、それに合う数のユーザー・番組を作る。
+    users / programs を省くとレビュー数から決める (1ユーザーあたり約10件・1番組あたり約50件)
+    """
+
+    def __init__(self, reviews: int, users: int = None, programs: int = None, favorites_per_user: float = 2.0,
+                 days: float = 30.0, seed: int = 0, base_url: str = "https://bangumi.org",
+                 chunk_size: int = 100_000):
+        self.n_reviews = reviews
+        self.n_users = users or max(10, reviews // 10)
+        self.n_programs = programs or max(10, reviews // 50)
+        self.favorites_per_user = favorites_per_user
+        self.days = days
+        self.seed = seed
+        self.base_url = base_url
+        self.chunk_size = chunk_size
+        self.now = datetime.utcnow().replace(microsecond=0)
+
+    def user_ids(self):
+        return [f"user{u}" for u in range(self.n_users)]
+
+    def program_ids(self):
+        return [f"program{i}" for i in range(self.n_programs)]
+
+    def users(self):
+        for chunk_start in range(0, self.n_users, self.chunk_size):
+            yield [{"user_id": f"user{u}", "user_name": f"ユーザー{u}"}
+                   for u in range(chunk_start, min(self.n_users, chunk_start + self.chunk_size))]
+
+    def programs(self):
+        programs = make_programs(self.n_programs, n_genres=max(1, min(50, self.n_programs // 20)),
+                                 n_cast=max(10, self.n_programs // 5), seed=self.seed)
+        for chunk_start in range(0, len(programs), self.chunk_size):
+            chunk = programs[chunk_start:chunk_start + self.chunk_size]
+            for p in chunk:
+                p["url"] = f"{self.base_url}/tv_events/{p['program_id']}"
+                p["scraped_at"] = self.now
+            yield chunk
+
+    def titles(self):
+        return {p["program_id"]: p["title"] for chunk in self.programs() for p in chunk}
+
+    def reviews(self, titles: dict = None):
+        """
+        レビューを chunk_size 件ずつのリストで返す (古い順)
+        """
+        user_codes, item_codes, ratings, user_ids, item_ids = make_ratings(
+            self.n_reviews, self.n_users, self.n_programs, seed=self.seed)
+        rng = np.random.default_rng(self.seed + 1)
+        seconds = np.sort(rng.uniform(0, self.days * 86400, self.n_reviews))[::-1]
+        words = np.array(WORDS)
+        for chunk_start in range(0, self.n_reviews, self.chunk_size):
+            chunk_end = min(self.n_reviews, chunk_start + self.chunk_size)
+            texts = words[rng.integers(0, len(WORDS), chunk_end - chunk_start)]
+            chunk = []
+            for offset, i in enumerate(range(chunk_start, chunk_end)):
+                pid = item_ids[item_codes[i]]
+                chunk.append({
+                    "review_id": f"review{i:09d}",
+                    "program_id": pid,
+                    "program_title": titles.get(pid) if titles else None,
+                    "user_id": user_ids[user_codes[i]],
+                    "rating": int(ratings[i]),
+                    "review_text": str(texts[offset]),
+                    "created_at": self.now - timedelta(seconds=float(seconds[i])),
+                })
+            yield chunk
+
+    def favorites(self):
+        rng = np.random.default_rng(self.seed + 2)
+        n_favorites = int(self.n_users * self.favorites_per_user)
+        for chunk_start in range(0, n_favorites, self.chunk_size):
+            size = min(n_favorites - chunk_start, self.chunk_size)
+            user_codes = rng.integers(0, self.n_users, size)
+            item_codes = (rng.zipf(1.2, size) - 1) % self.n_programs
+            yield [{"user_id": f"user{u}", "program_id": f"program{i}"} for u, i in zip(user_codes, item_codes)]
+
+    def load_into(self, storage):
+        """
+        MemoryStorage.bulk_load でまとめて入れる
+        """
+        titles = self.titles()
+        for chunk in self.programs():
+            storage.bulk_load(programs=chunk)
+        for chunk in self.users():
+            storage.bulk_load(users=chunk)
+        for chunk in self.reviews(titles):
+            storage.bulk_load(reviews=chunk)
+        for chunk in self.favorites():
+            storage.bulk_load(favorites=chunk)
+        return storage
+
+    def write_ndjson(self, out_dir):
+        """
+        bulk_io.py import で読める NDJSON (users / reviews / favorites) と、番組の NDJSON を書き出す
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        titles = self.titles()
+        counts = {}
+        for name, chunks in (("users", self.users()), ("programs", self.programs()),
+                             ("reviews", self.reviews(titles)), ("favorites", self.favorites())):
+            path = out_dir / f"{name}.ndjson"
+            counts[name] = 0
+            with open(path, "w", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.writelines(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in chunk)
+                    counts[name] += len(chunk)
+        return counts
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reviews", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--programs", type=int, default=None)
+    parser.add_argument("--favorites-per-user", type=float, default=2.0)
+    parser.add_argument("--days", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic")
+    args = parser.parse_args()
+
+    data = SyntheticData(args.reviews, args.users, args.programs, args.favorites_per_user, args.days, args.seed)
+    start = time.perf_counter()
+    counts = data.write_ndjson(args.out)
+    print(f"{args.out}: {counts} ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# browser_pool.py
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import span
+
+
+class PoolExhaustedError(Exception):
+    """
+    全ブラウザが使用中で、待ち時間内に空きが出なかったときに送出する
+    """
+
+
+class BrowserWorker:
+    """
+    WebDriver を1つ保持し、読み込んだページ数などの状態を管理する。
+    driver の属性はそのまま委譲するので、呼び出し側は driver と同じように扱える。
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.broken = False
+        self.created_at = time.monotonic()
+        self.page_load_timeout = None
+
+    def get(self, url: str):
+        self.pages += 1
+        self.driver.get(url)
+
+    def set_page_load_timeout(self, seconds: float):
+        # 読み込みごとに期限に合わせて変えるので、前回と同じなら WebDriver に送らない
+        if seconds != self.page_load_timeout:
+            self.driver.set_page_load_timeout(seconds)
+            self.page_load_timeout = seconds
+
+    def is_alive(self) -> bool:
+        """
+        ブラウザが応答するかを確認する (ヘルスチェック)
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            self.driver.execute_script("return 1")
+            return True
+        except WebDriverException:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            print(f"ブラウザの終了に失敗しました: {e}")
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class BrowserPool:
+    """
+    起動済みの WebDriver を使い回すためのプール。
+    - size 個のブラウザをアプリ起動時に立ち上げる
+    - max_pages ページ読み込んだブラウザ、クラッシュしたブラウザは作り直す
+    - 全て使用中なら acquire_timeout 秒まで待ち、それでも空かなければ PoolExhaustedError
+    """
+
+    def __init__(self, driver_factory, size: int = 2, max_pages: int = 50,
+                 acquire_timeout: float = 10.0):
+        self._driver_factory = driver_factory
+        self.size = size
+        self.max_pages = max_pages
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.in_use = 0
+        self.recycled = 0
+
+    def start(self):
+        for _ in range(self.size):
+            self._idle.put(self._new_worker())
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.quit()
+
+    @contextmanager
+    def borrow(self, timeout: float = None):
+        """
+        プールからブラウザを1つ借りる。with ブロックを抜けると返却される。
+        """
+        # selenium の読み込みは、ブラウザを実際に使うまで遅らせる
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        worker = self._acquire(self.acquire_timeout if timeout is None else timeout)
+        try:
+            yield worker
+        except TimeoutException:
+            # 読み込みのタイムアウトはブラウザの故障とはみなさない
+            raise
+        except WebDriverException:
+            worker.broken = True
+            raise
+        finally:
+            self._release(worker)
+
+    def _new_worker(self) -> BrowserWorker:
+        return BrowserWorker(self._driver_factory())
+
+    def _acquire(self, timeout: float) -> BrowserWorker:
+        if self._closed:
+            raise PoolExhaustedError("Browser pool is closed.")
+        try:
+            with span("browser.acquire"):
+                worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolExhaustedError(f"No browser became available within {timeout} seconds.")
+        with self._lock:
+            self.in_use += 1
+        if worker.broken or not worker.is_alive():
+            try:
+                worker = self._recycle(worker)
+            except Exception:
+                # 枠を失わないよう、壊れたままプールに戻してから送出する
+                worker.broken = True
+                with self._lock:
+                    self.in_use -= 1
+                self._idle.put(worker)
+                raise
+        return worker
+
+    def _release(self, worker: BrowserWorker):
+        with self._lock:
+            self.in_use -= 1
+        if self._closed:
+            worker.quit()
+            return
+        if worker.broken or worker.pages >= self.max_pages:
+            try:
+                worker = self._recycle(worker)
+            except Exception as e:
+                # 作り直しに失敗した場合は次回の取得時に再度作り直す
+                print(f"ブラウザの再起動に失敗しました: {e}")
+                worker.broken = True
+        self._idle.put(worker)
+
+    def _recycle(self, worker: BrowserWorker) -> BrowserWorker:
+        worker.quit()
+        with self._lock:
+            self.recycled += 1
+        return self._new_worker()
@@ -0,0 +1,535 @@
+# bulk_io.py
+"""
+レビュー・ユーザー・お気に入りの一括インポート / エクスポート。
+
+    python bulk_io.py import reviews reviews.parquet --checkpoint reviews.ckpt
+    python bulk_io.py export favorites out/favorites --format ndjson
+    python bulk_io.py training-matrix out/ratings
+
+形式は NDJSON (1行1件の JSON) と Parquet (pyarrow が必要)。
+インポートは database.put_records でまとめて保存し、エクスポートはカーソルで少しずつ読む。
+どちらもチェックポイントファイルを指定すると、中断したところから再開できる。
+"""
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import database
+from storage import to_utc_naive
+
+# 種類ごとのレコードの種類 (database.put_records の kind) と列 (列の型は Parquet のスキーマに使う)
+KINDS = {
+    "reviews": ("review", [("review_id", "string"), ("program_id", "string"), ("program_title", "string"),
+                           ("user_id", "string"), ("rating", "int32"), ("review_text", "string"),
+                           ("created_at", "timestamp")]),
+    "users": ("user", [("user_id", "string"), ("user_name", "string")]),
+    "favorites": ("favorite", [("user_id", "string"), ("program_id", "string")]),
+}
+FORMATS = ("ndjson", "parquet")
+_listeners = []
+
+
+class BulkError(Exception):
+    """
+    入力ファイルやチェックポイントが不正なときに送出する
+    """
+
+
+# -------------------
+# 行の変換
+# -------------------
+def _parse_datetime(value):
+    """
+    created_at を datetime にする (タイムゾーンはそのまま。保存前に to_utc_naive で UTC の naive にそろえる)
+    """
+    if value is None or value == "":
+        return datetime.utcnow()
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def to_record(kind: str, row: dict):
+    """
+    インポートする1行を database.put_records に渡す (kind, fields) にする
+    """
+    try:
+        if kind == "users":
+            return ("user", {"user_id": str(row["user_id"]), "user_name": row.get("user_name") or ""})
+        if kind == "favorites":
+            return ("favorite", {"user_id": str(row["user_id"]), "program_id": str(row["program_id"])})
+        parsed = _parse_datetime(row.get("created_at"))
+        review_id = row.get("review_id")
+        if not review_id:
+            # 再実行しても同じレビューが二重にできないよう、内容から決まる ID にする
+            # (以前にインポートしたレビューと同じ ID になるよう、UTC にそろえる前の値から作る)
+            review_id = str(uuid.uuid5(uuid.NAMESPACE_URL,
+                                       f"{row['user_id']}/{row['program_id']}/{parsed.isoformat()}"))
+        # 保存先・差分読み込み・カーソルでは created_at を UTC の naive な datetime として比べる
+        created_at = to_utc_naive(parsed)
+        return ("review", {
+            "review_id": str(review_id),
+            "program_id": str(row["program_id"]),
+            "program_title": row.get("program_title") or "",
+            "user_id": str(row["user_id"]),
+            "rating": int(row["rating"]),
+            "review_text": row.get("review_text") or "",
+            "created_at": created_at,
+        })
+    except (KeyError, TypeError, ValueError) as e:
+        raise BulkError(f"{kind} の行が不正です ({e.__class__.__name__}: {e}): {row}")
+
+
+# -------------------
+# 読み込み・書き出し
+# -------------------
+def detect_format(path) -> str:
+    path = Path(path)
+    if path.is_dir():
+        files = _part_files(path)
+        if not files:
+            raise BulkError(f"{path} に読み込めるファイルがありません")
+        path = files[0]
+    if path.suffix in (".parquet", ".pq"):
+        return "parquet"
+    if path.suffix in (".ndjson", ".jsonl", ".json"):
+        return "ndjson"
+    raise BulkError(f"形式を判定できません: {path} (--format を指定してください)")
+
+
+def _part_files(directory: Path):
+    return sorted(p for p in directory.iterdir()
+                  if p.suffix in (".parquet", ".pq", ".ndjson", ".jsonl", ".json"))
+
+
+def read_batches(path, fmt: str = None, batch_size: int = 500):
+    """
+    ファイル (またはディレクトリ内の part ファイル) を batch_size 行ずつのリストで返す
+    """
+    path = Path(path)
+    fmt = fmt or detect_format(path)
+    files = _part_files(path) if path.is_dir() else [path]
+    batch = []
+    for file in files:
+        for row in (_read_parquet(file, batch_size) if fmt == "parquet" else _read_ndjson(file)):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def iter_ndjson_lines(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise BulkError(f"{number}行目の JSON が不正です: {e}")
+
+
+def _read_ndjson(path: Path):
+    with open(path, encoding="utf-8") as f:
+        yield from iter_ndjson_lines(f)
+
+
+def _read_parquet(path, batch_size: int):
+    import pyarrow.parquet as pq
+
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from record_batch.to_pylist()
+
+
+def _arrow_schema(kind: str):
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "int32": pa.int32(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[type_name]) for name, type_name in KINDS[kind][1]])
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def to_ndjson(rows) -> bytes:
+    return "".join(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows).encode()
+
+
+def write_rows(path: Path, kind: str, rows, fmt: str):
+    """
+    rows を1つのファイルに書き出す (一時ファイルに書いてから置き換える)
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = [name for name, _ in KINDS[kind][1]]
+        table = pa.Table.from_pylist([{c: row.get(c) for c in columns} for row in rows],
+                                     schema=_arrow_schema(kind))
+        pq.write_table(table, tmp)
+    else:
+        with open(tmp, "wb") as f:
+            f.write(to_ndjson(rows))
+    os.replace(tmp, path)
+
+
+# -------------------
+# チェックポイント
+# -------------------
+def _load_checkpoint(path):
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_checkpoint(path, state: dict):
+    if not path:
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# -------------------
+# インポート
+# -------------------
+def add_listener(fn):
+    """
+    一括インポートで1バッチ保存するたびに fn(kind, records) を呼ぶ (records は保存した fields のリスト)。
+    通常の書き込みと同じく、キャッシュ・索引・集計に反映するのに使う
+    """
+    _listeners.append(fn)
+
+
+def put_rows(kind: str, rows, retries: int = 3):
+    """
+    rows をまとめて保存する。失敗したら間隔を空けて retries 回まで再試行する。
+    インポートの全バッチを保存し終えたら finish_import(kind) を1回呼ぶ
+    """
+    records = [to_record(kind, row) for row in rows]
+    for attempt in range(retries + 1):
+        try:
+            database.put_records(records)
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"一括インポートの保存に失敗しました ({attempt + 1}回目, {delay:.1f}s後に再試行): {e}")
+            time.sleep(delay)
+    # 通知は保存できたバッチごとに1回だけ (再試行の対象にしない)
+    _notify(kind, [fields for _, fields in records])
+    return len(records)
+
+
+def finish_import(kind: str):
+    """
+    インポートの終わりに1回呼ぶ (途中で失敗した場合も、保存済みのバッチがあれば呼ぶ)。
+    レビューは created_at が古くても入るので、学習用のレビューを次の再学習で全件読み直させる
+    """
+    from training_data import mark_ratings_reset
+
+    if kind == "reviews":
+        mark_ratings_reset()
+
+
+def _notify(kind: str, records):
+    for fn in _listeners:
+        try:
+            fn(kind, records)
+        except Exception as e:
+            print(f"一括インポートの保存後の処理に失敗しました: {e}")
+
+
+def import_batches(kind: str, batches, workers: int = 4, checkpoint: str = None, batch_size: int = 500) -> int:
+    """
+    batches (行のリストのイテラブル) を workers 個のスレッドで並列に保存し、保存した行数を返す。
+    checkpoint には「先頭から何バッチ目まで保存できたか」を記録し、再実行時はそこから続ける
+    (保存は上書きなので、チェックポイントより後のバッチを二重に保存しても結果は変わらない)。
+    """
+    if kind not in KINDS:
+        raise BulkError(f"kind は {', '.join(KINDS)} のいずれかです: {kind}")
+    state = _load_checkpoint(checkpoint)
+    if state and (state.get("kind") != kind or state.get("batch_size") != batch_size):
+        raise BulkError(f"チェックポイント {checkpoint} は別の設定 ({state.get('kind')}, "
+                        f"batch_size={state.get('batch_size')}) のものです")
+    done = state.get("batches_done", 0)
+    imported = state.get("rows", 0)
+    if done:
+        print(f"チェックポイントから再開します ({done}バッチ, {imported}件保存済み)")
+
+    completed = {}
+    pending = {}
+    submitted = False
+
+    def collect(futures):
+        nonlocal done, imported
+        for future in futures:
+            index = pending.pop(future)
+            completed[index] = future.result()
+        advanced = False
+        while done in completed:
+            imported += completed.pop(done)
+            done += 1
+            advanced = True
+        if advanced:
+            _save_checkpoint(checkpoint, {"kind": kind, "batch_size": batch_size,
+                                          "batches_done": done, "rows": imported})
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-import") as executor:
+            try:
+                for index, rows in enumerate(batches):
+                    if index < done:
+                        continue
+                    pending[executor.submit(put_rows, kind, rows)] = index
+                    submitted = True
+                    if len(pending) >= workers * 2:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        # 実行中のバッチが終わってから (executor を抜けてから) 印を付ける
+        if submitted:
+            finish_import(kind)
+    return imported
+
+
+def import_file(kind: str, path, fmt: str = None, batch_size: int = 500, workers: int = 4,
+                checkpoint: str = None) -> int:
+    start = time.monotonic()
+    imported = import_batches(kind, read_batches(path, fmt, batch_size), workers=workers,
+                              checkpoint=checkpoint, batch_size=batch_size)
+    print(f"{kind} を {imported}件インポートしました ({time.monotonic() - start:.1f}s)")
+    return imported
+
+
+# -------------------
+# エクスポート
+# -------------------
+def iter_rows(kind: str, batch_size: int = 1000, cursor: str = None):
+    """
+    (行のリスト, 次のカーソル) を返す。次のページの読み込みは、呼び出し側が今のページを処理している間に行う
+    """
+    if kind not in KINDS:
+        raise BulkError(f"kind は {', '.join(KINDS)} のいずれかです: {kind}")
+    pages = database.scan_rows(KINDS[kind][0], batch_size=batch_size, cursor=cursor)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-export") as executor:
+        future = executor.submit(next, pages, None)
+        while True:
+            page = future.result()
+            if page is None:
+                return
+            future = executor.submit(next, pages, None)
+            yield page
+
+
+class _StreamSink:
+    """
+    ParquetWriter の書き込み先。書かれたバイト列を溜めておき、take() で取り出す
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_export(kind: str, fmt: str = "ndjson", batch_size: int = 1000):
+    """
+    kind の全件を fmt のバイト列として少しずつ返す (API のストリーミング応答用)。
+    Parquet はページごとに row group を1つ書く
+    """
+    if fmt not in FORMATS:
+        raise BulkError(f"format は {', '.join(FORMATS)} のいずれかです: {fmt}")
+    if fmt == "ndjson":
+        for rows, _ in iter_rows(kind, batch_size):
+            yield to_ndjson(rows)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(kind)
+    columns = [name for name, _ in KINDS[kind][1]]
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for rows, _ in iter_rows(kind, batch_size):
+        writer.write_table(pa.Table.from_pylist([{c: row.get(c) for c in columns} for row in rows],
+                                                schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def export_kind(kind: str, out_dir, fmt: str = "ndjson", batch_size: int = 1000,
+                rows_per_file: int = 100000, checkpoint: str = None) -> int:
+    """
+    kind の全件を out_dir/part-00000.<形式> ... に rows_per_file 行ずつ書き出し、書き出した行数を返す。
+    checkpoint には書き終えたファイル数とその後ろのカーソルを記録する
+    """
+    if fmt not in FORMATS:
+        raise BulkError(f"format は {', '.join(FORMATS)} のいずれかです: {fmt}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state = _load_checkpoint(checkpoint)
+    if state.get("finished"):
+        print(f"{kind} のエクスポートは完了済みです ({state['rows']}件)")
+        return state["rows"]
+    part = state.get("parts", 0)
+    exported = state.get("rows", 0)
+    cursor = state.get("cursor")
+    start = time.monotonic()
+    buffer = []
+
+    def flush(next_cursor):
+        nonlocal part, exported, buffer
+        write_rows(out_dir / f"part-{part:05d}.{fmt}", kind, buffer, fmt)
+        part += 1
+        exported += len(buffer)
+        buffer = []
+        _save_checkpoint(checkpoint, {"kind": kind, "parts": part, "rows": exported, "cursor": next_cursor})
+
+    for rows, next_cursor in iter_rows(kind, batch_size, cursor):
+        buffer.extend(rows)
+        if len(buffer) >= rows_per_file:
+            flush(next_cursor)
+    if buffer:
+        flush(None)
+    _save_checkpoint(checkpoint, {"kind": kind, "parts": part, "rows": exported, "finished": True})
+    print(f"{kind} を {exported}件エクスポートしました ({time.monotonic() - start:.1f}s)")
+    return exported
+
+
+# -------------------
+# 学習用の行列
+# -------------------
+def export_training_matrix(out_dir, batch_size: int = 1000) -> int:
+    """
+    全レビューの (user, program, rating) を out_dir に書き出す。
+    - user_codes.npy (int32) / program_codes.npy (int32) / ratings.npy (float32): np.load(mmap_mode="r") で読める
+    - user_ids.json / program_ids.json: コードから ID への対応表
+    """
+    from training_data import RatingsTable
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    table = RatingsTable(batch_size=batch_size)
+    table.refresh()
+    with table._lock:
+        columns = {"user_codes": table.user_codes, "program_codes": table.program_codes,
+                   "ratings": table.ratings}
+        vocab = {"user_ids": list(table.user_ids), "program_ids": list(table.program_ids)}
+    for name, array in columns.items():
+        tmp = out_dir / f".{name}.{os.getpid()}.tmp.npy"
+        np.save(tmp, array)
+        os.replace(tmp, out_dir / f"{name}.npy")
+    for name, values in vocab.items():
+        tmp = out_dir / f".{name}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(values, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, out_dir / f"{name}.json")
+    print(f"学習用の行列を書き出しました ({len(table)}件, {out_dir})")
+    return len(table)
+
+
+def load_training_matrix(path, mmap: bool = True):
+    """
+    export_training_matrix の出力を読む。
+    (user_codes, program_codes, ratings, user_ids, program_ids) を返し、配列はファイルを mmap したもの
+    """
+    path = Path(path)
+    mode = "r" if mmap else None
+    arrays = [np.load(path / f"{name}.npy", mmap_mode=mode)
+              for name in ("user_codes", "program_codes", "ratings")]
+    vocab = [json.loads((path / f"{name}.json").read_text(encoding="utf-8"))
+             for name in ("user_ids", "program_ids")]
+    return (*arrays, *vocab)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="レビュー・ユーザー・お気に入りの一括インポート / エクスポート")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="ファイルから保存先に保存する")
+    p.add_argument("kind", choices=list(KINDS))
+    p.add_argument("path", help="ファイル、または part ファイルの入ったディレクトリ")
+    p.add_argument("--format", choices=FORMATS)
+    p.add_argument("--batch-size", type=int, default=database.PUT_BATCH_SIZE)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--checkpoint")
+
+    p = commands.add_parser("export", help="保存先からファイルに書き出す")
+    p.add_argument("kind", choices=list(KINDS))
+    p.add_argument("out_dir")
+    p.add_argument("--format", choices=FORMATS, default="ndjson")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--rows-per-file", type=int, default=100000)
+    p.add_argument("--checkpoint")
+
+    p = commands.add_parser("training-matrix", help="学習用の (user, program, rating) を mmap できる形式で書き出す")
+    p.add_argument("out_dir")
+    p.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        import_file(args.kind, args.path, args.format, batch_size=min(args.batch_size, database.PUT_BATCH_SIZE),
+                    workers=args.workers, checkpoint=args.checkpoint)
+    elif args.command == "export":
+        export_kind(args.kind, args.out_dir, args.format, batch_size=args.batch_size,
+                    rows_per_file=args.rows_per_file, checkpoint=args.checkpoint)
+    else:
+        export_training_matrix(args.out_dir, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
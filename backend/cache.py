@@ -0,0 +1,236 @@
+# cache.py
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MemoryBackend:
+    """
+    プロセス内の LRU。max_size を超えたら最も古く使われたものから捨てる
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data.move_to_end(key)
+            return item
+
+    def set(self, key: str, value, stored_at: float):
+        with self._lock:
+            self._data[key] = (value, stored_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteBackend:
+    """
+    SQLite ファイルに保存する LRU。同じホストの複数ワーカーで共有でき、再起動後も残る。
+    値は JSON で保存するので、JSON にできる値だけを入れること。
+    """
+
+    def __init__(self, path: str, max_size: int = 1024, table: str = "cache"):
+        self.max_size = max_size
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)")
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value, stored_at: float):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False, default=str), stored_at, time.time()),
+            )
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "hit_rate": (self.hits + self.stale_hits + self.coalesced) / lookups if lookups else 0.0,
+            }
+
+
+# 期限切れエントリの裏での取り直しに使う
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+
+class TTLCache:
+    """
+    TTL 付きキャッシュ。
+    - ttl 秒以内のエントリはそのまま返す
+    - ttl を過ぎても stale_ttl 秒以内なら古い値を返しつつ、裏で取り直す (stale-while-revalidate)
+    - 同じキーへの同時リクエストは、実行中の1回の読み込み結果を共有する
+    """
+
+    def __init__(self, backend=None, ttl: float = 300.0, stale_ttl: float = 0.0, name: str = ""):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self.stats = CacheStats()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: str, loader, should_cache=None):
+        """
+        キャッシュにあれば返し、無ければ loader() を呼んで結果を保存してから返す。
+        should_cache(value) が False の結果は保存しない (途中までの結果など)。
+        """
+        item = self.backend.get(key)
+        if item is not None:
+            value, stored_at = item
+            age = time.time() - stored_at
+            if age <= self.ttl:
+                self.stats.incr("hits")
+                return value
+            if age <= self.ttl + self.stale_ttl:
+                self.stats.incr("stale_hits")
+                self._refresh_in_background(key, loader, should_cache)
+                return value
+
+        future, owner = self._join_or_start(key)
+        if not owner:
+            self.stats.incr("coalesced")
+            return future.result()
+        self.stats.incr("misses")
+        return self._load(key, future, loader, should_cache)
+
+    def put(self, key: str, value):
+        """
+        読み込み済みの値を保存する (先読みなど)
+        """
+        self.backend.set(key, value, time.time())
+
+    def age(self, key: str):
+        """
+        保存してからの秒数。無ければ None
+        """
+        item = self.backend.get(key)
+        return None if item is None else time.time() - item[1]
+
+    def invalidate(self, key: str):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def info(self) -> dict:
+        info = self.stats.as_dict()
+        info.update({"size": len(self.backend), "ttl": self.ttl, "stale_ttl": self.stale_ttl})
+        return info
+
+    def _join_or_start(self, key: str):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _load(self, key: str, future: Future, loader, should_cache):
+        try:
+            value = loader()
+        except BaseException as e:
+            self.stats.incr("errors")
+            future.set_exception(e)
+            raise
+        else:
+            if should_cache is None or should_cache(value):
+                self.backend.set(key, value, time.time())
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key: str, loader, should_cache):
+        future, owner = self._join_or_start(key)
+        if not owner:
+            return  # すでに取り直し中
+        self.stats.incr("refreshes")
+
+        def refresh():
+            try:
+                self._load(key, future, loader, should_cache)
+            except Exception as e:
+                print(f"キャッシュの更新に失敗しました ({self.name} {key}): {e}")
+
+        _refresh_executor.submit(refresh)
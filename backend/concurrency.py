@@ -0,0 +1,86 @@
+# concurrency.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OverloadedError(Exception):
+    """
+    エンドポイントの同時実行数の上限に達し、待ち時間内に空きが出なかったときに送出する
+    """
+
+
+class BoundedExecutor:
+    """
+    ブロッキング処理 (Selenium, Datastore など) を実行するスレッドプール。
+    種類ごとに分けることで、遅いスクレイピングが Datastore の処理を詰まらせないようにする。
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        # 実行中・実行待ちの数
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix=self.name)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, /, *args, **kwargs):
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+
+class ConcurrencyLimit:
+    """
+    エンドポイントの種類ごとの同時実行数の上限。
+    上限に達している場合は wait_timeout 秒まで待ち、それでも空かなければ OverloadedError。
+    """
+
+    def __init__(self, name: str, limit: int, wait_timeout: float = 5.0):
+        self.name = name
+        self.limit = limit
+        self.wait_timeout = wait_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise OverloadedError(f"Too many concurrent {self.name} requests.")
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+async def run_limited(limit: ConcurrencyLimit, executor: BoundedExecutor, fn, /, *args, **kwargs):
+    """
+    limit の枠を取ってから、executor で fn を実行する
+    """
+    async with limit:
+        return await executor.run(fn, *args, **kwargs)
@@ -0,0 +1,226 @@
+# config.py
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# -------------------
+# ブラウザプール関連
+# -------------------
+# プールの headless Chrome の数 (WARMUP_BROWSER_POOL=1 なら起動時に立ち上げる)
+BROWSER_POOL_SIZE = _env_int("BROWSER_POOL_SIZE", 2)
+# 1つのブラウザで読み込むページ数の上限 (超えたら作り直す)
+BROWSER_MAX_PAGES = _env_int("BROWSER_MAX_PAGES", 50)
+# 全ブラウザが使用中のとき、空きを待つ最大秒数
+BROWSER_ACQUIRE_TIMEOUT = _env_float("BROWSER_ACQUIRE_TIMEOUT", 10.0)
+# ページ読み込みのタイムアウト秒数
+BROWSER_PAGE_LOAD_TIMEOUT = _env_int("BROWSER_PAGE_LOAD_TIMEOUT", 30)
+
+# -------------------
+# スクレイピング関連
+# -------------------
+# /search で返す件数の既定値と上限
+SEARCH_DEFAULT_RESULTS = _env_int("SEARCH_DEFAULT_RESULTS", 3)
+SEARCH_MAX_RESULTS = _env_int("SEARCH_MAX_RESULTS", 20)
+# 1つの検索で同時に読み込む詳細ページ数の上限
+SCRAPE_MAX_CONCURRENCY = _env_int("SCRAPE_MAX_CONCURRENCY", 3)
+# 1つの検索にかけてよい秒数。超えたらそれまでに取れた結果だけを返す
+SCRAPE_DEADLINE = _env_float("SCRAPE_DEADLINE", 20.0)
+# スクレイピング方式: selenium (headless Chrome) / http (HTTP + HTML パーサ)
+SCRAPER_ENGINE = os.getenv("SCRAPER_ENGINE", "selenium")
+# スクレイピング対象のサイト (ベンチマークではローカルのサーバーに向ける)
+BANGUMI_BASE_URL = os.getenv("BANGUMI_BASE_URL", "https://bangumi.org").rstrip("/")
+# http エンジン: 1ホストあたりの接続数上限とタイムアウト秒数
+HTTP_MAX_CONNECTIONS_PER_HOST = _env_int("HTTP_MAX_CONNECTIONS_PER_HOST", 10)
+HTTP_TIMEOUT = _env_float("HTTP_TIMEOUT", 10.0)
+# 検索対象の地域コード (23 = 東京)
+BANGUMI_AREA_CODE = os.getenv("BANGUMI_AREA_CODE", "23")
+
+# -------------------
+# 検索結果キャッシュ
+# -------------------
+# この秒数までは取り直さずに返す
+SEARCH_CACHE_TTL = _env_float("SEARCH_CACHE_TTL", 600.0)
+# TTL を過ぎてもこの秒数までは古い結果を返しつつ、裏で取り直す
+SEARCH_CACHE_STALE_TTL = _env_float("SEARCH_CACHE_STALE_TTL", 3600.0)
+# 保持するクエリ数の上限 (LRU)
+SEARCH_CACHE_SIZE = _env_int("SEARCH_CACHE_SIZE", 256)
+# memory (プロセス内) / sqlite (ファイルに保存し、ワーカー間で共有)
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.db")
+
+# -------------------
+# 検索の索引 (保存済みの番組・レビューの全文検索)
+# -------------------
+# 0 にすると /search は常にスクレイピングする
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "1") != "0"
+# 索引の番組がこの秒数より古ければスクレイピングし直す
+SEARCH_INDEX_MAX_AGE = _env_float("SEARCH_INDEX_MAX_AGE", 21600.0)
+# クエリの bigram のうち、この割合以上を含む番組だけを一致とする
+SEARCH_INDEX_MIN_MATCH = _env_float("SEARCH_INDEX_MIN_MATCH", 0.8)
+
+# -------------------
+# スクレイピングのジョブ (よく検索されるクエリと古くなった番組の先読み)
+# -------------------
+# 0 にすると先読みしない (/search のときだけスクレイピングする)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+# ジョブの状態と検索されたクエリの回数を保存するファイル
+SCHEDULER_PATH = os.getenv("SCHEDULER_PATH", "scrape_jobs.db")
+# ジョブを実行するスレッド数
+SCHEDULER_WORKERS = _env_int("SCHEDULER_WORKERS", 1)
+# ジョブが1ホストから読み込むページ数の上限 (件/秒) と、まとめて読み込める数
+SCHEDULER_RATE_LIMIT = _env_float("SCHEDULER_RATE_LIMIT", 0.5)
+SCHEDULER_RATE_BURST = _env_float("SCHEDULER_RATE_BURST", 5.0)
+# 失敗したジョブの再試行: 最大回数と、待ち秒数の基準・上限 (指数バックオフ + ジッター)
+SCHEDULER_MAX_ATTEMPTS = _env_int("SCHEDULER_MAX_ATTEMPTS", 5)
+SCHEDULER_RETRY_BASE = _env_float("SCHEDULER_RETRY_BASE", 30.0)
+SCHEDULER_RETRY_MAX = _env_float("SCHEDULER_RETRY_MAX", 3600.0)
+# 先読みのジョブを追加する間隔 (秒)
+SCHEDULER_PLAN_INTERVAL = _env_float("SCHEDULER_PLAN_INTERVAL", 300.0)
+# 先読みするクエリ数 (検索回数の多い順) と、1回に取り直す番組数
+SCHEDULER_PREFETCH_QUERIES = _env_int("SCHEDULER_PREFETCH_QUERIES", 20)
+SCHEDULER_REFRESH_PROGRAMS = _env_int("SCHEDULER_REFRESH_PROGRAMS", 20)
+# キャッシュの TTL・索引の SEARCH_INDEX_MAX_AGE のこの割合を過ぎたら取り直す
+SCHEDULER_REFRESH_MARGIN = _env_float("SCHEDULER_REFRESH_MARGIN", 0.8)
+# 検索回数を半分に減衰させる時間
+SCHEDULER_QUERY_HALF_LIFE_HOURS = _env_float("SCHEDULER_QUERY_HALF_LIFE_HOURS", 24.0)
+
+# -------------------
+# 計測 (GET /metrics とプロファイラ)
+# -------------------
+# 0 にすると段階ごとの時間・リクエストの待ち時間を記録しない
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# 1 にすると X-Profile ヘッダーの付いたリクエストをサンプリングプロファイラで記録する
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# プロファイルの書き出し先と、スタックを読む間隔 (秒)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = _env_float("PROFILE_INTERVAL", 0.005)
+
+# -------------------
+# 番組カタログ
+# -------------------
+# Datastore の Program の前に置くプロセス内キャッシュの件数
+PROGRAM_CACHE_SIZE = _env_int("PROGRAM_CACHE_SIZE", 5000)
+
+# -------------------
+# 推薦モデル
+# -------------------
+# 学習済みモデルの保存先。バージョンごとの model-<version>/ (配列ごとの .npy と meta.json。各 worker が mmap で共有する)、
+# 現在のバージョン名を書いた CURRENT、学習するプロセスを1つにするロック .train.lock を置く
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+MODEL_KEEP_VERSIONS = _env_int("MODEL_KEEP_VERSIONS", 3)
+# この秒数ごと、または新しいレビューがこの件数たまったら再学習する
+MODEL_RETRAIN_INTERVAL = _env_float("MODEL_RETRAIN_INTERVAL", 3600.0)
+MODEL_RETRAIN_AFTER_REVIEWS = _env_int("MODEL_RETRAIN_AFTER_REVIEWS", 50)
+# 0 にするとこのプロセスでは学習せず、他のプロセスが保存したモデルを読み込むだけ
+MODEL_TRAIN_IN_PROCESS = os.getenv("MODEL_TRAIN_IN_PROCESS", "1") != "0"
+# 行列分解 (ALS) の因子数・正則化・反復回数・学習スレッド数 (0 なら CPU 数)
+MODEL_FACTORS = _env_int("MODEL_FACTORS", 64)
+MODEL_REGULARIZATION = _env_float("MODEL_REGULARIZATION", 0.1)
+MODEL_ITERATIONS = _env_int("MODEL_ITERATIONS", 10)
+MODEL_TRAIN_WORKERS = _env_int("MODEL_TRAIN_WORKERS", 0)
+# 番組ベクトルの索引 (似ている番組・推薦候補)。番組数が ITEM_INDEX_MIN_ITEMS 未満なら全件を調べ、
+# それ以上は ITEM_INDEX_LISTS 個のセル (0 なら √番組数) に分けて ITEM_INDEX_PROBE 個のセルだけを調べる
+ITEM_INDEX_MIN_ITEMS = _env_int("ITEM_INDEX_MIN_ITEMS", 5000)
+ITEM_INDEX_LISTS = _env_int("ITEM_INDEX_LISTS", 0)
+ITEM_INDEX_PROBE = _env_int("ITEM_INDEX_PROBE", 8)
+# ユーザーごとに事前計算しておく推薦件数
+RECOMMENDATION_STORE_TOP_N = _env_int("RECOMMENDATION_STORE_TOP_N", 50)
+
+# -------------------
+# 内容に基づく推薦 (コールドスタート)
+# -------------------
+# 番組ベクトルでのテキスト (タイトル・補足) と出演者の重み
+CONTENT_TEXT_WEIGHT = _env_float("CONTENT_TEXT_WEIGHT", 0.5)
+CONTENT_CAST_WEIGHT = _env_float("CONTENT_CAST_WEIGHT", 0.5)
+# この秒数ごとに全番組から索引を作り直す
+CONTENT_REBUILD_INTERVAL = _env_float("CONTENT_REBUILD_INTERVAL", 900.0)
+
+# -------------------
+# 人気番組
+# -------------------
+# コールドスタート時に使う集計: all / 24h / 7d / decayed
+POPULARITY_MODE = os.getenv("POPULARITY_MODE", "all")
+# decayed の半減期 (時間)
+POPULARITY_HALF_LIFE_HOURS = _env_float("POPULARITY_HALF_LIFE_HOURS", 72.0)
+# 全レビューから集計を作り直す間隔 (秒)
+POPULARITY_REBUILD_INTERVAL = _env_float("POPULARITY_REBUILD_INTERVAL", 900.0)
+
+# 学習用にレビューを読み込むときの1ページの件数
+REVIEW_SCAN_BATCH_SIZE = _env_int("REVIEW_SCAN_BATCH_SIZE", 1000)
+# 差分読み込みで、前回の位置からさかのぼって読み直す時間 (秒)。遅れて保存されたレビューを拾う
+TRAINING_SCAN_OVERLAP = _env_float("TRAINING_SCAN_OVERLAP", 600.0)
+# 全レビューを読み直す間隔 (秒)
+TRAINING_FULL_RESCAN_INTERVAL = _env_float("TRAINING_FULL_RESCAN_INTERVAL", 86400.0)
+# 他の worker が保存したレビューを読んで、推薦結果の事前計算・人気番組の集計・レビュー一覧のキャッシュに反映する間隔 (秒)。
+# 0 なら読まない。既定では uvicorn の worker 数 (WEB_CONCURRENCY) が2以上のときだけ 5 秒ごとに読む。
+# 1回の読み込みは射影クエリ1回で、Datastore では新しいレビューが無くても最低1回の読み取り、あれば
+# 直近 REVIEW_SYNC_OVERLAP 秒のレビュー件数分の読み取りになる (5 秒ごとなら worker あたり1日 17280 回以上)
+REVIEW_SYNC_INTERVAL = _env_float("REVIEW_SYNC_INTERVAL", 5.0 if _env_int("WEB_CONCURRENCY", 1) > 1 else 0.0)
+# 前回の位置からさかのぼって読み直す時間 (秒)。書き込みのまとめなどで遅れて保存されたレビューを拾う
+REVIEW_SYNC_OVERLAP = _env_float("REVIEW_SYNC_OVERLAP", 30.0)
+
+# -------------------
+# レビュー一覧
+# -------------------
+# /reviews/program/{program_id} の1ページの件数 (既定値と上限)
+REVIEW_PAGE_SIZE = _env_int("REVIEW_PAGE_SIZE", 20)
+REVIEW_PAGE_MAX_SIZE = _env_int("REVIEW_PAGE_MAX_SIZE", 100)
+# 番組ごとの1ページ目のキャッシュ (件数と、他のワーカーでの投稿を拾うまでの秒数)
+REVIEW_PAGE_CACHE_SIZE = _env_int("REVIEW_PAGE_CACHE_SIZE", 2000)
+REVIEW_PAGE_CACHE_TTL = _env_float("REVIEW_PAGE_CACHE_TTL", 60.0)
+# /batch で1回に指定できる番組数の上限
+BATCH_MAX_PROGRAMS = _env_int("BATCH_MAX_PROGRAMS", 50)
+
+# -------------------
+# 保存先
+# -------------------
+# datastore: Cloud Datastore / sqlite: ローカルの SQLite ファイル (1台で動かす場合やベンチマーク用)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "datastore")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "tvapp.db")
+# SQLite の接続を使い回す本数
+SQLITE_POOL_SIZE = _env_int("SQLITE_POOL_SIZE", 8)
+
+# -------------------
+# 書き込み (レビュー・お気に入り)
+# -------------------
+# direct: リクエストごとに put / batched: まとめて put_multi / write_behind: ローカルのキューに記録して応答
+WRITE_MODE = os.getenv("WRITE_MODE", "batched")
+# batched で書き込みを溜める最大秒数と、1回の put_multi の最大件数
+WRITE_BATCH_WINDOW = _env_float("WRITE_BATCH_WINDOW", 0.005)
+WRITE_BATCH_SIZE = _env_int("WRITE_BATCH_SIZE", 500)
+# まとめた書き込みを保存するスレッド数
+WRITE_FLUSH_WORKERS = _env_int("WRITE_FLUSH_WORKERS", 4)
+# write_behind のキューのファイル
+WRITE_BEHIND_PATH = os.getenv("WRITE_BEHIND_PATH", "write_behind.db")
+
+# -------------------
+# 同時実行数
+# -------------------
+# ブロッキング処理用のスレッド数 (スクレイピング用と Datastore 用は別々)
+SCRAPE_EXECUTOR_WORKERS = _env_int("SCRAPE_EXECUTOR_WORKERS", 8)
+DATASTORE_EXECUTOR_WORKERS = _env_int("DATASTORE_EXECUTOR_WORKERS", 32)
+# エンドポイントの種類ごとの同時実行数の上限
+SEARCH_CONCURRENCY = _env_int("SEARCH_CONCURRENCY", 8)
+READ_CONCURRENCY = _env_int("READ_CONCURRENCY", 64)
+WRITE_CONCURRENCY = _env_int("WRITE_CONCURRENCY", 32)
+RECOMMEND_CONCURRENCY = _env_int("RECOMMEND_CONCURRENCY", 16)
+# 上限に達しているとき、空きを待つ秒数 (超えると 503)
+CONCURRENCY_WAIT_TIMEOUT = _env_float("CONCURRENCY_WAIT_TIMEOUT", 5.0)
+
+# -------------------
+# 起動時の準備 (ウォームアップ) と readiness
+# -------------------
+# 1 なら保存先への接続・推薦モデルの読み込み・ブラウザの起動が終わるまで /readyz は 503 を返す
+# (0 なら起動してすぐ ready になり、準備は裏で進める)
+WARMUP_BEFORE_READY = os.getenv("WARMUP_BEFORE_READY", "1") != "0"
+# 起動時にブラウザプールを立ち上げる (既定は SCRAPER_ENGINE=selenium のときだけ。それ以外は初めて使うときに作る)
+WARMUP_BROWSER_POOL = os.getenv("WARMUP_BROWSER_POOL", "1" if SCRAPER_ENGINE == "selenium" else "0") != "0"
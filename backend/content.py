@@ -0,0 +1,216 @@
+# content.py
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from scoring import _concat_ranges, _top_indices
+
+
+def text_ngrams(text: str, n: int = 2):
+    """
+    NFKC 正規化・小文字化し、文字と数字だけを残した文字列の文字 n-gram (日本語は単語に区切らない)
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    chars = "".join(c for c in text if unicodedata.category(c)[0] in "LN")
+    if len(chars) < n:
+        return [chars] if chars else []
+    return [chars[i:i + n] for i in range(len(chars) - n + 1)]
+
+
+def normalize_cast(name: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", name or "").split())
+
+
+class ContentIndex:
+    """
+    番組の内容 (タイトル・補足の文字 bigram と出演者) の疎ベクトル。
+    - テキスト: TF-IDF (tf は 1 + log)。出演者: 出演者ごとの IDF。それぞれ L2 正規化して
+      text_weight / cast_weight で重み付けし、番組ごとに長さ1にする (内積 = コサイン類似度)
+    - 番組×特徴の CSR (indptr, indices, data) と、特徴→番組の転置索引 (postings, postings_data) を持つ。
+      出演者の特徴の postings は、その出演者が出ている番組の一覧になる
+    - 推薦は転置索引で候補を絞ってから、候補だけを正確に計算する
+    作ったあとは変更しない (作り直して差し替える)。
+    """
+
+    def __init__(self, programs, text_weight: float = 0.5, cast_weight: float = 0.5, ngram: int = 2):
+        self.program_ids = []
+        self.program_index = {}
+        self.features = {}         # ("t", n-gram) / ("c", 出演者) -> 特徴番号
+        rows, features, counts, is_cast = [], [], [], []
+        for program in programs:
+            pid = program["program_id"]
+            if pid in self.program_index:
+                continue
+            code = self.program_index[pid] = len(self.program_ids)
+            self.program_ids.append(pid)
+            text = Counter(text_ngrams(f"{program.get('title') or ''} {program.get('supplement') or ''}", ngram))
+            cast = {normalize_cast(name) for name in program.get("cast_names") or []} - {""}
+            for gram, count in text.items():
+                rows.append(code)
+                features.append(self._feature(("t", gram)))
+                counts.append(count)
+                is_cast.append(False)
+            for name in cast:
+                rows.append(code)
+                features.append(self._feature(("c", name)))
+                counts.append(1)
+                is_cast.append(True)
+
+        n_programs, n_features = len(self.program_ids), len(self.features)
+        rows = np.asarray(rows, dtype=np.int64)
+        features = np.asarray(features, dtype=np.int64)
+        is_cast = np.asarray(is_cast, dtype=bool)
+        df = np.bincount(features, minlength=n_features)
+        self.idf = (np.log((1 + n_programs) / (1 + df)) + 1).astype(np.float32)
+        values = np.where(is_cast, 1.0, 1 + np.log(np.asarray(counts, dtype=np.float64))) * self.idf[features]
+        # テキストと出演者をそれぞれ長さ1にして重みを掛け、最後に番組ごとに長さ1にする
+        parts = rows * 2 + is_cast
+        part_norms = np.sqrt(np.bincount(parts, weights=values ** 2, minlength=2 * n_programs))
+        values = values / part_norms[parts] * np.sqrt(np.where(is_cast, cast_weight, text_weight))
+        row_norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=n_programs))
+        keep = values > 0
+        rows, features, values = rows[keep], features[keep], values[keep] / row_norms[rows[keep]]
+
+        order = np.lexsort((features, rows))
+        self.indptr = np.zeros(n_programs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_programs), out=self.indptr[1:])
+        self.indices = features[order].astype(np.int32)
+        self.data = values[order].astype(np.float32)
+
+        # 転置索引: 特徴ごとの番組の一覧 (CSC)
+        order = np.lexsort((rows, features))
+        self.postings = rows[order].astype(np.int32)
+        self.postings_data = values[order].astype(np.float32)
+        self.postings_indptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(np.bincount(features, minlength=n_features), out=self.postings_indptr[1:])
+
+    def __len__(self):
+        return len(self.program_ids)
+
+    def _feature(self, key) -> int:
+        index = self.features.get(key)
+        if index is None:
+            index = self.features[key] = len(self.features)
+        return index
+
+    def programs_with_cast(self, name: str):
+        """
+        出演者の転置索引から、その出演者が出ている番組の program_id の一覧を返す
+        """
+        feature = self.features.get(("c", normalize_cast(name)))
+        if feature is None:
+            return []
+        postings = self.postings[self.postings_indptr[feature]:self.postings_indptr[feature + 1]]
+        return [self.program_ids[p] for p in postings]
+
+    def profile(self, seeds: dict):
+        """
+        {program_id: 重み} (お気に入り・レビュー済みの番組) の番組ベクトルの重み付き和を (特徴番号, 値) で返す
+        """
+        codes = np.fromiter((self.program_index[pid] for pid in seeds if pid in self.program_index), dtype=np.int64)
+        if not len(codes):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        weights = np.fromiter((seeds[pid] for pid in seeds if pid in self.program_index), dtype=np.float32)
+        starts, lengths = self.indptr[codes], np.diff(self.indptr)[codes]
+        positions = _concat_ranges(starts, lengths)
+        features, inverse = np.unique(self.indices[positions], return_inverse=True)
+        values = np.zeros(len(features), dtype=np.float32)
+        np.add.at(values, inverse, self.data[positions] * np.repeat(weights, lengths))
+        return features, values
+
+    def candidates(self, features, values, max_terms: int = 64, max_candidates: int = 500):
+        """
+        プロフィールの値が大きい特徴 max_terms 個の postings だけで内積を概算し、上位 max_candidates 個の
+        番組 (コード) を返す
+        """
+        positive = values > 0
+        features, values = features[positive], values[positive]
+        top = _top_indices(values, max_terms)
+        starts = self.postings_indptr[features[top]]
+        lengths = self.postings_indptr[features[top] + 1] - starts
+        positions = _concat_ranges(starts, lengths)
+        partial = np.bincount(self.postings[positions],
+                              weights=self.postings_data[positions] * np.repeat(values[top], lengths),
+                              minlength=len(self.program_ids))
+        codes = _top_indices(partial, max_candidates)
+        return codes[partial[codes] > 0]
+
+    def score(self, codes, features, values):
+        """
+        候補の番組 (コード) とプロフィールの内積をまとめて計算する
+        """
+        dense = np.zeros(len(self.features), dtype=np.float32)
+        dense[features] = values
+        starts, lengths = self.indptr[codes], np.diff(self.indptr)[codes]
+        positions = _concat_ranges(starts, lengths)
+        products = self.data[positions] * dense[self.indices[positions]]
+        scores = np.zeros(len(codes), dtype=np.float32)
+        nonempty = lengths > 0
+        if nonempty.any():
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))[nonempty]
+            scores[nonempty] = np.add.reduceat(products, offsets)
+        return scores
+
+    def recommend(self, seeds: dict, n: int = 10, exclude=(), max_terms: int = 64):
+        """
+        seeds ({program_id: 重み}) に内容が近い番組の [(program_id, score)] を返す。seeds と exclude の番組は除く
+        """
+        features, values = self.profile(seeds)
+        if not len(features):
+            return []
+        codes = self.candidates(features, values, max_terms=max_terms)
+        if not len(codes):
+            return []
+        scores = self.score(codes, features, values)
+        skip = {self.program_index[pid] for pid in list(seeds) + list(exclude) if pid in self.program_index}
+        results = []
+        for i in _top_indices(scores, n + len(skip)):
+            if codes[i] not in skip and scores[i] > 0:
+                results.append((self.program_ids[codes[i]], float(scores[i])))
+        return results[:n]
+
+
+class ContentRebuilder:
+    """
+    起動時と一定間隔ごとに、全番組から ContentIndex を作り直して差し替える
+    """
+
+    def __init__(self, load_programs, interval: float = 900.0, text_weight: float = 0.5,
+                 cast_weight: float = 0.5):
+        self.load_programs = load_programs
+        self.interval = interval
+        self.text_weight = text_weight
+        self.cast_weight = cast_weight
+        self.index = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="content-rebuild", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def rebuild_now(self):
+        start = time.monotonic()
+        index = ContentIndex(self.load_programs(), text_weight=self.text_weight, cast_weight=self.cast_weight)
+        self.index = index
+        print(f"番組内容の索引を作り直しました: {len(index)} programs, {len(index.features)} features "
+              f"({time.monotonic() - start:.2f}s)")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.rebuild_now()
+            except Exception as e:
+                print(f"番組内容の索引の作成に失敗しました: {e}")
+            self._stop.wait(self.interval)
@@ -1,99 +1,157 @@
 # database.py
-from google.cloud import datastore
-from typing import List
+"""
+ユーザー・レビュー・お気に入り・番組の保存と読み込み。
+実際の保存先は STORAGE_BACKEND (datastore / sqlite) で選び、最初に使うときに接続する (storage.get_storage)。
+各関数の所要時間は tvsearch_stage_seconds{stage="db.<関数名>"} に記録する (イテレータを返す scan_* などは除く)。
+"""
 from datetime import datetime
-import uuid
-import os
+from typing import Dict, Iterator, List, Optional
 
-print("DATASTORE_EMULATOR_HOST:", os.getenv("DATASTORE_EMULATOR_HOST"))
-print("DATASTORE_PROJECT_ID:", os.getenv("DATASTORE_PROJECT_ID"))
-
-# Datastore クライアントの初期化
-client = datastore.Client()
+from metrics import timed
+from storage import (
+    GET_BATCH_SIZE, PUT_BATCH_SIZE, RatingBatch,
+    get_storage, new_review
+)
 
 # -------------------
 # ユーザー関連
 # -------------------
 def add_user(user_id: str, user_name: str):
     """
-    Datastore の Users Kind にユーザーを追加
+    ユーザーを追加 (同じ user_id は上書き)
+    """
+    put_records([("user", {'user_id': user_id, 'user_name': user_name})])
+
+@timed("db.create_user")
+def create_user(user_id: str, user_name: str):
+    """
+    ユーザーが無ければ追加する (1回のトランザクションで確認と追加を行う)
+    (user_id, user_name, 追加したかどうか) を返す。既にいる場合は保存済みの user_name を返す
     """
-    key = client.key('User', user_id)
-    entity = datastore.Entity(key=key)
-    entity.update({
-        'user_name': user_name
-    })
-    client.put(entity)
+    return get_storage().create_user(user_id, user_name)
 
+@timed("db.get_user")
 def get_user(user_id: str):
     """
-    userId で Users Kind を取得
+    userId でユーザーを取得し、(user_id, user_name) を返す
     """
-    key = client.key('User', user_id)
-    entity = client.get(key)
-    if entity:
-        return (entity.key.name, entity.get('user_name'))
-    else:
-        return None
+    return get_storage().get_user(user_id)
 
 # -------------------
 # レビュー関連
 # -------------------
 def add_review(program_id: str, program_title: str, user_id: str, rating: int, review_text: str):
     """
-    Datastore の Reviews Kind にレビューを追加
+    レビューを追加し、review_id を返す
     review_id は UUID を使用
     """
-    review_id = str(uuid.uuid4())
-    created_at = datetime.utcnow()
-
-    key = client.key('Review', review_id)
-    entity = datastore.Entity(key=key)
-    entity.update({
-        'review_id': review_id,  # review_id をフィールドとして保存
-        'program_id': program_id,
-        'program_title': program_title,
-        'user_id': user_id,
-        'rating': rating,
-        'review_text': review_text,
-        'created_at': created_at
-    })
-    client.put(entity)
+    fields = new_review(program_id, program_title, user_id, rating, review_text)
+    put_records([("review", fields)])
+    return fields['review_id']
 
+@timed("db.get_reviews_by_program")
 def get_reviews_by_program(program_id: str) -> List[dict]:
     """
-    programId で Reviews Kind をクエリ
+    programId のレビューを新しい順に全件取得
     """
-    query = client.query(kind='Review')
-    query.add_filter('program_id', '=', program_id)
-    query.order = ['-created_at']  # 新しい順
-    results = list(query.fetch())
-    return results
+    return get_storage().get_reviews_by_program(program_id)
+
+@timed("db.get_review_page")
+def get_review_page(program_id: str, limit: int, cursor: Optional[str] = None):
+    """
+    programId のレビューを新しい順に limit 件ずつ取得し、(レビューのリスト, 次のページのカーソル) を返す
+    最後のページでは次のカーソルは None
+    """
+    return get_storage().get_review_page(program_id, limit, cursor)
+
+@timed("db.get_user_ratings")
+def get_user_ratings(user_id: str) -> List[tuple]:
+    """
+    userId のレビューの [(program_id, rating)] を返す
+    """
+    return get_storage().get_user_ratings(user_id)
 
 # -------------------
 # お気に入り関連
 # -------------------
 def add_favorite(user_id: str, program_id: str):
     """
-    Datastore の Favorites Kind にお気に入りを追加
-    user_id を親キーとして program_id を子キーとして設定
+    お気に入りを追加
     """
-    # パスの設定: User > Favorite
-    parent_key = client.key('User', user_id)
-    key = client.key('Favorite', program_id, parent=parent_key)
-    entity = datastore.Entity(key=key)
-    entity.update({
-        'program_id': program_id
-    })
-    client.put(entity)
+    put_records([("favorite", {'user_id': user_id, 'program_id': program_id})])
 
+@timed("db.get_favorites")
 def get_favorites(user_id: str) -> List[str]:
     """
-    userId で Favorites Kind をクエリし、program_id の一覧を返す
+    userId のお気に入りの program_id の一覧を返す
     """
-    parent_key = client.key('User', user_id)
-    query = client.query(kind='Favorite', ancestor=parent_key)
-    query.keys_only()
-    results = list(query.fetch())
-    program_ids = [entity.key.name for entity in results]
-    return program_ids
+    return get_storage().get_favorites(user_id)
+
+# -------------------
+# まとめて書き込み
+# -------------------
+@timed("db.put_records")
+def put_records(records: List[tuple]):
+    """
+    [(kind, fields)] (kind: user / review / favorite) をまとめて保存する (同じキーは上書き)
+    """
+    if records:
+        get_storage().put_records(records)
+
+# -------------------
+# 番組関連
+# -------------------
+@timed("db.upsert_programs")
+def upsert_programs(programs: List[dict]):
+    """
+    スクレイピングした番組情報をまとめて保存 (同じ program_id は上書き)
+    """
+    get_storage().upsert_programs(programs)
+
+@timed("db.get_programs")
+def get_programs(program_ids: List[str]) -> Dict[str, dict]:
+    """
+    複数の program_id をまとめて取得し、{program_id: 番組情報} を返す (見つからないものは含まない)
+    """
+    return get_storage().get_programs(program_ids)
+
+def scan_programs(batch_size: int = 1000) -> Iterator[List[dict]]:
+    """
+    全番組を batch_size 件ずつ返す (内容に基づく推薦の索引の作成用)
+    """
+    return get_storage().scan_programs(batch_size=batch_size)
+
+# -------------------
+# 読み込み (集計・学習・エクスポート用)
+# -------------------
+def iter_review_events():
+    """
+    全レビューの (review_id, program_id, program_title, created_at) を1件ずつ返す (集計の作り直し用)
+    """
+    return get_storage().iter_review_events()
+
+def scan_ratings(batch_size: int = 1000, since: Optional[datetime] = None) -> Iterator[RatingBatch]:
+    """
+    レビューを batch_size 件ずつ、作成順に RatingBatch として返す。
+    - (user_id, program_id, rating, created_at) だけを読み、review_text などは読まない
+    - since を指定すると、その時刻より後に作成されたレビューだけを返す (差分読み込み)
+    """
+    return get_storage().scan_ratings(batch_size=batch_size, since=since)
+
+def scan_rows(kind: str, batch_size: int = 1000, cursor: Optional[str] = None):
+    """
+    kind (user / review / favorite) の全件を batch_size 件ずつ読み、(行のリスト, このページの後ろのカーソル) を返す。
+    カーソルを渡すと、その位置から続きを読む
+    """
+    return get_storage().scan_rows(kind, batch_size=batch_size, cursor=cursor)
+
+@timed("db.get_watermark")
+def get_watermark(name: str) -> Optional[datetime]:
+    """
+    差分読み込みの位置 (最後に読んだレビューの created_at) を取得
+    """
+    return get_storage().get_watermark(name)
+
+@timed("db.set_watermark")
+def set_watermark(name: str, created_at: datetime):
+    get_storage().set_watermark(name, created_at)
@@ -0,0 +1,105 @@
+# evaluate_model.py
+"""
+推薦モデルのオフライン評価。サーバーの学習 (recommendation.train_model) は全レビューを使うので、
+精度はこのスクリプトで別に確認する。レビューを学習用と検証用に分け、学習用だけで同じ設定のモデルを学習して
+- 検証用レビューの RMSE / MAE (全体平均で予測した場合との比較)
+- 検証用で rating >= --relevant の番組が上位 --top-n 件に入った割合 (recall@N)
+を表示する。
+
+    cd backend
+    python evaluate_model.py                          # 保存先から全レビューを読む
+    python evaluate_model.py --matrix training_matrix  # bulk_io.py training-matrix の出力を読む
+"""
+import argparse
+import time
+
+import numpy as np
+
+import config
+from factorization import ALSModel, RatingMatrix, split_holdout
+
+
+def load_ratings(matrix_dir=None):
+    """
+    (user_codes, program_codes, ratings, user_ids, program_ids) を返す
+    """
+    if matrix_dir:
+        from bulk_io import load_training_matrix
+        return load_training_matrix(matrix_dir, mmap=False)
+    from training_data import RatingsTable
+    table = RatingsTable(batch_size=config.REVIEW_SCAN_BATCH_SIZE)
+    table.refresh()
+    return table.user_codes, table.program_codes, table.ratings, table.user_ids, table.program_ids
+
+
+def recall_at_n(scorer, test: RatingMatrix, relevant: float, n: int, max_users: int = 10000, seed: int = 0):
+    """
+    検証用で relevant 以上の評価を付けた番組のうち、上位 n 件 (学習用でレビュー済みの番組は除く) に入った割合
+    """
+    rows = np.unique(test.row_codes()[test.data >= relevant])
+    if len(rows) > max_users:
+        rows = np.random.default_rng(seed).choice(rows, max_users, replace=False)
+    user_ids = [test.user_ids[row] for row in rows]
+    tops = scorer.top_n_batch(user_ids, n)
+    hits = total = 0
+    for row, user_id in zip(rows, user_ids):
+        lo, hi = test.indptr[row], test.indptr[row + 1]
+        liked = {test.item_ids[i] for i, r in zip(test.indices[lo:hi], test.data[lo:hi]) if r >= relevant}
+        hits += len(liked & {pid for pid, _ in tops[user_id]})
+        total += len(liked)
+    return hits / total if total else 0.0, len(rows)
+
+
+def evaluate(user_codes, program_codes, ratings, user_ids, program_ids, model: ALSModel,
+             holdout: float = 0.2, relevant: float = 4, top_n: int = 10, seed: int = 0) -> dict:
+    train, test = split_holdout(np.asarray(user_codes), np.asarray(program_codes), np.asarray(ratings),
+                                fraction=holdout, seed=seed)
+    train_matrix = RatingMatrix.from_codes(*train, user_ids, program_ids)
+    test_matrix = RatingMatrix.from_codes(*test, user_ids, program_ids)
+
+    start = time.perf_counter()
+    model.fit(train_matrix)
+    elapsed = time.perf_counter() - start
+
+    rows = test_matrix.row_codes()
+    errors = model.predict(rows, test_matrix.indices).clip(1, 5) - test_matrix.data
+    baseline = test_matrix.data - model.global_mean
+    recall, n_users = recall_at_n(model.to_scorer(train_matrix), test_matrix, relevant, top_n, seed=seed)
+    return {
+        'train_ratings': train_matrix.nnz,
+        'test_ratings': test_matrix.nnz,
+        'train_seconds': elapsed,
+        'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else None,
+        'mae': float(np.mean(np.abs(errors))) if len(errors) else None,
+        'baseline_rmse': float(np.sqrt(np.mean(baseline ** 2))) if len(baseline) else None,
+        f'recall@{top_n}': recall,
+        'recall_users': n_users,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推薦モデルのオフライン評価 (ホールドアウト)")
+    parser.add_argument("--matrix", help="bulk_io.py training-matrix の出力ディレクトリ")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--relevant", type=float, default=4)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--factors", type=int, default=config.MODEL_FACTORS)
+    parser.add_argument("--regularization", type=float, default=config.MODEL_REGULARIZATION)
+    parser.add_argument("--iterations", type=int, default=config.MODEL_ITERATIONS)
+    parser.add_argument("--workers", type=int, default=config.MODEL_TRAIN_WORKERS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    columns = load_ratings(args.matrix)
+    if not len(columns[2]):
+        raise SystemExit("レビューがありません")
+    model = ALSModel(factors=args.factors, regularization=args.regularization,
+                     iterations=args.iterations, workers=args.workers, seed=args.seed)
+    result = evaluate(*columns, model, holdout=args.holdout, relevant=args.relevant,
+                      top_n=args.top_n, seed=args.seed)
+    for name, value in result.items():
+        print(f"{name:>15}: {value:.4f}" if isinstance(value, float) else f"{name:>15}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# factorization.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from scoring import FactorScorer
+
+
+class RatingMatrix:
+    """
+    ユーザー×番組の評価を CSR 形式 (indptr, indices, data) で持つ。
+    行・列は整数コードで、user_ids[行] / item_ids[列] が元の ID。
+    同じユーザーが同じ番組を複数回評価している場合は、最後の評価だけを使う。
+    """
+
+    def __init__(self, user_ids, item_ids, indptr, indices, data):
+        self.user_ids = list(user_ids)
+        self.item_ids = list(item_ids)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+
+    @classmethod
+    def from_codes(cls, user_codes, item_codes, ratings, user_ids, item_ids):
+        """
+        (ユーザーのコード, 番組のコード, 評価) の配列から作る。配列の順序は古い順とする
+        """
+        user_codes = np.asarray(user_codes, dtype=np.int64)
+        item_codes = np.asarray(item_codes, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float32)
+        n_users, n_items = len(user_ids), len(item_ids)
+        # (ユーザー, 番組) 順に並べ、同じ組は最後 (最新) のものだけを残す
+        keys = user_codes * n_items + item_codes
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        order = order[last]
+        rows = user_codes[order]
+        indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_users), out=indptr[1:])
+        return cls(user_ids, item_ids, indptr, item_codes[order], ratings[order])
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.item_ids)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def row_codes(self):
+        """
+        評価ごとの行 (ユーザー) のコード
+        """
+        return np.repeat(np.arange(len(self.user_ids), dtype=np.int32), np.diff(self.indptr))
+
+    def transpose(self) -> "RatingMatrix":
+        """
+        番組×ユーザーの CSR (= 元の行列の CSC) を作る
+        """
+        rows = self.row_codes()
+        order = np.argsort(self.indices, kind="stable")
+        indptr = np.zeros(len(self.item_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.item_ids)), out=indptr[1:])
+        return RatingMatrix(self.item_ids, self.user_ids, indptr, rows[order], self.data[order])
+
+
+class ALSModel:
+    """
+    バイアス付きの行列分解を ALS (交互最小二乗法) で学習する。
+        r(u, i) ≈ global_mean + user_bias[u] + item_bias[i] + user_factors[u] · item_factors[i]
+    - ユーザー側を解くときは番組側を固定し、[user_factors[u], user_bias[u]] を正規方程式で求める (番組側も同様)
+    - 正則化は評価数に比例させる (ALS-WR)
+    - 行ごとの Y^T Y は BLAS の行列積で求め、連立方程式はチャンク (chunk_size 行) ごとにまとめて解く。
+      チャンクは workers 個のスレッドで並列に処理する (BLAS / LAPACK の間は GIL が外れる)
+    - 連立方程式は前回の解から共役勾配法を cg_steps 回だけ進める (0 なら np.linalg.solve で厳密に解く)。
+      小さな行列を大量に解くので、LU 分解より速い
+    """
+
+    def __init__(self, factors: int = 64, regularization: float = 0.1, iterations: int = 10,
+                 workers: int = None, chunk_size: int = 2048, cg_steps: int = 3, seed: int = 0):
+        self.factors = factors
+        self.regularization = regularization
+        self.iterations = iterations
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.cg_steps = cg_steps
+        self.seed = seed
+        self.timings = []
+
+    def fit(self, matrix: RatingMatrix, verbose: bool = False):
+        n_users, n_items = matrix.shape
+        rng = np.random.default_rng(self.seed)
+        self.global_mean = float(matrix.data.mean()) if matrix.nnz else 0.0
+        self.user_factors = rng.normal(0, 0.1, (n_users, self.factors)).astype(np.float32)
+        self.item_factors = rng.normal(0, 0.1, (n_items, self.factors)).astype(np.float32)
+        self.user_bias = np.zeros(n_users, dtype=np.float32)
+        self.item_bias = np.zeros(n_items, dtype=np.float32)
+        by_item = matrix.transpose()
+        self.timings = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="als") as executor:
+            for iteration in range(self.iterations):
+                start = time.perf_counter()
+                self.user_factors, self.user_bias = self._solve_side(
+                    executor, matrix, self.user_factors, self.user_bias, self.item_factors, self.item_bias)
+                self.item_factors, self.item_bias = self._solve_side(
+                    executor, by_item, self.item_factors, self.item_bias, self.user_factors, self.user_bias)
+                self.timings.append(time.perf_counter() - start)
+                if verbose:
+                    print(f"ALS {iteration + 1}/{self.iterations}: {self.timings[-1]:.2f}s"
+                          f"  train RMSE {self.rmse(matrix):.4f}")
+        return self
+
+    def _solve_side(self, executor, matrix: RatingMatrix, factors, bias, other_factors, other_bias):
+        """
+        matrix の各行について、相手側 (other) を固定したときの [factors, bias] を求める。
+        factors, bias は今の値で、共役勾配法の初期値に使う
+        """
+        n_rows = len(matrix.user_ids)
+        k = self.factors + 1
+        # 相手側の特徴に定数1の列を足すと、最後の成分がこちら側のバイアスになる
+        fixed = np.empty((len(other_factors), k), dtype=np.float32)
+        fixed[:, :-1] = other_factors
+        fixed[:, -1] = 1.0
+        targets = matrix.data - self.global_mean - other_bias[matrix.indices]
+        previous = np.empty((n_rows, k), dtype=np.float32)
+        previous[:, :-1] = factors
+        previous[:, -1] = bias
+        solution = np.zeros((n_rows, k), dtype=np.float32)
+        futures = [executor.submit(self._solve_chunk, matrix, fixed, targets, previous, solution,
+                                   start, min(start + self.chunk_size, n_rows))
+                   for start in range(0, n_rows, self.chunk_size)]
+        for future in futures:
+            future.result()
+        return np.ascontiguousarray(solution[:, :-1]), np.ascontiguousarray(solution[:, -1])
+
+    def _solve_chunk(self, matrix: RatingMatrix, fixed, targets, previous, solution, start: int, end: int):
+        indptr, indices = matrix.indptr, matrix.indices
+        counts = np.diff(indptr[start:end + 1])
+        rows = start + np.nonzero(counts)[0]
+        if not len(rows):
+            return
+        k = fixed.shape[1]
+        gram = np.empty((len(rows), k, k), dtype=np.float32)
+        rhs = np.empty((len(rows), k), dtype=np.float32)
+        for j, row in enumerate(rows):
+            lo, hi = indptr[row], indptr[row + 1]
+            features = fixed[indices[lo:hi]]
+            np.matmul(features.T, features, out=gram[j])
+            np.matmul(targets[lo:hi], features, out=rhs[j])
+        gram += (self.regularization * counts[rows - start])[:, None, None] * np.eye(k, dtype=np.float32)
+        if self.cg_steps:
+            solution[rows] = _conjugate_gradient(gram, rhs, previous[rows], self.cg_steps)
+        else:
+            solution[rows] = np.linalg.solve(gram, rhs[..., None])[..., 0]
+
+    def predict(self, user_codes, item_codes):
+        return (self.global_mean + self.user_bias[user_codes] + self.item_bias[item_codes]
+                + np.einsum("rk,rk->r", self.user_factors[user_codes], self.item_factors[item_codes]))
+
+    def rmse(self, matrix: RatingMatrix, chunk: int = 1_000_000) -> float:
+        rows = matrix.row_codes()
+        total = 0.0
+        for lo in range(0, matrix.nnz, chunk):
+            hi = lo + chunk
+            errors = self.predict(rows[lo:hi], matrix.indices[lo:hi]) - matrix.data[lo:hi]
+            total += float(np.dot(errors, errors))
+        return (total / matrix.nnz) ** 0.5 if matrix.nnz else 0.0
+
+    def to_scorer(self, matrix: RatingMatrix, rating_scale=(1, 5)) -> FactorScorer:
+        """
+        推薦用の FactorScorer にする。レビュー済みの番組は学習に使った CSR をそのまま使う
+        """
+        return FactorScorer(matrix.user_ids, matrix.item_ids, self.user_factors, self.item_factors,
+                            self.user_bias, self.item_bias, self.global_mean,
+                            matrix.indptr, matrix.indices, rating_scale=rating_scale)
+
+
+def _conjugate_gradient(a, b, x, steps: int):
+    """
+    正定値行列 a (n × k × k) の連立方程式 a x = b を、初期値 x から共役勾配法で steps 回だけまとめて進める
+    """
+    residual = b - np.matmul(a, x[..., None])[..., 0]
+    direction = residual.copy()
+    norm = np.einsum("bi,bi->b", residual, residual)
+    for _ in range(steps):
+        a_direction = np.matmul(a, direction[..., None])[..., 0]
+        curvature = np.einsum("bi,bi->b", direction, a_direction)
+        # 収束済み (残差が 0) の行はそのままにする
+        alpha = np.divide(norm, curvature, out=np.zeros_like(norm), where=curvature > 0)
+        x += alpha[:, None] * direction
+        residual -= alpha[:, None] * a_direction
+        new_norm = np.einsum("bi,bi->b", residual, residual)
+        beta = np.divide(new_norm, norm, out=np.zeros_like(norm), where=norm > 0)
+        direction = residual + beta[:, None] * direction
+        norm = new_norm
+    return x
+
+
+def split_holdout(user_codes, item_codes, ratings, fraction: float = 0.2, seed: int = 0):
+    """
+    評価を学習用と検証用にランダムに分け、(学習用の3配列, 検証用の3配列) を返す (オフライン評価用)
+    """
+    rng = np.random.default_rng(seed)
+    test = rng.random(len(ratings)) < fraction
+    train = ~test
+    return ((user_codes[train], item_codes[train], ratings[train]),
+            (user_codes[test], item_codes[test], ratings[test]))
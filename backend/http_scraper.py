@@ -0,0 +1,122 @@
+# http_scraper.py
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from browser_pool import PoolExhaustedError
+from metrics import span
+from scraper import (
+    ScraperEngine, search_url,
+    PROGRAM_LINK_SELECTOR, TITLE_SELECTOR, SUPPLEMENT_SELECTOR, CAST_SELECTOR,
+)
+
+
+def create_session(max_connections: int = None) -> requests.Session:
+    """
+    keep-alive で接続を使い回す Session を作る。
+    1ホストあたりの同時接続数は max_connections まで (超えた分は空きを待つ)。
+    """
+    max_connections = max_connections or config.HTTP_MAX_CONNECTIONS_PER_HOST
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_connections,
+                          pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": "Mozilla/5.0 (compatible; TVsearchapp)"})
+    return session
+
+
+def parse_program_links(html: str, base_url: str):
+    """
+    検索結果ページの HTML から詳細ページの URL 一覧を取り出す
+    """
+    doc = lxml.html.fromstring(html)
+    return [urljoin(base_url, a.get("href")) for a in doc.cssselect(PROGRAM_LINK_SELECTOR)]
+
+
+def parse_program_detail(html: str, url: str):
+    """
+    詳細ページの HTML から番組情報を取り出す。
+    タイトルか補足情報が見つからない場合は None (JavaScript で描画されるページなど)。
+    """
+    doc = lxml.html.fromstring(html)
+    title = _first_text(doc.cssselect(TITLE_SELECTOR))
+    supplement = _first_text(doc.cssselect(SUPPLEMENT_SELECTOR))
+    if not title or not supplement:
+        return None
+    cast_names = [a.text_content().strip() for a in doc.cssselect(CAST_SELECTOR)]
+    return {
+        "url": url,
+        "title": title,
+        "supplement": supplement,
+        "cast_names": [name for name in cast_names if name]
+    }
+
+
+def _first_text(elements) -> str:
+    return elements[0].text_content().strip() if elements else ""
+
+
+class HttpEngine(ScraperEngine):
+    """
+    ブラウザを使わず HTTP で HTML を取得し、lxml で解析する方式。
+    セレクタが空を返したページは fallback (Selenium) で取得し直す。
+    """
+    name = "http"
+
+    def __init__(self, fallback: ScraperEngine = None, session: requests.Session = None):
+        self.fallback = fallback
+        self.http = session or create_session()
+
+    def collect_links(self, search_query: str, deadline_at: float):
+        url = search_url(search_query)
+        try:
+            links = parse_program_links(self._get(url), url)
+        except requests.RequestException as e:
+            print(f"エラーが発生しました: {e}")
+            links = []
+        if not links and self.fallback:
+            # フォールバックが使えない (Chrome を起動できないなど) ときは、見つからなかったものとして返す
+            try:
+                return self.fallback.collect_links(search_query, deadline_at)
+            except Exception as e:
+                print(f"フォールバックでの検索に失敗しました: {e}")
+        return links
+
+    @contextmanager
+    def session(self, deadline_at: float):
+        # Session は共有し、接続数は HTTPAdapter の pool_maxsize で制限する
+        yield lambda link: self.fetch_detail(link, deadline_at)
+
+    def fetch_detail(self, link: str, deadline_at: float = None):
+        try:
+            detail = parse_program_detail(self._get(link), link)
+        except requests.RequestException as e:
+            print(f"エラーが発生しました: {e}")
+            detail = None
+        if detail is None and self.fallback and deadline_at is not None:
+            try:
+                with self.fallback.session(deadline_at) as fetch:
+                    return fetch(link)
+            except PoolExhaustedError:
+                print(f"フォールバック用のブラウザが空いていません: {link}")
+            except Exception as e:
+                # 壊れたブラウザは with を抜けるときにプールが作り直す
+                print(f"フォールバックでの取得に失敗しました ({link}): {e}")
+        return detail
+
+    def max_concurrency(self) -> int:
+        return min(config.SCRAPE_MAX_CONCURRENCY, config.HTTP_MAX_CONNECTIONS_PER_HOST)
+
+    def _get(self, url: str) -> str:
+        with span("http.page_load"):
+            res = self.http.get(url, timeout=config.HTTP_TIMEOUT)
+        res.raise_for_status()
+        return res.text
@@ -0,0 +1,181 @@
+# item_index.py
+import numpy as np
+
+from scoring import _top_indices
+
+
+class ItemIndex:
+    """
+    番組ベクトルの内積で上位 k 件を探す索引 (NumPy のみ)。
+    - n_lists <= 1 のときは全件を行列×ベクトルで調べる (厳密)
+    - それ以外は IVF: k-means でベクトルを n_lists 個のセルに分け、クエリとの内積が大きいセントロイドの
+      セルを n_probe 個だけ調べる (近似)。調べる件数はおよそ 件数 × n_probe / n_lists になる
+    ベクトルはセルごとに連続するように並べ替えて持つ (order[位置] = 番組のコード、position[番組のコード] = 位置)。
+    """
+
+    def __init__(self, vectors, n_lists: int = 0, n_probe: int = 8, kmeans_iterations: int = 10,
+                 seed: int = 0, block_size: int = 65536):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.n_items, self.dim = vectors.shape
+        self.n_probe = n_probe
+        self.block_size = block_size
+        n_lists = min(n_lists, self.n_items)
+        if n_lists <= 1:
+            self.centroids = None
+            self.order = np.arange(self.n_items, dtype=np.int64)
+            self.offsets = np.array([0, self.n_items], dtype=np.int64)
+            self.vectors = vectors
+            self.position = self.order
+            return
+        self.centroids, assignment = self._kmeans(vectors, n_lists, kmeans_iterations, seed)
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=self.offsets[1:])
+        self.vectors = vectors[self.order]
+        self.position = np.empty_like(self.order)
+        self.position[self.order] = np.arange(self.n_items)
+
+    @property
+    def n_lists(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def arrays(self, prefix: str) -> dict:
+        arrays = {f"{prefix}vectors": self.vectors, f"{prefix}order": self.order,
+                  f"{prefix}position": self.position, f"{prefix}offsets": self.offsets}
+        if self.centroids is not None:
+            arrays[f"{prefix}centroids"] = self.centroids
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, prefix: str, n_probe: int = 8, block_size: int = 65536) -> "ItemIndex":
+        """
+        arrays() の配列 (mmap したものでもよい) から作り直す。k-means はやり直さない
+        """
+        index = cls.__new__(cls)
+        index.vectors = arrays[f"{prefix}vectors"]
+        index.n_items, index.dim = index.vectors.shape
+        index.n_probe = n_probe
+        index.block_size = block_size
+        index.order = arrays[f"{prefix}order"]
+        index.position = arrays[f"{prefix}position"]
+        index.offsets = arrays[f"{prefix}offsets"]
+        index.centroids = arrays.get(f"{prefix}centroids")
+        return index
+
+    def vector(self, code: int):
+        return self.vectors[self.position[code]]
+
+    def search(self, query, k: int, n_probe: int = None):
+        """
+        query との内積が大きい順に最大 k 件の (番組のコードの配列, 内積の配列) を返す
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.centroids is None:
+            positions = None
+            scores = self.vectors @ query
+        else:
+            n_probe = min(n_probe or self.n_probe, self.n_lists)
+            cells = _top_indices(self.centroids @ query, n_probe)
+            ranges = [(self.offsets[c], self.offsets[c + 1]) for c in cells]
+            positions = np.concatenate([np.arange(lo, hi) for lo, hi in ranges])
+            scores = np.concatenate([self.vectors[lo:hi] @ query for lo, hi in ranges])
+        top = _top_indices(scores, k)
+        items = top if positions is None else positions[top]
+        return self.order[items], scores[top]
+
+    def _kmeans(self, vectors, n_lists: int, iterations: int, seed: int, sample_per_list: int = 64):
+        """
+        セントロイドと各ベクトルのセル番号を返す。
+        k-means はセルあたり sample_per_list 件の標本で学習し、最後に全件をいちばん近いセルに割り当てる
+        """
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if self.n_items > n_lists * sample_per_list:
+            sample = vectors[rng.choice(self.n_items, n_lists * sample_per_list, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            filled = counts > 0
+            centroids[filled] = (np.add.reduceat(sample[order], starts[filled], axis=0)
+                                 / counts[filled, None])
+            # 空になったセルは適当なベクトルで置き直す
+            if not filled.all():
+                centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()), replace=False)]
+        return centroids, self._assign(vectors, centroids)
+
+    def _assign(self, vectors, centroids):
+        """
+        各ベクトルのいちばん近いセントロイドの番号。block_size 件ずつ計算してメモリを抑える
+        """
+        # ||x - c||^2 が最小のセル = x·c - ||c||^2 / 2 が最大のセル
+        half_norms = 0.5 * np.einsum("ck,ck->c", centroids, centroids)
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for lo in range(0, len(vectors), self.block_size):
+            block = vectors[lo:lo + self.block_size]
+            assignment[lo:lo + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+        return assignment
+
+
+class ModelIndex:
+    """
+    推薦モデル1つ分の番組の索引。学習したプロセスで作り、モデルと一緒に保存する (arrays / from_arrays)。
+    - 似ている番組: 番組の因子ベクトルのコサイン類似度
+    - 推薦の候補: [user_factors[u], 1] と [item_factors[i], item_bias[i]] の内積 (= スコアから定数を除いたもの)
+    番組数が min_items 未満なら全件を調べる。
+    """
+
+    def __init__(self, scorer, version: str = None, n_lists: int = 0, n_probe: int = 8, min_items: int = 5000):
+        self.scorer = scorer
+        self.version = version
+        n_items = scorer.n_items
+        if n_items < min_items:
+            n_lists = 0
+        elif n_lists <= 0:
+            n_lists = int(np.sqrt(n_items))
+        factors = scorer.item_factors
+        norms = np.linalg.norm(factors, axis=1, keepdims=True)
+        self.similar_index = ItemIndex(factors / np.maximum(norms, 1e-6), n_lists=n_lists, n_probe=n_probe)
+        candidates = np.hstack([factors, scorer.item_bias[:, None]])
+        self.candidate_index = ItemIndex(candidates, n_lists=n_lists, n_probe=n_probe)
+
+    def arrays(self) -> dict:
+        return {**self.similar_index.arrays("similar_"), **self.candidate_index.arrays("candidate_")}
+
+    @classmethod
+    def from_arrays(cls, scorer, arrays: dict, version: str = None, n_probe: int = 8) -> "ModelIndex":
+        index = cls.__new__(cls)
+        index.scorer = scorer
+        index.version = version
+        index.similar_index = ItemIndex.from_arrays(arrays, "similar_", n_probe)
+        index.candidate_index = ItemIndex.from_arrays(arrays, "candidate_", n_probe)
+        return index
+
+    def similar(self, program_id, n: int = 10):
+        """
+        program_id に似ている番組の [(program_id, 類似度)] を返す。モデルに無い番組なら None
+        """
+        code = self.scorer.item_index.get(program_id)
+        if code is None:
+            return None
+        codes, scores = self.similar_index.search(self.similar_index.vector(code), n + 1)
+        return [(self.scorer.item_ids[c], float(s)) for c, s in zip(codes, scores) if c != code][:n]
+
+    def candidates(self, user_id, n: int = 10):
+        """
+        ユーザーのベクトルから、レビュー済みを除いたスコア上位 n 件の [(program_id, score)] を返す。
+        モデルに無いユーザーなら None
+        """
+        scorer = self.scorer
+        row = scorer.user_index.get(user_id)
+        if row is None:
+            return None
+        seen = scorer.seen(row)
+        query = np.append(scorer.user_factors[row], np.float32(1.0))
+        codes, scores = self.candidate_index.search(query, n + len(seen))
+        seen = set(seen.tolist())
+        base = scorer.global_mean + scorer.user_bias[row]
+        return [(scorer.item_ids[c], scorer._clip(base + s)) for c, s in zip(codes, scores)
+                if c not in seen][:n]
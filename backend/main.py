@@ -1,58 +1,244 @@
 # main.py
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query, HTTPException, Depends, Request
-from typing import List
-from scraper import get_program_details  # スクレイピングロジックがある場合
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import List, Optional
+import tempfile
+from scraper import cached_scrape_programs, search_cache, get_engine, init_browser_pool, shutdown_browser_pool
+from browser_pool import PoolExhaustedError
 from database import (
-    add_user, get_user,
-    add_review, get_reviews_by_program,
-    add_favorite, get_favorites
+    create_user as get_or_create_user, get_user,
+    new_review, PUT_BATCH_SIZE,
+    get_favorites, scan_programs, scan_rows
 )
+from storage import get_storage, close_storage
 from models import UserCreate, User, ReviewCreate, Review
-from recommendation import recommend_programs
+from recommendation import (
+    get_user_recommendations, get_program_details_by_ids, get_popular_programs, get_similar_programs,
+    model_manager, on_review_added, on_reviews_saved, popularity_rebuilder, content_rebuilder, review_sync
+)
+from popularity import MODES as POPULARITY_MODES
+import review_pages
+import program_catalog
+from search_index import search_index, answer_from_index
+from scrape_scheduler import scrape_scheduler
+import bulk_io
+import metrics
+from write_pipeline import write_pipeline
+from warmup import Warmup
+from concurrency import BoundedExecutor, ConcurrencyLimit, OverloadedError, run_limited
+import config
+
+# ブロッキング処理用のスレッドプール: スクレイピングと保存先 (Datastore / SQLite) で分ける
+scrape_executor = BoundedExecutor("scrape", config.SCRAPE_EXECUTOR_WORKERS)
+datastore_executor = BoundedExecutor("datastore", config.DATASTORE_EXECUTOR_WORKERS)
+
+# エンドポイントの種類ごとの同時実行数の上限
+limits = {
+    "search": ConcurrencyLimit("search", config.SEARCH_CONCURRENCY, config.CONCURRENCY_WAIT_TIMEOUT),
+    "read": ConcurrencyLimit("read", config.READ_CONCURRENCY, config.CONCURRENCY_WAIT_TIMEOUT),
+    "write": ConcurrencyLimit("write", config.WRITE_CONCURRENCY, config.CONCURRENCY_WAIT_TIMEOUT),
+    "recommend": ConcurrencyLimit("recommend", config.RECOMMEND_CONCURRENCY, config.CONCURRENCY_WAIT_TIMEOUT),
+}
+
+# 起動時の準備: 起動 (lifespan) は待たずに裏で順に行い、終わるまで /readyz は 503 を返す
+warmup = Warmup(wait_before_ready=config.WARMUP_BEFORE_READY)
+# 保存先 (Datastore / SQLite) のクライアントを最初のリクエストの前に作っておく
+warmup.add_step("storage", get_storage)
+# スクレイピングの HTTP セッションを作り、必要ならブラウザを起動しておく (/search ではページ読み込みだけを行う)
+warmup.add_step("scraper", lambda: get_engine())
+if config.WARMUP_BROWSER_POOL:
+    warmup.add_step("browser_pool", lambda: init_browser_pool())
+# 保存済みの推薦モデルを読み込み、裏で定期的に再学習する
+warmup.add_step("model", model_manager.start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scrape_executor.start()
+    datastore_executor.start()
+    # レビュー・お気に入りの書き込みをまとめて保存するスレッドを起動する
+    write_pipeline.start()
+    warmup.start()
+    # 保存済みの番組・レビューから検索の索引を裏で作る (以降は保存のたびに更新する)
+    if config.SEARCH_INDEX_ENABLED:
+        search_index.load_async(scan_programs, lambda: scan_rows("review"))
+    # 人気番組の集計を全レビューから作り、以降は定期的に作り直す
+    popularity_rebuilder.start()
+    # 番組の内容 (タイトル・補足・出演者) の索引を作り、以降は定期的に作り直す
+    content_rebuilder.start()
+    # よく検索されるクエリと古くなった番組を裏で先に取り直す
+    if config.SCHEDULER_ENABLED:
+        scrape_scheduler.start()
+    # 他の worker が保存したレビューを、推薦結果の事前計算・集計・レビュー一覧のキャッシュに反映する
+    review_sync.start()
+    yield
+    warmup.stop()
+    review_sync.stop()
+    scrape_scheduler.stop()
+    model_manager.stop()
+    popularity_rebuilder.stop()
+    content_rebuilder.stop()
+    await scrape_executor.run(shutdown_browser_pool)
+    scrape_executor.shutdown()
+    # 溜まっている書き込みを保存してから止める
+    await datastore_executor.run(write_pipeline.stop)
+    datastore_executor.shutdown()
+    close_storage()
+
+app = FastAPI(lifespan=lifespan)
+
+# ----- 計測 -----
+metrics.REGISTRY.gauge("tvsearch_concurrency", "Active requests, limit and rejections per endpoint kind.",
+                       lambda: {(name, state): getattr(l, state) for name, l in limits.items()
+                                for state in ("active", "limit", "rejected")}, ("kind", "state"))
+metrics.REGISTRY.gauge("tvsearch_executor_tasks", "Running or queued blocking tasks and worker threads.",
+                       lambda: {(e.name, state): value for e in (scrape_executor, datastore_executor)
+                                for state, value in (("pending", e.pending), ("workers", e.max_workers))},
+                       ("executor", "state"))
+metrics.REGISTRY.gauge("tvsearch_write_queue_pending", "Writes waiting in the write-behind queue.",
+                       lambda: write_pipeline.queue.pending() if write_pipeline.queue is not None else None)
+metrics.REGISTRY.gauge("tvsearch_search_index_programs", "Programs in the full-text search index.",
+                       lambda: len(search_index))
+metrics.REGISTRY.gauge("tvsearch_scrape_jobs", "Background scrape jobs waiting or running.",
+                       lambda: {(state,): scrape_scheduler.info()[state] for state in ("queued", "running")},
+                       ("state",))
+metrics.REGISTRY.gauge("tvsearch_ready", "1 once the startup warm-up has finished (or is not waited for).",
+                       lambda: 1 if warmup.ready.is_set() else 0)
+
+if config.METRICS_ENABLED or config.PROFILING_ENABLED:
+    @app.middleware("http")
+    async def instrument(request: Request, call_next):
+        """
+        リクエストの待ち時間をルートごとに記録する。
+        PROFILING_ENABLED=1 で X-Profile ヘッダーがあれば、そのリクエストの間だけサンプリングプロファイラを動かす
+        """
+        start = time.perf_counter()
+        profile = None
+        if config.PROFILING_ENABLED and request.headers.get("x-profile"):
+            with metrics.profile_request(request.url.path) as profile:
+                response = await call_next(request)
+        else:
+            response = await call_next(request)
+        if profile is not None:
+            response.headers["X-Profile-File"] = profile["path"]
+            response.headers["X-Profile-Samples"] = str(profile["samples"])
+        if metrics.ENABLED:
+            route = request.scope.get("route")
+            metrics.http_seconds.observe(time.perf_counter() - start, request.method,
+                                         route.path if route is not None else "unmatched",
+                                         str(response.status_code))
+        return response
 
-app = FastAPI()
+@app.get("/metrics")
+def get_metrics():
+    """
+    段階ごとの時間・リクエストの待ち時間・キャッシュのヒット数・プールの使用数を Prometheus のテキスト形式で返す
+    """
+    return Response(content=metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.exception_handler(OverloadedError)
+@app.exception_handler(PoolExhaustedError)
+async def overloaded_handler(request: Request, exc: Exception):
+    # 混雑中: 時間をおいて再試行してもらう
+    return JSONResponse(status_code=503, content={"detail": "Server is busy. Please retry later."},
+                        headers={"Retry-After": "5"})
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Hello, this is backend API!"}
 
+@app.get("/healthz")
+async def liveness():
+    """
+    liveness: イベントループが応答していれば 200 (準備中でも再起動させない)
+    """
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """
+    readiness: 起動時の準備が終わるまで 503。準備の一部が失敗した場合は 200 で status="degraded"
+    """
+    info = warmup.info()
+    return JSONResponse(status_code=200 if warmup.ready.is_set() else 503, content=info)
+
 @app.get("/search")
-def search_programs(q: str = Query(None)):
+async def search_programs(q: str = Query(None),
+                          n: int = Query(config.SEARCH_DEFAULT_RESULTS, ge=1, le=config.SEARCH_MAX_RESULTS)):
     """
-    検索クエリ q を受け取ってスクレイピングし、結果を返す。
-    例: GET /search?q=ドラマ
+    検索クエリ q の結果を最大 n 件返す。
+    保存済みの番組・レビューの索引で n 件見つかり、どれも新しければそれを返す (source="index")。
+    それ以外 (未知のクエリ・古い番組) はスクレイピングする (source="scrape")。
+    時間内に全件取得できなかった場合は partial=True で取得できた分だけ返す。
+    例: GET /search?q=ドラマ&n=5
     """
     if not q:
         raise HTTPException(status_code=400, detail="No query provided.")
-    data = get_program_details(q)
-    return {"programs": data}
+    if config.SCHEDULER_ENABLED:
+        scrape_scheduler.record_query(q)
+    if config.SEARCH_INDEX_ENABLED:
+        programs = await run_limited(limits["read"], datastore_executor, answer_from_index,
+                                     search_index, q, n, config.SEARCH_INDEX_MAX_AGE)
+        if programs is not None:
+            return {"programs": programs, "partial": False, "source": "index"}
+    # 全ブラウザが使用中 (PoolExhaustedError) の場合は 503 を返す
+    result = await run_limited(limits["search"], scrape_executor, cached_scrape_programs, q, limit=n)
+    return {**result, "source": "scrape"}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    キャッシュのヒット率などを返す
+    """
+    return {"search": search_cache.info(), "search_index": search_index.info()}
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """
+    先読みのジョブの数 (待ち・実行中・完了・失敗) と、レート制限で待った秒数を返す
+    """
+    return await datastore_executor.run(scrape_scheduler.info)
+
+@app.get("/writes/stats")
+async def get_write_stats():
+    """
+    書き込みのバッチ数・平均バッチサイズ・キューに残っている件数などを返す
+    """
+    return await datastore_executor.run(write_pipeline.info)
+
+@app.get("/concurrency/stats")
+async def get_concurrency_stats():
+    """
+    エンドポイントの種類ごとの実行中の数と、上限により断った数を返す
+    """
+    return {name: {"limit": l.limit, "active": l.active, "rejected": l.rejected}
+            for name, l in limits.items()}
 
 # ----- ユーザー関連 -----
 @app.post("/users", response_model=User, status_code=201)
-def create_user(user: UserCreate):
+async def create_user(user: UserCreate):
     """
     新規ユーザー登録
     """
-    # すでに存在するかチェック
-    existing_user = get_user(user.user_id)
-    if existing_user:
+    return await run_limited(limits["write"], datastore_executor, _create_user, user)
+
+def _create_user(user: UserCreate) -> User:
+    # 存在確認と追加を1回のトランザクションで行う
+    user_id, user_name, created = get_or_create_user(user.user_id, user.user_name)
+    if not created:
         raise HTTPException(status_code=400, detail="User already exists.")
-    
-    # DBに追加
-    add_user(user.user_id, user.user_name)
-    # DBから取り直して返す
-    db_user = get_user(user.user_id)
-    if db_user:
-        return User(user_id=db_user[0], user_name=db_user[1])
-    else:
-        raise HTTPException(status_code=500, detail="Could not create user.")
+    return User(user_id=user_id, user_name=user_name)
 
 @app.get("/users/{user_id}", response_model=User)
-def get_user_by_id(user_id: str):
+async def get_user_by_id(user_id: str):
     """
     ユーザーID指定で取得
     """
-    db_user = get_user(user_id)
+    db_user = await run_limited(limits["read"], datastore_executor, get_user, user_id)
     if db_user:
         return User(user_id=db_user[0], user_name=db_user[1])
     else:
@@ -60,65 +246,253 @@ def get_user_by_id(user_id: str):
 
 # ----- レビュー関連 -----
 @app.post("/reviews", status_code=201)
-def create_review(review: ReviewCreate):
+async def create_review(review: ReviewCreate):
     """
     新規レビュー投稿
     """
-    add_review(
+    fields = new_review(
         program_id=review.program_id,
         program_title=review.program_title,
         user_id=review.user_id,
         rating=review.rating,
         review_text=review.review_text
     )
+    await _submit_write("review", fields)
+    # 推薦結果の事前計算を捨て、再学習のカウントを進める
+    await datastore_executor.run(on_review_added, review.user_id, review.program_id,
+                                 review.program_title, fields["review_id"])
     return {"message": "Review added successfully"}
 
+async def _submit_write(kind: str, fields: dict):
+    """
+    他のリクエストの書き込みとまとめて保存する (write_behind ではキューに記録した時点で戻る)
+    """
+    async with limits["write"]:
+        if write_pipeline.mode == "batched":
+            future = write_pipeline.submit(kind, fields)
+        else:
+            # direct / write_behind は put やファイルへの書き込みを待つので、スレッドで実行する
+            future = await datastore_executor.run(write_pipeline.submit, kind, fields)
+        await asyncio.wrap_future(future)
+
+def _on_written(kind: str, fields: dict):
+    if kind == "review":
+        # この番組のレビュー一覧のキャッシュを捨て、レビュー本文を検索の索引に足す
+        review_pages.invalidate(fields["program_id"])
+        if config.SEARCH_INDEX_ENABLED:
+            search_index.add_review(fields)
+
+write_pipeline.add_listener(_on_written)
+
+def _on_imported(kind: str, records):
+    if kind == "reviews":
+        # 一括インポートしたレビューも、投稿と同じくキャッシュ・検索の索引・集計・推薦に反映する
+        for fields in records:
+            _on_written("review", fields)
+        on_reviews_saved(records)
+
+bulk_io.add_listener(_on_imported)
+
+def _on_synced(reviews):
+    # 他の worker が保存したレビュー: この番組のレビュー一覧のキャッシュを捨てる
+    for program_id in {fields["program_id"] for fields in reviews}:
+        review_pages.invalidate(program_id)
+
+review_sync.add_listener(_on_synced)
+# スクレイピングした番組を検索の索引に足す
+if config.SEARCH_INDEX_ENABLED:
+    program_catalog.add_listener(search_index.add_programs)
+
 @app.get("/reviews/program/{program_id}", response_model=List[Review])
-def get_reviews_for_program(program_id: str):
-    """
-    ある番組IDに対するレビュー一覧を取得
-    """
-    rows = get_reviews_by_program(program_id)
-    results = []
-    for row in rows:
-        try:
-            results.append(Review(
-                review_id=row["review_id"],  # 'review_id' に修正
-                program_id=row["program_id"],
-                program_title=row["program_title"],
-                user_id=row["user_id"],
-                rating=row["rating"],
-                review_text=row["review_text"],
-                created_at=row["created_at"]
-            ))
-        except KeyError as e:
-            # ログにエラーを記録し、詳細を確認できるようにする
-            print(f"KeyError: {e} in row: {row}")
-            raise HTTPException(status_code=500, detail=f"Missing field: {e}")
-    return results
+async def get_reviews_for_program(program_id: str, request: Request,
+                                  limit: int = Query(config.REVIEW_PAGE_SIZE, ge=1, le=config.REVIEW_PAGE_MAX_SIZE),
+                                  cursor: Optional[str] = Query(None)):
+    """
+    ある番組IDに対するレビュー一覧を新しい順に limit 件取得
+    続きがある場合は X-Next-Cursor ヘッダーの値を cursor に渡すと次のページを返す。
+    If-None-Match が ETag と一致すれば 304 を返す (1ページ目がキャッシュにあれば保存先には問い合わせない)
+    """
+    page = review_pages.cached_first_page(program_id, limit) if cursor is None else None
+    if page is None:
+        page = await run_limited(limits["read"], datastore_executor,
+                                 review_pages.load_page, program_id, limit, cursor)
+    headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+    if page.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
 
 # ----- お気に入り関連 -----
 @app.post("/favorites/{user_id}/{program_id}")
-def create_favorite(user_id: str, program_id: str):
+async def create_favorite(user_id: str, program_id: str):
     """
     お気に入り登録
     """
-    add_favorite(user_id, program_id)
+    await _submit_write("favorite", {"user_id": user_id, "program_id": program_id})
     return {"message": "Favorite added"}
 
 @app.get("/favorites/{user_id}")
-def get_favorite_list(user_id: str):
+async def get_favorite_list(user_id: str):
     """
-    ユーザーのお気に入り一覧を取得
+    ユーザーのお気に入り一覧を取得 (番組情報は番組カタログからまとめて引く)
     """
+    return await run_limited(limits["read"], datastore_executor, _load_favorites, user_id)
+
+def _load_favorites(user_id: str):
     programs = get_favorites(user_id)
-    return {"user_id": user_id, "favorite_programs": programs}
+    return {
+        "user_id": user_id,
+        "favorite_programs": programs,
+        "programs": get_program_details_by_ids(programs)
+    }
 
 
 @app.get("/recommendations/{user_id}")
-def get_recommendations(user_id: str, n: int = 10):
+async def get_recommendations(user_id: str, n: int = 10):
     """
     ユーザーIDと推薦件数を指定して番組推薦を受け取るエンドポイント
+    事前計算済みの結果を返し、計算に使ったモデルのバージョンと計算時刻も含める
+    """
+    return await run_limited(limits["recommend"], datastore_executor,
+                             get_user_recommendations, user_id, n_recommendations=n)
+
+@app.get("/programs/popular")
+async def get_popular_list(n: int = 10, mode: str = Query(None)):
+    """
+    人気番組の上位N件を取得
+    mode: all (レビュー数) / 24h / 7d (直近のレビュー数) / decayed (時間減衰スコア)
+    """
+    if mode is not None and mode not in POPULARITY_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(POPULARITY_MODES)}.")
+    programs = await run_limited(limits["recommend"], datastore_executor, get_popular_programs, n, mode)
+    return {"programs": programs}
+
+@app.get("/programs/{program_id}/similar")
+async def get_similar_list(program_id: str, n: int = 10):
+    """
+    推薦モデルの番組ベクトルが近い (似ている) 番組の上位N件を取得
+    """
+    result = await run_limited(limits["recommend"], datastore_executor, get_similar_programs, program_id, n)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Program not found in the recommendation model.")
+    return result
+
+# ----- まとめて取得 -----
+@app.get("/batch")
+async def get_batch(program_ids: List[str] = Query([]), user_id: Optional[str] = Query(None),
+                    review_limit: int = Query(config.REVIEW_PAGE_SIZE, ge=1, le=config.REVIEW_PAGE_MAX_SIZE),
+                    n: int = Query(10, ge=1, le=100)):
+    """
+    画面の表示に必要なものを1回で返す (フロントエンドが検索結果の番組ごとに問い合わせなくてよいように)。
+    - reviews: program_ids の番組ごとのレビュー一覧の1ページ目 (続きは review_cursors の cursor で /reviews/program/ から)
+    - favorites / recommendations: user_id を指定した場合だけ。/favorites/{user_id}, /recommendations/{user_id} と同じ形
+    キャッシュに無いレビュー一覧・お気に入り・推薦は並列に読み込む。
+    例: GET /batch?program_ids=123&program_ids=456&user_id=foo@example.com
+    """
+    program_ids = list(dict.fromkeys(program_ids))
+    if len(program_ids) > config.BATCH_MAX_PROGRAMS:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {config.BATCH_MAX_PROGRAMS} program_ids can be requested at once.")
+    pages = {pid: review_pages.cached_first_page(pid, review_limit) for pid in program_ids}
+    missing = [pid for pid, page in pages.items() if page is None]
+    tasks = [run_limited(limits["read"], datastore_executor, review_pages.load_page, pid, review_limit)
+             for pid in missing]
+    if user_id:
+        tasks.append(run_limited(limits["read"], datastore_executor, _load_favorites, user_id))
+        tasks.append(run_limited(limits["recommend"], datastore_executor,
+                                 get_user_recommendations, user_id, n_recommendations=n))
+    results = await asyncio.gather(*tasks)
+    pages.update(zip(missing, results))
+    extra = {"review_cursors": {pid: page.next_cursor for pid, page in pages.items()}}
+    if user_id:
+        extra["favorites"], extra["recommendations"] = results[len(missing):]
+    # レビュー一覧はキャッシュ済みの JSON をそのまま埋め込む
+    reviews = b",".join(json.dumps(pid, ensure_ascii=False).encode() + b":" + page.body
+                        for pid, page in pages.items())
+    rest = json.dumps(jsonable_encoder(extra), ensure_ascii=False, separators=(",", ":")).encode()
+    return Response(content=b'{"reviews":{' + reviews + b"}," + rest[1:], media_type="application/json")
+
+# ----- 一括インポート / エクスポート -----
+@app.post("/bulk/import/{kind}")
+async def bulk_import(kind: str, request: Request, format: str = Query("ndjson")):
+    """
+    レビュー・ユーザー・お気に入りを一括で保存する (kind: reviews / users / favorites)
+    本文は NDJSON (1行1件) か Parquet。NDJSON は受け取りながら PUT_BATCH_SIZE 件ずつ並列に保存する
+    """
+    if kind not in bulk_io.KINDS:
+        raise HTTPException(status_code=404, detail=f"kind must be one of {', '.join(bulk_io.KINDS)}.")
+    if format not in bulk_io.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(bulk_io.FORMATS)}.")
+    try:
+        if format == "parquet":
+            # Parquet は末尾から読むので一時ファイルに書き出す。ファイルへの書き込みはイベントループを止めないよう
+            # スレッドで行い、受け取った本文は 1MB ほどまとめてから書く
+            f = await datastore_executor.run(tempfile.NamedTemporaryFile, suffix=".parquet")
+            try:
+                buffered, size = [], 0
+                async for chunk in request.stream():
+                    buffered.append(chunk)
+                    size += len(chunk)
+                    if size >= 1 << 20:
+                        await datastore_executor.run(f.write, b"".join(buffered))
+                        buffered, size = [], 0
+                await datastore_executor.run(f.write, b"".join(buffered))
+                await datastore_executor.run(f.flush)
+                imported = await run_limited(limits["write"], datastore_executor,
+                                             bulk_io.import_file, kind, f.name, "parquet")
+            finally:
+                await datastore_executor.run(f.close)
+        else:
+            imported = await _import_ndjson_stream(kind, request)
+    except bulk_io.BulkError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"kind": kind, "imported": imported}
+
+async def _import_ndjson_stream(kind: str, request: Request) -> int:
+    batch_size = PUT_BATCH_SIZE
+    tasks, batch, imported, rest = [], [], 0, b""
+
+    submitted = False
+
+    async def put(rows):
+        return await run_limited(limits["write"], datastore_executor, bulk_io.put_rows, kind, rows)
+
+    try:
+        async for chunk in request.stream():
+            *lines, rest = (rest + chunk).split(b"\n")
+            for row in bulk_io.iter_ndjson_lines(line.decode("utf-8") for line in lines):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    tasks.append(asyncio.ensure_future(put(batch)))
+                    submitted = True
+                    batch = []
+            # 保存待ちが溜まりすぎないよう、一定数ごとに完了を待つ
+            if len(tasks) >= 4:
+                imported += sum(await asyncio.gather(*tasks))
+                tasks = []
+        batch.extend(bulk_io.iter_ndjson_lines([rest.decode("utf-8")]))
+        if batch:
+            tasks.append(asyncio.ensure_future(put(batch)))
+            submitted = True
+        imported += sum(await asyncio.gather(*tasks))
+    finally:
+        if submitted:
+            # 学習用レビューの読み直しの印は、バッチごとではなくインポートの終わりに1回だけ付ける
+            # (途中で失敗した場合は、保存中のバッチが終わるのを待ってから)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await datastore_executor.run(bulk_io.finish_import, kind)
+    return imported
+
+@app.get("/bulk/export/{kind}")
+async def bulk_export(kind: str, format: str = Query("ndjson")):
+    """
+    レビュー・ユーザー・お気に入りの全件を NDJSON か Parquet で返す (カーソルで少しずつ読みながら送る)
     """
-    recommended = recommend_programs(user_id, n_recommendations=n)
-    return {"recommendations": recommended}
\ No newline at end of file
+    if kind not in bulk_io.KINDS:
+        raise HTTPException(status_code=404, detail=f"kind must be one of {', '.join(bulk_io.KINDS)}.")
+    if format not in bulk_io.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(bulk_io.FORMATS)}.")
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/vnd.apache.parquet"
+    return StreamingResponse(bulk_io.stream_export(kind, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'})
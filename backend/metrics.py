@@ -0,0 +1,283 @@
+# metrics.py
+"""
+処理の段階ごとの時間・リクエストの待ち時間のヒストグラムと、キャッシュ・プールの状態を
+Prometheus のテキスト形式で出力する (GET /metrics)。外部ライブラリは使わない。
+METRICS_ENABLED=0 のときは timed がデコレートした関数をそのまま返し、span は何もしない。
+"""
+import bisect
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import config
+
+ENABLED = config.METRICS_ENABLED
+
+# 秒単位のバケットの上限 (Chrome の起動・ページ読み込みから NumPy の計算までを1つの区切りで見る)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """
+    ラベルの値の組ごとに、バケットごとの件数・合計・件数を持つ
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}        # ラベルの値 -> [バケットごとの件数 (+Inf を含む), 合計]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        names = self.labels + ("le",)
+        for key, counts, total in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, key + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class CounterMetric:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+
+class CallbackMetric:
+    """
+    出力するときに fn() を呼んで値を読む (プールの使用数やキャッシュのヒット数など、他のオブジェクトが持つ値)。
+    fn は数値か {ラベルの値のタプル: 数値} を返す。None ならその時点では出力しない
+    """
+
+    def __init__(self, name: str, help: str, fn, labels=(), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        values = self.fn()
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {float(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels=()) -> CounterMetric:
+        return self.register(CounterMetric(name, help, labels))
+
+    def gauge(self, name: str, help: str, fn, labels=(), kind: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, fn, labels, kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"メトリクスの読み取りに失敗しました ({metric.name}): {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+stage_seconds = REGISTRY.histogram("tvsearch_stage_seconds", "Time spent in each processing stage.", ("stage",))
+stage_errors = REGISTRY.counter("tvsearch_stage_errors_total", "Stages that raised an exception.", ("stage",))
+http_seconds = REGISTRY.histogram("tvsearch_http_request_seconds", "HTTP request latency.",
+                                  ("method", "route", "status"))
+
+
+# -------------------
+# 段階ごとの時間
+# -------------------
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_seconds.observe(time.perf_counter() - self.start, self.stage)
+        if exc_type is not None:
+            stage_errors.inc(1.0, self.stage)
+        return False
+
+
+_NOOP = contextlib.nullcontext()
+
+
+def span(stage: str):
+    """
+    with span("scrape.collect_links"): ... の所要時間を tvsearch_stage_seconds{stage=...} に記録する
+    """
+    return _Span(stage) if ENABLED else _NOOP
+
+
+def timed(stage: str):
+    """
+    関数の所要時間を stage として記録するデコレータ。無効なときは関数をそのまま返す
+    """
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# -------------------
+# リクエスト単位のプロファイラ
+# -------------------
+# 待機中 (仕事の無い) スレッドのサンプルは捨てる
+_IDLE_FRAMES = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get"),
+                ("threading.py", "_wait_for_tstate_lock")}
+_profile_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """
+    interval 秒ごとに全スレッドのスタックを読み、"関数;関数;... 回数" の形式 (flamegraph.pl / speedscope で読める)
+    で数える。with の間だけ裏のスレッドで動く。同じ時間に動いている他のリクエストの処理も含まれる
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        # 短いリクエストでも1回は読むよう、待つ前に読む
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                return
+
+    def _sample(self):
+        me = threading.get_ident()
+        self.samples += 1
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@contextlib.contextmanager
+def profile_request(name: str):
+    """
+    1つのリクエストの間だけ SamplingProfiler を動かし、PROFILE_DIR にファイルとして書き出す。
+    他のリクエストをプロファイル中なら何もしない (None を返す)
+    """
+    if not _profile_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        profiler = SamplingProfiler(config.PROFILE_INTERVAL)
+        result = {"path": None, "samples": 0}
+        with profiler:
+            yield result
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_") or "root"
+        path = os.path.join(config.PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}.folded")
+        with open(path, "w") as f:
+            f.write(profiler.folded())
+        result.update(path=path, samples=profiler.samples)
+    finally:
+        _profile_lock.release()
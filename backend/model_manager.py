@@ -0,0 +1,277 @@
+# model_manager.py
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス間のロックは使わない
+    fcntl = None
+
+FORMAT_VERSION = 1
+
+
+class ModelStore:
+    """
+    学習済みモデルをバージョン付きのディレクトリとして保存する。
+    - model-<version>/ に、配列を持つ部品 (arrays() を持つもの。因子行列・ID の対応表・番組の索引) を
+      部品名.配列名.npy として、それ以外の値を meta.json に書く
+    - 読み込みは np.load(mmap_mode="r") で行うので、配列はコピーされず、同じファイルを読む複数のプロセス
+      (uvicorn の worker) はページキャッシュを共有する。部品は loaders[部品名](配列, meta, モデル) で作り直す
+    - 一時ディレクトリに書いてから os.replace で model-<version>/ にし、最後に CURRENT に現在のバージョン名を書く
+      (これも一時ファイル + os.replace) ので、読み手が書きかけのモデルを見ることはない
+    - 古い形式 (model-<version>.pkl) も読める
+    """
+
+    def __init__(self, directory: str, keep_versions: int = 3, loaders: dict = None):
+        self.directory = Path(directory)
+        self.keep_versions = keep_versions
+        self.loaders = loaders or {}
+
+    @property
+    def pointer_path(self) -> Path:
+        return self.directory / "CURRENT"
+
+    def new_version(self) -> str:
+        return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+    def save(self, model: dict) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        version = model["version"]
+        tmp = self.directory / f".model-{version}.{os.getpid()}.tmp"
+        tmp.mkdir()
+        meta = {"format": FORMAT_VERSION, "fields": {}, "datetimes": [], "components": {}}
+        for key, value in model.items():
+            if hasattr(value, "arrays"):
+                for name, array in value.arrays().items():
+                    with open(tmp / f"{key}.{name}.npy", "wb") as f:
+                        np.save(f, np.asarray(array))
+                        f.flush()
+                        os.fsync(f.fileno())
+                meta["components"][key] = value.meta() if hasattr(value, "meta") else {}
+            elif isinstance(value, datetime):
+                meta["fields"][key] = value.isoformat()
+                meta["datetimes"].append(key)
+            else:
+                meta["fields"][key] = value
+        self._atomic_write(tmp / "meta.json", json.dumps(meta).encode())
+        os.replace(tmp, self.directory / f"model-{version}")
+        self._atomic_write(self.pointer_path, version.encode())
+        self._prune()
+        return version
+
+    def current_version(self):
+        try:
+            return self.pointer_path.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self, version: str = None):
+        version = version or self.current_version()
+        if version is None:
+            return None
+        path = self.directory / f"model-{version}"
+        if not path.is_dir():
+            with open(self.directory / f"model-{version}.pkl", "rb") as f:
+                return pickle.load(f)
+        meta = json.loads((path / "meta.json").read_text())
+        model = dict(meta["fields"])
+        for key in meta["datetimes"]:
+            model[key] = datetime.fromisoformat(model[key])
+        for key, component in meta["components"].items():
+            arrays = {file.name[len(key) + 1:-len(".npy")]: np.load(file, mmap_mode="r")
+                      for file in path.glob(f"{key}.*.npy")}
+            if key not in self.loaders:
+                raise ValueError(f"No loader for model component: {key}")
+            model[key] = self.loaders[key](arrays, component, model)
+        return model
+
+    @contextmanager
+    def training_lock(self):
+        """
+        複数のプロセスのうち1つだけが学習するためのファイルロック。他のプロセスが持っていれば False を返す
+        """
+        if fcntl is None:
+            yield True
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".train.lock", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _atomic_write(self, path: Path, data: bytes):
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _prune(self):
+        # 読み込み中のプロセスが mmap している古いバージョンを消しても、そのプロセスは閉じるまで読める
+        versions = sorted(self.directory.glob("model-*"), key=lambda p: p.stat().st_mtime)
+        for path in versions[:-self.keep_versions]:
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ModelManager:
+    """
+    推薦モデルのライフサイクルを管理する。
+    - 起動時に保存済みの現在のモデルを読み込む
+    - 裏のスレッドで、一定時間ごと or 新しいレビューが K 件たまったら再学習する
+    - 他のプロセスが新しいバージョンを保存した場合も読み込み直す
+    - 新しいモデルへの差し替えは参照の入れ替え1回で行うので、リクエスト側は常に完全なモデルを見る
+    """
+
+    def __init__(self, train_fn, store: ModelStore, retrain_interval: float = 3600.0,
+                 retrain_after_reviews: int = 50, check_interval: float = 10.0,
+                 train_enabled: bool = True):
+        self.train_fn = train_fn
+        self.store = store
+        self.retrain_interval = retrain_interval
+        self.retrain_after_reviews = retrain_after_reviews
+        self.check_interval = check_interval
+        # False のプロセスは学習せず、他が保存した新しいバージョンを読み込むだけ
+        self.train_enabled = train_enabled
+        self._model = None
+        self._pending_reviews = 0
+        self._last_trained = 0.0
+        self._lock = threading.Lock()
+        self._train_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    @property
+    def current(self):
+        return self._model
+
+    @property
+    def version(self):
+        model = self._model
+        return model["version"] if model else None
+
+    def start(self, background: bool = True):
+        self.reload()
+        if background and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-manager", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def notify_new_review(self, count: int = 1):
+        """
+        レビューが追加されたときに呼ぶ。K 件たまると次の確認で再学習する
+        """
+        with self._lock:
+            self._pending_reviews += count
+
+    def add_listener(self, fn):
+        """
+        モデルが差し替わるたびに fn(model) を呼ぶ (推薦結果の事前計算など)
+        """
+        self._listeners.append(fn)
+
+    def swap(self, model: dict):
+        self._model = model
+        print(f"推薦モデルを切り替えました: {model['version']}")
+        for fn in self._listeners:
+            try:
+                fn(model)
+            except Exception as e:
+                print(f"モデル切り替え後の処理に失敗しました: {e}")
+
+    def reload(self) -> bool:
+        """
+        CURRENT が指すバージョンが手元のモデルと違えば読み込み直す
+        """
+        version = self.store.current_version()
+        if version is None or version == self.version:
+            return False
+        try:
+            model = self.store.load(version)
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError) as e:
+            print(f"推薦モデルの読み込みに失敗しました ({version}): {e}")
+            return False
+        with self._lock:
+            trained_at = model.get("trained_at_ts", 0.0)
+            if trained_at > self._last_trained:
+                # 他のプロセスが学習した新しいモデル: それまでのレビューは学習済みとみなす
+                self._last_trained = trained_at
+                self._pending_reviews = 0
+        self.swap(model)
+        return True
+
+    def train_now(self):
+        """
+        学習して保存し、差し替える。同時に複数回は走らない
+        """
+        with self._train_lock:
+            with self._lock:
+                pending = self._pending_reviews
+            start = time.monotonic()
+            model = self.train_fn()
+            if model is None:
+                # 学習できるデータが無い: 次の時間 or K 件たまるまで待つ
+                with self._lock:
+                    self._pending_reviews -= pending
+                    self._last_trained = time.time()
+                return None
+            model["version"] = self.store.new_version()
+            model["trained_at_ts"] = time.time()
+            model["train_seconds"] = time.monotonic() - start
+            self.store.save(model)
+            with self._lock:
+                self._pending_reviews -= pending
+                self._last_trained = model["trained_at_ts"]
+            self.swap(model)
+            return model
+
+    def should_retrain(self) -> bool:
+        with self._lock:
+            pending = self._pending_reviews
+        if self._model is None and self._last_trained == 0.0:
+            return True
+        if pending >= self.retrain_after_reviews:
+            return True
+        return time.time() - self._last_trained >= self.retrain_interval
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.reload()
+                if self.train_enabled and self.should_retrain():
+                    # 複数の worker が同じ MODEL_DIR を使う場合は、ロックを取れた1つだけが学習する
+                    with self.store.training_lock() as acquired:
+                        if acquired:
+                            self.train_now()
+            except Exception as e:
+                print(f"推薦モデルの学習に失敗しました: {e}")
+            self._stop.wait(self.check_interval)
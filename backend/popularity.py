@@ -0,0 +1,270 @@
+# popularity.py
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timezone
+
+# 集計の種類: all (全期間のレビュー数) / 24h / 7d (直近のレビュー数) / decayed (時間減衰スコア)
+WINDOWS = {"24h": 24 * 3600, "7d": 7 * 24 * 3600}
+MODES = ("all", "decayed") + tuple(WINDOWS)
+
+
+def _timestamp(value) -> float:
+    if value is None:
+        return time.time()
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class _TopK:
+    """
+    増えるだけのスコアについて、上位 size 件を (-score, program_id) の昇順で並べたまま持つ。
+    上位にない番組は、自分のスコアが増えたときにしか上位に入れないので、update だけで上位を保てる
+    """
+
+    def __init__(self, size: int, values=None):
+        self.size = size
+        # 同点は program_id 順にして結果を安定させる
+        self.items = heapq.nsmallest(size, ((-score, pid) for pid, score in (values or {}).items()))
+        self.scores = {pid: -neg for neg, pid in self.items}
+
+    def update(self, program_id: str, score: float):
+        old = self.scores.get(program_id)
+        if old is not None:
+            del self.items[bisect_left(self.items, (-old, program_id))]
+        elif len(self.items) >= self.size and (-score, program_id) >= self.items[-1]:
+            return
+        insort(self.items, (-score, program_id))
+        self.scores[program_id] = score
+        if len(self.items) > self.size:
+            _, dropped = self.items.pop()
+            del self.scores[dropped]
+
+    def scale(self, factor: float):
+        # 全体に同じ係数を掛けても並びはほぼ変わらないが、丸めで同点になったものは program_id 順に並べ直す
+        self.items = sorted((neg * factor, pid) for neg, pid in self.items)
+        self.scores = {pid: -neg for neg, pid in self.items}
+
+    def ranking(self, n: int):
+        return [(pid, -neg) for neg, pid in self.items[:n]]
+
+
+class _State:
+    """
+    集計値の本体。作り直しのときは新しい _State を作ってから丸ごと差し替える
+    """
+
+    def __init__(self, anchor: float):
+        self.counts = Counter()
+        self.titles = {}
+        # decayed スコアは 2^((t - anchor) / half_life) の和として持つ (anchor 時点の値)
+        self.anchor = anchor
+        self.decayed = Counter()
+        # 1時間ごとのレビュー数: bucket番号 -> Counter(program_id)
+        self.buckets = {}
+        # 集計の種類ごとの上位: mode -> _TopK (作り直しの読み込み中は None)
+        self.rankings = None
+        # 期間集計の今の範囲: mode -> (bucket の epoch, 範囲の最初の bucket) と、その範囲のレビュー数
+        self.windows = {}
+        self.window_counts = {}
+
+
+class PopularityIndex:
+    """
+    番組ごとのレビュー数をメモリ上に集計し、人気順の上位N件をすぐに返す。
+    - add: レビュー投稿時に1件ずつ加算する
+    - rebuild: 全レビューから作り直す (起動時と定期的な復旧用)
+    - top: 集計の種類ごとに上位 top_k 件を並べたまま持ち、add のたびにその番組の位置だけ直す。
+      期間集計は bucket が進んで範囲から外れるレビューが出たときだけ並べ直す
+    """
+
+    def __init__(self, half_life_hours: float = 72.0, bucket_seconds: int = 3600, top_k: int = 1000):
+        self.half_life = half_life_hours * 3600
+        self.bucket_seconds = bucket_seconds
+        self.top_k = top_k
+        self._state = _State(anchor=time.time())
+        self._rank(self._state, time.time())
+        self._lock = threading.Lock()
+        self._rebuilding = None
+        self.last_rebuilt = None
+
+    def add(self, program_id: str, program_title: str = None, created_at=None, review_id: str = None):
+        ts = _timestamp(created_at)
+        with self._lock:
+            self._add(self._state, program_id, program_title, ts)
+            if self._rebuilding is not None:
+                # 作り直し中に届いたレビューは、作り直しの結果に後から反映する
+                self._rebuilding.append((review_id, program_id, program_title, ts))
+
+    def rebuild(self, reviews):
+        """
+        reviews: (review_id, program_id, program_title, created_at) のイテラブル
+        """
+        started = time.time()
+        with self._lock:
+            self._rebuilding = []
+        state = _State(anchor=started)
+        recent_ids = set()
+        try:
+            for review_id, program_id, program_title, created_at in reviews:
+                ts = _timestamp(created_at)
+                self._add(state, program_id, program_title, ts)
+                if ts >= started - 60:
+                    recent_ids.add(review_id)
+        except BaseException:
+            # 途中までの集計では差し替えない
+            with self._lock:
+                self._rebuilding = None
+            raise
+        # 並べ替えは差し替える前にここで済ませ、top の呼び出しでは行わない
+        self._rank(state, time.time())
+        with self._lock:
+            pending, self._rebuilding = self._rebuilding, None
+            # 読み込みと重なったレビューは、読み込み結果に含まれていなければ加算する
+            for review_id, program_id, program_title, ts in pending:
+                if review_id is None or review_id not in recent_ids:
+                    self._add(state, program_id, program_title, ts)
+            self._state = state
+            self.last_rebuilt = datetime.utcnow()
+
+    def top(self, n: int = 10, mode: str = "all"):
+        """
+        [(program_id, title, score)] を人気順で返す。score は mode に応じたレビュー数またはスコア
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown popularity mode: {mode}")
+        now = time.time()
+        with self._lock:
+            state = self._state
+            # 期間集計は時間が経つと範囲から外れるレビューが出るので、bucket が進んだら並べ直す
+            if mode in WINDOWS and state.windows[mode][0] != int(now // self.bucket_seconds):
+                self._rank_window(state, mode, now)
+            if n <= self.top_k:
+                ranking = state.rankings[mode].ranking(n)
+            else:
+                ranking = self._sort(state, mode, now)[:n]
+        if mode == "decayed":
+            scale = 2 ** ((state.anchor - now) / self.half_life)
+            return [(pid, state.titles.get(pid), score * scale) for pid, score in ranking]
+        return [(pid, state.titles.get(pid), score) for pid, score in ranking]
+
+    def count(self, program_id: str) -> int:
+        return self._state.counts.get(program_id, 0)
+
+    def _add(self, state: _State, program_id: str, program_title: str, ts: float):
+        if not program_id:
+            return
+        state.counts[program_id] += 1
+        if program_title:
+            state.titles[program_id] = program_title
+        exponent = (ts - state.anchor) / self.half_life
+        if exponent > 500:
+            # 値が大きくなりすぎないよう、基準時刻を進めて全体を縮める
+            self._rebase(state, ts)
+            exponent = 0.0
+        state.decayed[program_id] += 2 ** exponent
+        bucket = int(ts // self.bucket_seconds)
+        if state.rankings is not None:
+            state.rankings["all"].update(program_id, state.counts[program_id])
+            state.rankings["decayed"].update(program_id, state.decayed[program_id])
+            for mode, (_, first) in state.windows.items():
+                if bucket >= first:
+                    window = state.window_counts[mode]
+                    window[program_id] += 1
+                    state.rankings[mode].update(program_id, window[program_id])
+        oldest = int((time.time() - max(WINDOWS.values())) // self.bucket_seconds)
+        if bucket < oldest:
+            return
+        counts = state.buckets.get(bucket)
+        if counts is None:
+            counts = state.buckets[bucket] = Counter()
+            # 新しい bucket を作るときに、最長の期間より古い bucket を捨てる
+            for b in [b for b in state.buckets if b < oldest]:
+                del state.buckets[b]
+        counts[program_id] += 1
+
+    def _rebase(self, state: _State, anchor: float):
+        scale = 2 ** ((state.anchor - anchor) / self.half_life)
+        for pid in state.decayed:
+            state.decayed[pid] *= scale
+        if state.rankings is not None:
+            state.rankings["decayed"].scale(scale)
+        state.anchor = anchor
+
+    def _rank(self, state: _State, now: float):
+        state.rankings = {
+            "all": _TopK(self.top_k, state.counts),
+            "decayed": _TopK(self.top_k, state.decayed),
+        }
+        for mode in WINDOWS:
+            self._rank_window(state, mode, now)
+
+    def _rank_window(self, state: _State, mode: str, now: float):
+        first = int((now - WINDOWS[mode]) // self.bucket_seconds) + 1
+        counts = Counter()
+        for bucket, bucket_counts in state.buckets.items():
+            if bucket >= first:
+                counts.update(bucket_counts)
+        state.windows[mode] = (int(now // self.bucket_seconds), first)
+        state.window_counts[mode] = counts
+        state.rankings[mode] = _TopK(self.top_k, counts)
+
+    def _sort(self, state: _State, mode: str, now: float):
+        if mode == "all":
+            values = state.counts
+        elif mode == "decayed":
+            values = state.decayed
+        else:
+            first = int((now - WINDOWS[mode]) // self.bucket_seconds) + 1
+            values = Counter()
+            for bucket, counts in state.buckets.items():
+                if bucket >= first:
+                    values.update(counts)
+        # 同点は program_id 順にして結果を安定させる
+        return sorted(values.items(), key=lambda item: (-item[1], item[0]))
+
+
+class PopularityRebuilder:
+    """
+    起動時と一定間隔ごとに、全レビューから PopularityIndex を作り直す
+    """
+
+    def __init__(self, index: PopularityIndex, load_reviews, interval: float = 900.0):
+        self.index = index
+        self.load_reviews = load_reviews
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        # 最初の作り直しが終わったらセットされる
+        self.ready = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="popularity-rebuild", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def rebuild_now(self):
+        start = time.monotonic()
+        self.index.rebuild(self.load_reviews())
+        self.ready.set()
+        print(f"人気番組の集計を作り直しました ({time.monotonic() - start:.2f}s)")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.rebuild_now()
+            except Exception as e:
+                print(f"人気番組の集計に失敗しました: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,84 @@
+# program_catalog.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import config
+import database
+from cache import MemoryBackend
+
+# 保存先の前に置くプロセス内キャッシュ (program_id -> 番組情報)
+_cache = MemoryBackend(max_size=config.PROGRAM_CACHE_SIZE)
+# スクレイピング結果の保存は検索のレスポンスを待たせないよう裏で行う
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="program-catalog")
+_listeners = []
+
+
+def program_id_from_url(url: str) -> str:
+    """
+    詳細ページの URL から番組IDを取り出す (フロントエンドと同じ規則)
+    """
+    return url.split("/tv_events/")[-1]
+
+
+def add_listener(fn):
+    """
+    番組を保存するたびに fn(programs) を呼ぶ (検索の索引の更新など)
+    """
+    _listeners.append(fn)
+
+
+def save_programs(programs: List[dict]):
+    """
+    番組情報をまとめて保存先に保存し、キャッシュも更新する
+    """
+    if not programs:
+        return
+    database.upsert_programs(programs)
+    for program in programs:
+        _cache.set(program["program_id"], _public_fields(program), 0)
+    for fn in _listeners:
+        try:
+            fn(programs)
+        except Exception as e:
+            print(f"番組の保存後の処理に失敗しました: {e}")
+
+
+def save_programs_async(programs: List[dict]):
+    def save():
+        try:
+            save_programs(programs)
+        except Exception as e:
+            print(f"番組情報の保存に失敗しました: {e}")
+
+    if programs:
+        _write_executor.submit(save)
+
+
+def get_programs(program_ids: List[str]) -> Dict[str, dict]:
+    """
+    {program_id: 番組情報} を返す。キャッシュに無いものだけを1回の get_multi で取りに行く。
+    """
+    found = {}
+    missing = []
+    for pid in program_ids:
+        item = _cache.get(pid)
+        if item is not None:
+            found[pid] = item[0]
+        else:
+            missing.append(pid)
+    if missing:
+        for pid, program in database.get_programs(missing).items():
+            program = _public_fields(program)
+            _cache.set(pid, program, 0)
+            found[pid] = program
+    return found
+
+
+def _public_fields(program: dict) -> dict:
+    return {
+        "program_id": program["program_id"],
+        "url": program.get("url"),
+        "title": program.get("title"),
+        "supplement": program.get("supplement"),
+        "cast_names": list(program.get("cast_names") or []),
+    }
@@ -0,0 +1,75 @@
+# rate_limit.py
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    attempt 回目 (0 始まり) の再試行までの待ち秒数。
+    指数バックオフ (base * 2^attempt、最大 cap) の範囲から一様に選ぶ (full jitter)。
+    失敗した処理が同時に再試行しないよう揺らす
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    1秒あたり rate 個たまり、最大 burst 個まで持てるトークンのバケット
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0, timeout: float = None) -> bool:
+        """
+        トークンが tokens 個 (最大 burst 個) たまるまで待って取る。timeout 秒待っても足りなければ False
+        """
+        tokens = min(tokens, self.burst)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class HostRateLimiter:
+    """
+    ホストごとに TokenBucket を持ち、同じホストへのリクエスト数を rate 件/秒に抑える
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        # トークンを待った合計秒数
+        self.waited = 0.0
+
+    def acquire(self, url: str, tokens: float = 1.0, timeout: float = None) -> bool:
+        host = urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        start = time.monotonic()
+        acquired = bucket.acquire(tokens, timeout)
+        with self._lock:
+            self.waited += time.monotonic() - start
+        return acquired
@@ -1,123 +1,344 @@
 # recommendation.py
-import pandas as pd
-from surprise import Dataset, Reader, SVD
-from surprise.model_selection import train_test_split
+import threading
+import time
+from datetime import datetime
 
-from database import client  # Datastoreクライアント
+from database import iter_review_events, get_favorites, get_user_ratings, scan_programs, scan_ratings
+from training_data import RatingsTable
+from program_catalog import get_programs
+from model_manager import ModelManager, ModelStore
+from factorization import ALSModel
+from scoring import FactorScorer
+from item_index import ModelIndex
+from recommendation_store import RecommendationStore
+from review_sync import ReviewSync
+from popularity import PopularityIndex, PopularityRebuilder
+from content import ContentRebuilder
+from metrics import span, timed
+import config
 # from scraper import get_program_details_from_scraper  # 必要ならスクレイピング用の関数を使う
 
+# 学習用のレビュー (列ごとの配列)。再学習のたびに前回からの差分だけを読み込む
+ratings_table = RatingsTable(batch_size=config.REVIEW_SCAN_BATCH_SIZE, overlap=config.TRAINING_SCAN_OVERLAP,
+                             full_rescan_interval=config.TRAINING_FULL_RESCAN_INTERVAL)
+
+
 def get_all_reviews():
     """
     全レビューを取得し、(user_id, program_id, rating) のタプルのリストとして返す。
     """
-    query = client.query(kind='Review')
-    results = list(query.fetch())
-    all_reviews = []
-    for r in results:
-        user_id = r.get('user_id')
-        program_id = r.get('program_id')
-        rating = r.get('rating')
-        if user_id and program_id and rating:
-            all_reviews.append((user_id, program_id, float(rating)))
-    return all_reviews
-
-def get_popular_programs(n=10):
-    """
-    「人気番組」を返すための簡易実装。
-    ここでは「レビュー数が多い番組」を上位N件取得する例。
-    実装の仕方は自由に変更可能。
-    """
-    query = client.query(kind='Review')
-    results = list(query.fetch())
-    
-    # program_id -> レビュー数, 最新のタイトル(上書きするだけ)
-    count_dict = {}
-    title_map = {}
-    
-    for r in results:
-        pid = r.get('program_id')
-        ptitle = r.get('program_title', 'No Title')
-        if pid:
-            count_dict[pid] = count_dict.get(pid, 0) + 1
-            # 同じprogram_idでも最後に見つかったタイトルで更新しているだけ
-            title_map[pid] = ptitle
-
-    # レビュー数の多い順にソート
-    sorted_programs = sorted(count_dict.items(), key=lambda x: x[1], reverse=True)
-    top_program_ids = [pid for (pid, _) in sorted_programs[:n]]
-    
+    ratings_table.refresh()
+    return ratings_table.to_tuples()
+
+popularity_index = PopularityIndex(half_life_hours=config.POPULARITY_HALF_LIFE_HOURS)
+popularity_rebuilder = PopularityRebuilder(popularity_index, iter_review_events,
+                                           interval=config.POPULARITY_REBUILD_INTERVAL)
+
+
+def load_all_programs():
+    programs = []
+    for batch in scan_programs():
+        programs.extend(batch)
+    return programs
+
+content_rebuilder = ContentRebuilder(load_all_programs, interval=config.CONTENT_REBUILD_INTERVAL,
+                                     text_weight=config.CONTENT_TEXT_WEIGHT,
+                                     cast_weight=config.CONTENT_CAST_WEIGHT)
+
+
+def get_content_recommendations(user_id, n=10):
+    """
+    お気に入りとレビュー済みの番組に内容 (タイトル・補足・出演者) が近い番組を返す。
+    - お気に入りは重み 2、レビューは rating - 2.5 (低評価の番組に近いものは下がる)
+    - 内容の索引が無い、または手がかりになる番組が無ければ空のリスト
+    """
+    index = content_rebuilder.index
+    if index is None:
+        return []
+    seeds = {}
+    for pid, rating in get_user_ratings(user_id):
+        seeds[pid] = seeds.get(pid, 0.0) + (float(rating or 0) - 2.5)
+    for pid in get_favorites(user_id):
+        seeds[pid] = seeds.get(pid, 0.0) + 2.0
+    if not any(weight > 0 for weight in seeds.values()):
+        return []
+    return index.recommend(seeds, n)
+
+
+def get_popular_programs(n=10, mode=None):
+    """
+    「人気番組」を上位N件返す。
+    集計は popularity_index がメモリ上に持ち、レビュー投稿時に加算・定期的に全件から作り直す。
+    mode: all (レビュー数) / 24h / 7d (直近のレビュー数) / decayed (時間減衰スコア)
+    """
+    mode = mode or config.POPULARITY_MODE
+    if popularity_index.last_rebuilt is None:
+        # 起動直後は最初の集計が終わるまで少しだけ待つ
+        popularity_rebuilder.ready.wait(timeout=5)
+
     # 人気番組リストを作成
     popular_programs = []
-    for pid in top_program_ids:
+    for pid, title, score in popularity_index.top(n, mode):
+        if mode == "decayed":
+            supplement = f"人気番組 (スコア: {score:.1f})"
+        elif mode == "all":
+            supplement = f"人気番組 (レビュー数: {score})"
+        else:
+            supplement = f"人気番組 (直近{mode}のレビュー数: {score})"
         popular_programs.append({
             'program_id': pid,
-            'title': title_map.get(pid, f'Program {pid}'),
-            # サンプルとして補足情報を適当に入れる
-            'supplement': f"人気番組 (レビュー数: {count_dict[pid]})"
+            'title': title or f'Program {pid}',
+            'supplement': supplement
         })
     return popular_programs
 
 def get_program_details_by_ids(program_ids):
     """
     取得した番組IDをもとに、番組の詳細情報をまとめて返す。
-    - 本当は DBに番組情報を保存しておき、そこから取得するのが望ましい。
-    - ここでは「タイトルやサプリメント情報が無い場合はダミーを入れる」例。
-    - もしくはスクレイピング関数 get_program_details_from_scraper(pid) で補完することも可能。
+    - 番組カタログ (スクレイピング時に保存した Program) から1回のまとめ取得で引く
+    - カタログに無い番組はダミーを入れる
     """
+    catalog = get_programs(program_ids)
     details = []
     for pid in program_ids:
-        # ここで DB or 別のAPI から詳細を取る処理が書ければベスト。
-        # 例: detail = get_program_details_from_db(pid)
-        #     if not detail: detail = get_program_details_from_scraper(pid)
-        
-        # 今はダミー実装: 見つからなかったらデフォルト値を挿入
-        details.append({
-            'program_id': pid,
-            'title': f"Program {pid}",
-            'supplement': f"Details of Program {pid}"
-        })
+        program = catalog.get(pid)
+        if program:
+            details.append(program)
+        else:
+            details.append({
+                'program_id': pid,
+                'title': f"Program {pid}",
+                'supplement': f"Details of Program {pid}"
+            })
     return details
 
+def new_model() -> ALSModel:
+    return ALSModel(factors=config.MODEL_FACTORS, regularization=config.MODEL_REGULARIZATION,
+                    iterations=config.MODEL_ITERATIONS, workers=config.MODEL_TRAIN_WORKERS)
+
+
+@timed("model.train")
+def train_model():
+    """
+    全レビューから行列分解モデル (ALS) を学習し、推薦に必要な情報とまとめて返す。
+    レビューが無ければ None。
+    - レビューはすべて学習に使う (精度の確認は evaluate_model.py で別に行う)
+    """
+    ratings_table.refresh()
+    if not len(ratings_table):
+        return None
+    matrix = ratings_table.to_matrix()
+    with span("model.fit"):
+        model = new_model().fit(matrix)
+
+    # 因子・バイアスを配列に取り出し、推薦時は NumPy でまとめてスコア計算する
+    scorer = model.to_scorer(matrix)
+    # 番組ベクトルの索引も学習したプロセスで作ってモデルと一緒に保存し、各 worker は読むだけにする
+    index = ModelIndex(scorer, n_lists=config.ITEM_INDEX_LISTS, n_probe=config.ITEM_INDEX_PROBE,
+                       min_items=config.ITEM_INDEX_MIN_ITEMS)
+
+    return {
+        'scorer': scorer,
+        'index': index,
+        'n_reviews': len(ratings_table),
+        'trained_at': datetime.utcnow(),
+    }
+
+
+def _load_scorer(arrays, meta, model):
+    return FactorScorer.from_arrays(arrays, meta)
+
+
+def _load_index(arrays, meta, model):
+    return ModelIndex.from_arrays(model['scorer'], arrays, model.get('version'), n_probe=config.ITEM_INDEX_PROBE)
+
+
+# 保存したモデルの配列は mmap で読むので、複数の worker で同じファイルを共有する
+model_manager = ModelManager(
+    train_model,
+    ModelStore(config.MODEL_DIR, keep_versions=config.MODEL_KEEP_VERSIONS,
+               loaders={'scorer': _load_scorer, 'index': _load_index}),
+    retrain_interval=config.MODEL_RETRAIN_INTERVAL,
+    retrain_after_reviews=config.MODEL_RETRAIN_AFTER_REVIEWS,
+    train_enabled=config.MODEL_TRAIN_IN_PROCESS,
+)
+
+
+# 現在のモデルの番組ベクトルの索引 (似ている番組・推薦候補の取得用)
+item_index = None
+
+
+def build_item_index(model):
+    """
+    モデルが切り替わったら、番組ベクトルの索引を差し替える (古い形式のモデルなど、索引が無ければ作る)
+    """
+    global item_index
+    start = time.perf_counter()
+    index = model.get('index')
+    if index is None:
+        index = ModelIndex(model['scorer'], n_lists=config.ITEM_INDEX_LISTS,
+                           n_probe=config.ITEM_INDEX_PROBE, min_items=config.ITEM_INDEX_MIN_ITEMS)
+    index.version = model['version']
+    item_index = index
+    print(f"番組の索引を用意しました: {model['scorer'].n_items} programs, "
+          f"{index.similar_index.n_lists or '全件'} lists ({time.perf_counter() - start:.2f}s)")
+
+
+model_manager.add_listener(build_item_index)
+
+
+recommendation_store = RecommendationStore(top_n=config.RECOMMENDATION_STORE_TOP_N)
+# 現在のモデルの学習後に投稿されたレビュー (user_id -> program_id の集合)
+_recent_reviews = {}
+_recent_reviews_lock = threading.Lock()
+# 他の worker が保存したレビューを読み、このプロセスの事前計算・集計に反映する (on_reviews_saved)
+review_sync = ReviewSync(scan_ratings, interval=config.REVIEW_SYNC_INTERVAL, overlap=config.REVIEW_SYNC_OVERLAP,
+                         batch_size=config.REVIEW_SCAN_BATCH_SIZE)
+
+
+def precompute_recommendations(model):
+    """
+    モデルが切り替わったら、レビューが5件以上ある全ユーザーの推薦結果を裏でまとめて計算する
+    """
+    scorer = model['scorer']
+    with _recent_reviews_lock:
+        _recent_reviews.clear()
+    user_ids = scorer.users_with_reviews(5)
+    recommendation_store.rebuild_async(scorer, user_ids, model['version'])
+
+
+model_manager.add_listener(precompute_recommendations)
+
+
+def on_review_added(user_id, program_id, program_title=None, review_id=None):
+    """
+    レビュー投稿時に呼ぶ。人気番組の集計に加算し、そのユーザーの事前計算結果を捨て、再学習のカウントを進める
+    """
+    popularity_index.add(program_id, program_title, review_id=review_id)
+    if review_id:
+        review_sync.mark_seen(review_id)
+    with _recent_reviews_lock:
+        _recent_reviews.setdefault(user_id, set()).add(program_id)
+    recommendation_store.invalidate(user_id)
+    model_manager.notify_new_review()
+
+
+def on_reviews_saved(reviews):
+    """
+    一括インポートしたレビューや、他の worker が保存したレビュー (fields の辞書のリスト) ごとに
+    on_review_added と同じ処理をする。人気番組の集計にはレビューの created_at で加算する
+    (同じレビューを入れ直した分は、集計の作り直しで直る)
+    """
+    for fields in reviews:
+        popularity_index.add(fields['program_id'], fields.get('program_title'), created_at=fields.get('created_at'),
+                             review_id=fields['review_id'])
+        review_sync.mark_seen(fields['review_id'], fields.get('created_at'))
+        with _recent_reviews_lock:
+            _recent_reviews.setdefault(fields['user_id'], set()).add(fields['program_id'])
+        recommendation_store.invalidate(fields['user_id'])
+    model_manager.notify_new_review(len(reviews))
+
+
+review_sync.add_listener(on_reviews_saved)
+
+
+@timed("recommend.user")
+def get_user_recommendations(user_id, n_recommendations=10):
+    """
+    推薦結果を、計算に使ったモデルのバージョン・計算時刻と一緒に返す。
+    1) 事前計算済みの結果があればそれを返す (source="precomputed")
+    2) 無ければ現在のモデルでその場で計算して保存する (source="model")
+    3) レビューが5件未満 (またはモデル未学習) なら、内容の近い番組 (source="content")、
+       それも無ければ人気番組を返す (source="popular")
+    """
+    model = model_manager.current
+    scorer = model['scorer'] if model else None
+    with _recent_reviews_lock:
+        recent = set(_recent_reviews.get(user_id, ()))
+
+    entry = recommendation_store.get(user_id, model['version']) if model else None
+    # 計算中にこのユーザーのレビューが届いたら、計算した結果は保存しない
+    generation = recommendation_store.generation
+    source = "precomputed"
+    if entry is None or entry['limit'] < n_recommendations:
+        # コールドスタート対策: レビュー数が5件未満 (またはモデル未学習) なら、
+        # お気に入り・レビュー済みの番組に内容が近い番組を返し、足りない分は人気番組で埋める
+        if scorer is None or scorer.n_seen(user_id) + len(recent) < 5:
+            with span("recommend.content"):
+                content = get_content_recommendations(user_id, n_recommendations)
+            recommendations = get_program_details_by_ids([pid for (pid, _) in content])
+            if len(recommendations) < n_recommendations:
+                chosen = {pid for (pid, _) in content}
+                popular = get_popular_programs(n_recommendations + len(chosen))
+                recommendations += [p for p in popular if p['program_id'] not in chosen]
+            return {
+                'recommendations': recommendations[:n_recommendations],
+                'model_version': None,
+                'computed_at': datetime.utcnow().isoformat(),
+                'source': 'content' if content else 'popular',
+            }
+        # 未レビューの番組のうち、予測スコアの高い上位N件を取得 (学習後に投稿されたレビューも除く)
+        limit = max(n_recommendations, recommendation_store.top_n)
+        top_n = None
+        index = item_index
+        with span("recommend.score"):
+            if index is not None and index.version == model['version']:
+                # 番組ベクトルの索引から候補を取る (足りなければ全番組のスコアを計算する)
+                top_n = index.candidates(user_id, limit + len(recent))
+            if top_n is None or len(top_n) < limit + len(recent):
+                top_n = scorer.top_n(user_id, limit + len(recent))
+        program_ids = [pid for (pid, _) in top_n if pid not in recent][:limit]
+        entry = recommendation_store.put(user_id, program_ids, model['version'], limit=limit, generation=generation)
+        source = "model"
+
+    # 番組詳細の取得 (番組カタログ)
+    recommended_ids = entry['program_ids'][:n_recommendations]
+    with span("recommend.program_details"):
+        recommendations = get_program_details_by_ids(recommended_ids)
+    return {
+        'recommendations': recommendations,
+        'model_version': entry['model_version'],
+        'computed_at': entry['computed_at'],
+        'source': source,
+    }
+
+
+@timed("recommend.similar")
+def get_similar_programs(program_id, n=10):
+    """
+    推薦モデルの番組ベクトルが近い番組を、類似度 (コサイン) と一緒に返す。
+    モデルが無い、またはモデルに含まれない番組なら None
+    """
+    index = item_index
+    if index is None:
+        return None
+    similar = index.similar(program_id, n)
+    if similar is None:
+        return None
+    details = get_program_details_by_ids([pid for (pid, _) in similar])
+    return {
+        'program_id': program_id,
+        'model_version': index.version,
+        'programs': [{**detail, 'similarity': similarity}
+                     for detail, (_, similarity) in zip(details, similar)],
+    }
+
+
+@timed("recommend.programs")
 def recommend_programs(user_id, n_recommendations=10):
     """
-    1) ユーザーのレビューが少なければ人気番組を返す
-    2) 一定以上あればSVDによる協調フィルタリングを行う
-    """
-    reviews = get_all_reviews()
-    # ユーザーのレビューのみ抽出
-    user_reviews = [r for r in reviews if r[0] == user_id]
-    
-    # コールドスタート対策: レビュー数が5件未満なら人気番組を返す
-    if len(user_reviews) < 5:
-        popular_programs = get_popular_programs(n_recommendations)
-        return popular_programs
-
-    # ========== 以下、SVDによるレコメンド ==========
-    # Surprise 用に DataFrame を作成
-    df = pd.DataFrame(reviews, columns=['user_id', 'program_id', 'rating'])
-    reader = Reader(rating_scale=(1, 5))
-    dataset = Dataset.load_from_df(df, reader)
-
-    # 学習データとテストデータに分割（例: 75%学習 / 25%テスト）
-    trainset, testset = train_test_split(dataset, test_size=0.25)
-
-    # SVDモデルで学習
-    algo = SVD()
-    algo.fit(trainset)
-
-    # ユーザーが既にレビューしている番組ID
-    user_history = [item for (u, item, r) in reviews if u == user_id]
-    # すべての番組ID (重複排除)
-    all_programs = list(set([item for (_, item, _) in reviews]))
-    # 未レビューの番組を抽出
-    unseen_programs = [p for p in all_programs if p not in user_history]
-
-    # 予測スコアの高い順にソートして上位N件を取得
-    predictions = [algo.predict(user_id, p) for p in unseen_programs]
-    predictions.sort(key=lambda x: x.est, reverse=True)
-    top_n = predictions[:n_recommendations]
-    recommended_ids = [pred.iid for pred in top_n]
-
-    # 番組詳細の取得 (DB or スクレイピングなど)
-    recommendations = get_program_details_by_ids(recommended_ids)
-    return recommendations
+    推薦番組のリストだけを返す
+    """
+    return get_user_recommendations(user_id, n_recommendations)['recommendations']
+
+
+if __name__ == "__main__":
+    # 別プロセス (cron など) で学習だけを行い、各サーバーには CURRENT の更新で読み込ませる
+    #   python recommendation.py
+    # サーバーの worker が学習中なら、同時に CURRENT を書かないよう何もしない
+    with model_manager.store.training_lock() as acquired:
+        if not acquired:
+            print("他のプロセスが学習中のため、学習しませんでした")
+        else:
+            trained = model_manager.train_now()
+            print(f"trained: {trained['version'] if trained else 'no reviews'}")
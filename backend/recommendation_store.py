@@ -0,0 +1,96 @@
+# recommendation_store.py
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cache import MemoryBackend
+
+
+class RecommendationStore:
+    """
+    ユーザーごとの推薦結果 (上位の program_id 一覧) を保持する。
+    - モデルが切り替わるたびに、全ユーザー分をまとめて計算して入れ直す
+    - 各エントリはどのモデルで計算したか (model_version) と計算時刻を持つ
+    - レビュー投稿などで結果が変わるユーザーは invalidate で消す
+    - invalidate のたびに世代 (generation) を1つ進め、ユーザーごとに最後に消した世代を覚えておく。
+      計算を始めた時点の世代を put に渡すと、計算中に消されたユーザーの結果は入れない
+      (消した直後に、消す前のレビューで計算した結果が入り直すのを防ぐ)
+    """
+
+    def __init__(self, backend=None, top_n: int = 50, max_invalidations: int = 100000):
+        self.backend = backend if backend is not None else MemoryBackend(max_size=100000)
+        self.top_n = top_n
+        self.max_invalidations = max_invalidations
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommendation-store")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated = OrderedDict()   # user_id -> 最後に invalidate した世代
+        self.built_version = None
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, user_id: str, model_version: str = None):
+        """
+        model_version 以外のモデルで計算した結果は無いものとして扱う
+        """
+        item = self.backend.get(user_id)
+        if item is None:
+            return None
+        entry = item[0]
+        if model_version is not None and entry["model_version"] != model_version:
+            return None
+        return entry
+
+    def put(self, user_id: str, program_ids, model_version: str, computed_at: datetime = None,
+            limit: int = None, generation: int = None):
+        """
+        generation (計算を始めた時点の self.generation) より後にこのユーザーが消されていれば、保存せずに返す
+        """
+        with self._lock:
+            if generation is None:
+                generation = self._generation
+            entry = {
+                "program_ids": list(program_ids),
+                "limit": limit or self.top_n,
+                "model_version": model_version,
+                "generation": generation,
+                "computed_at": (computed_at or datetime.utcnow()).isoformat(),
+            }
+            if self._invalidated.get(user_id, -1) <= generation:
+                self.backend.set(user_id, entry, time.time())
+        return entry
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            if len(self._invalidated) > self.max_invalidations:
+                self._invalidated.popitem(last=False)
+            self.backend.delete(user_id)
+
+    def rebuild(self, scorer, user_ids, model_version: str):
+        """
+        scorer.top_n_batch で user_ids 全員の推薦結果を計算して入れ直す
+        """
+        computed_at = datetime.utcnow()
+        generation = self._generation
+        results = scorer.top_n_batch(user_ids, self.top_n)
+        for user_id, top in results.items():
+            self.put(user_id, [pid for (pid, _) in top], model_version, computed_at, generation=generation)
+        with self._lock:
+            self.built_version = model_version
+        print(f"推薦結果を事前計算しました: {len(results)} users ({model_version})")
+
+    def rebuild_async(self, scorer, user_ids, model_version: str):
+        def run():
+            try:
+                self.rebuild(scorer, user_ids, model_version)
+            except Exception as e:
+                print(f"推薦結果の事前計算に失敗しました: {e}")
+
+        return self._executor.submit(run)
@@ -0,0 +1,120 @@
+# review_pages.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+import config
+from cache import MemoryBackend
+from database import get_review_page
+from models import Review
+
+
+class ReviewPage(NamedTuple):
+    body: bytes                 # List[Review] の JSON
+    etag: str
+    next_cursor: Optional[str]  # 最後のページなら None
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        If-None-Match ヘッダーがこのページの ETag と一致するか
+        """
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or f"W/{self.etag}" in tags
+
+
+# 番組ごとの1ページ目のキャッシュ ("program_id:limit" -> (読み始めた時点の世代, ReviewPage))
+_first_pages = MemoryBackend(max_size=config.REVIEW_PAGE_CACHE_SIZE)
+# レビュー投稿のたびに世代を1つ進め、番組ごとに最後に消した世代を覚えておく。
+# それより前に読み始めたページは使わない
+_generation = 0
+_invalidated = OrderedDict()    # program_id -> 最後に invalidate した世代
+_MAX_INVALIDATIONS = 100000
+# _invalidated からあふれた番組は、あふれた中で最も新しい世代に消されたものとして扱う
+_evicted_generation = -1
+_lock = threading.Lock()
+
+
+def _key(program_id: str, limit: int) -> str:
+    return f"{program_id}:{limit}"
+
+
+def cached_first_page(program_id: str, limit: int) -> Optional[ReviewPage]:
+    """
+    キャッシュ済みの1ページ目を返す (無ければ None)。保存先には問い合わせない
+    """
+    item = _first_pages.get(_key(program_id, limit))
+    if item is None:
+        return None
+    (generation, page), stored_at = item
+    if _invalidated.get(program_id, _evicted_generation) > generation:
+        return None
+    if time.time() - stored_at > config.REVIEW_PAGE_CACHE_TTL:
+        return None
+    return page
+
+
+def load_page(program_id: str, limit: int, cursor: Optional[str] = None) -> ReviewPage:
+    """
+    レビューを新しい順に limit 件読み込む。cursor が無い (1ページ目) ときは結果をキャッシュする
+    """
+    if cursor is None:
+        page = cached_first_page(program_id, limit)
+        if page is not None:
+            return page
+    generation = _generation
+    try:
+        rows, next_cursor = get_review_page(program_id, limit, cursor)
+    except ValueError as e:
+        if cursor is None:
+            raise
+        print(f"不正なカーソルです: {e}")
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    page = _build_page(rows, next_cursor)
+    if cursor is None:
+        _first_pages.set(_key(program_id, limit), (generation, page), time.time())
+    return page
+
+
+def invalidate(program_id: str):
+    """
+    レビューが投稿された番組のキャッシュを捨てる
+    """
+    global _generation, _evicted_generation
+    with _lock:
+        _generation += 1
+        _invalidated[program_id] = _generation
+        _invalidated.move_to_end(program_id)
+        if len(_invalidated) > _MAX_INVALIDATIONS:
+            _, evicted = _invalidated.popitem(last=False)
+            _evicted_generation = max(_evicted_generation, evicted)
+
+
+def _build_page(rows, next_cursor: Optional[str]) -> ReviewPage:
+    results = []
+    for row in rows:
+        try:
+            results.append(Review(
+                review_id=row["review_id"],
+                program_id=row["program_id"],
+                program_title=row["program_title"],
+                user_id=row["user_id"],
+                rating=row["rating"],
+                review_text=row["review_text"],
+                created_at=row["created_at"]
+            ))
+        except KeyError as e:
+            # ログにエラーを記録し、詳細を確認できるようにする
+            print(f"KeyError: {e} in row: {row}")
+            raise HTTPException(status_code=500, detail=f"Missing field: {e}")
+    body = json.dumps(jsonable_encoder(results), ensure_ascii=False, separators=(",", ":")).encode()
+    digest = hashlib.sha1(body)
+    digest.update((next_cursor or "").encode())
+    return ReviewPage(body=body, etag=f'"{digest.hexdigest()[:20]}"', next_cursor=next_cursor)
@@ -0,0 +1,93 @@
+# review_sync.py
+"""
+他のプロセス (uvicorn の worker・一括インポートの CLI) が保存したレビューを、保存先から定期的に読んで知らせる。
+推薦結果の事前計算・人気番組の集計・レビュー一覧のキャッシュはプロセスごとに持つので、
+別の worker に投稿されたレビューはこれで反映する (保存先のレビューを worker 間で共有する変更の記録として使う)。
+"""
+import threading
+from datetime import datetime, timedelta
+
+
+class ReviewSync:
+    """
+    interval 秒ごとに、前回読んだ位置 (watermark) から overlap 秒さかのぼって新しいレビューを読み、
+    まだ知らないものを add_listener(fn) の fn(reviews) に渡す。reviews は
+    {review_id, user_id, program_id, created_at} のリスト。
+    このプロセスで保存したレビューは mark_seen で記録しておくと、二重に知らせない
+    """
+
+    def __init__(self, scan, interval: float = 5.0, overlap: float = 30.0, batch_size: int = 1000):
+        self.scan = scan
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.batch_size = batch_size
+        self.watermark = None
+        self._seen = {}            # 読み直す範囲のレビュー: review_id -> created_at
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def mark_seen(self, review_id: str, created_at: datetime = None):
+        if self.interval <= 0:
+            # 読まない設定では記録も捨てられないので持たない
+            return
+        with self._lock:
+            self._seen[review_id] = created_at or datetime.utcnow()
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            # 起動より前のレビューは、起動時の集計・学習に入っているので読まない
+            self.watermark = datetime.utcnow()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="review-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def sync_now(self) -> int:
+        """
+        新しいレビューを読んで知らせ、その件数を返す
+        """
+        watermark = self.watermark or datetime.utcnow()
+        reviews = []
+        for batch in self.scan(batch_size=self.batch_size, since=watermark - self.overlap):
+            if batch.review_ids is None:
+                continue
+            with self._lock:
+                for review_id, user_id, program_id, created_at in zip(batch.review_ids, batch.user_ids,
+                                                                      batch.program_ids, batch.created_ats):
+                    if review_id in self._seen:
+                        continue
+                    self._seen[review_id] = created_at
+                    reviews.append({"review_id": review_id, "user_id": user_id, "program_id": program_id,
+                                    "created_at": created_at})
+            if batch.max_created_at is not None and batch.max_created_at > watermark:
+                watermark = batch.max_created_at
+        # 未来の created_at で先に進みすぎないようにする
+        self.watermark = min(watermark, datetime.utcnow())
+        cutoff = self.watermark - self.overlap
+        with self._lock:
+            self._seen = {review_id: created_at for review_id, created_at in self._seen.items()
+                          if created_at is None or created_at > cutoff}
+        if reviews:
+            for fn in self._listeners:
+                try:
+                    fn(reviews)
+                except Exception as e:
+                    print(f"他のプロセスのレビューの反映に失敗しました: {e}")
+        return len(reviews)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync_now()
+            except Exception as e:
+                print(f"レビューの同期に失敗しました: {e}")
@@ -0,0 +1,233 @@
+# scoring.py
+import numpy as np
+
+
+class IdMap:
+    """
+    ID (文字列) と整数コードの対応表。dict の代わりに配列だけで持つ:
+    - sorted_ids: UTF-8 にした ID を固定長のバイト列で並べ替えたもの (二分探索で引く)
+    - codes: sorted_ids の順の各 ID のコード / positions: コード -> sorted_ids の位置
+    配列は mmap したファイルのものをそのまま使えるので、複数のプロセスで同じモデルを読んでもメモリは増えない。
+    ids[code] で ID、get(id) でコード (無ければ None) を返し、for ではコード順に ID を返す。
+    """
+
+    def __init__(self, sorted_ids, codes, positions):
+        self.sorted_ids = sorted_ids
+        self.codes = codes
+        self.positions = positions
+
+    @classmethod
+    def build(cls, ids) -> "IdMap":
+        if isinstance(ids, IdMap):
+            return ids
+        encoded = [str(i).encode() for i in ids]
+        width = max((len(e) for e in encoded), default=0) or 1
+        values = np.array(encoded, dtype=f"S{width}")
+        codes = np.argsort(values, kind="stable").astype(np.int64)
+        positions = np.empty_like(codes)
+        positions[codes] = np.arange(len(codes))
+        return cls(values[codes], codes, positions)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, code) -> str:
+        return self.sorted_ids[self.positions[code]].decode()
+
+    def __iter__(self):
+        for position in self.positions:
+            yield self.sorted_ids[position].decode()
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        encoded = str(key).encode()
+        if not len(self.codes) or len(encoded) > self.sorted_ids.itemsize:
+            return default
+        position = int(np.searchsorted(self.sorted_ids, encoded))
+        if position < len(self.codes) and self.sorted_ids[position] == encoded:
+            return int(self.codes[position])
+        return default
+
+    def get_many(self, keys):
+        """
+        複数の ID のコードをまとめて引く (無い ID は -1)
+        """
+        if not len(self.codes):
+            return np.full(len(keys), -1, dtype=np.int64)
+        encoded = np.array([str(k).encode() for k in keys], dtype=object)
+        too_long = np.fromiter((len(e) > self.sorted_ids.itemsize for e in encoded), dtype=bool, count=len(keys))
+        queries = encoded.astype(self.sorted_ids.dtype)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, queries), len(self.codes) - 1)
+        found = (self.sorted_ids[positions] == queries) & ~too_long
+        return np.where(found, self.codes[positions], -1)
+
+    def arrays(self, prefix: str) -> dict:
+        return {f"{prefix}sorted_ids": self.sorted_ids, f"{prefix}codes": self.codes,
+                f"{prefix}positions": self.positions}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, prefix: str) -> "IdMap":
+        return cls(arrays[f"{prefix}sorted_ids"], arrays[f"{prefix}codes"], arrays[f"{prefix}positions"])
+
+
+class FactorScorer:
+    """
+    行列分解モデルの因子とバイアスから、全番組のスコアを NumPy でまとめて計算する。
+        score(u, i) = global_mean + user_bias[u] + item_bias[i] + user_factors[u] · item_factors[i]
+    ユーザーがレビュー済みの番組は CSR 形式 (seen_indptr, seen_indices) で持ち、上位N件から除外する。
+    ID とコードの対応は IdMap で持つ (user_ids[行] / user_index.get(ID) のどちらでも引ける)。
+    arrays() / from_arrays() で配列の dict と相互に変換でき、mmap した配列のまま推薦に使える。
+    """
+
+    def __init__(self, user_ids, item_ids, user_factors, item_factors, user_bias, item_bias,
+                 global_mean: float, seen_indptr, seen_indices, rating_scale=(1, 5)):
+        self.user_ids = IdMap.build(user_ids)
+        self.item_ids = IdMap.build(item_ids)
+        self.user_index = self.user_ids
+        self.item_index = self.item_ids
+        self.user_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        self.item_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
+        self.user_bias = np.asarray(user_bias, dtype=np.float32)
+        self.item_bias = np.asarray(item_bias, dtype=np.float32)
+        self.global_mean = float(global_mean)
+        self.seen_indptr = np.asarray(seen_indptr, dtype=np.int64)
+        self.seen_indices = np.asarray(seen_indices, dtype=np.int32)
+        self.rating_scale = tuple(rating_scale)
+
+    def arrays(self) -> dict:
+        return {
+            **self.user_ids.arrays("user_"), **self.item_ids.arrays("item_"),
+            "user_factors": self.user_factors, "item_factors": self.item_factors,
+            "user_bias": self.user_bias, "item_bias": self.item_bias,
+            "seen_indptr": self.seen_indptr, "seen_indices": self.seen_indices,
+        }
+
+    def meta(self) -> dict:
+        return {"global_mean": self.global_mean, "rating_scale": list(self.rating_scale)}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, meta: dict) -> "FactorScorer":
+        return cls(IdMap.from_arrays(arrays, "user_"), IdMap.from_arrays(arrays, "item_"),
+                   arrays["user_factors"], arrays["item_factors"], arrays["user_bias"], arrays["item_bias"],
+                   meta["global_mean"], arrays["seen_indptr"], arrays["seen_indices"], meta["rating_scale"])
+
+    def users_with_reviews(self, min_reviews: int):
+        """
+        レビューが min_reviews 件以上あるユーザーの ID の一覧 (事前計算の対象)
+        """
+        rows = np.flatnonzero(np.diff(self.seen_indptr) >= min_reviews)
+        return [self.user_ids[row] for row in rows]
+
+    @property
+    def n_items(self) -> int:
+        return len(self.item_ids)
+
+    def n_seen(self, user_id) -> int:
+        row = self.user_index.get(user_id)
+        if row is None:
+            return 0
+        return int(self.seen_indptr[row + 1] - self.seen_indptr[row])
+
+    def seen(self, row: int):
+        return self.seen_indices[self.seen_indptr[row]:self.seen_indptr[row + 1]]
+
+    def score_user(self, user_id):
+        """
+        1ユーザーの全番組のスコアを行列×ベクトル1回で計算する
+        """
+        row = self.user_index.get(user_id)
+        if row is None:
+            return self.global_mean + self.item_bias
+        return (self.global_mean + self.user_bias[row] + self.item_bias
+                + self.item_factors @ self.user_factors[row])
+
+    def top_n(self, user_id, n: int = 10, exclude_seen: bool = True):
+        """
+        スコア上位 n 件の [(program_id, score)] を返す
+        """
+        scores = self.score_user(user_id)
+        row = self.user_index.get(user_id)
+        if exclude_seen and row is not None:
+            scores[self.seen(row)] = -np.inf
+        top = _top_indices(scores, n)
+        return [(self.item_ids[i], self._clip(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def top_n_batch(self, user_ids, n: int = 10, exclude_seen: bool = True, chunk_size: int = 1024):
+        """
+        多数のユーザーの上位 n 件をまとめて計算する (事前計算用)。
+        chunk_size ユーザーずつ行列×行列で計算するので、メモリは chunk_size × 番組数に収まる。
+        {user_id: [(program_id, score)]} を返す。
+        """
+        results = {}
+        user_ids = list(user_ids)
+        codes = self.user_index.get_many(user_ids)
+        known = [(u, code) for u, code in zip(user_ids, codes) if code >= 0]
+        for u, code in zip(user_ids, codes):
+            if code < 0:
+                results[u] = self.top_n(u, n, exclude_seen)
+        for start in range(0, len(known), chunk_size):
+            chunk = [u for u, _ in known[start:start + chunk_size]]
+            rows = np.fromiter((code for _, code in known[start:start + chunk_size]), dtype=np.int64,
+                               count=len(chunk))
+            scores = (self.global_mean + self.user_bias[rows, None] + self.item_bias[None, :]
+                      + self.user_factors[rows] @ self.item_factors.T)
+            if exclude_seen:
+                starts, ends = self.seen_indptr[rows], self.seen_indptr[rows + 1]
+                lengths = ends - starts
+                mask_rows = np.repeat(np.arange(len(rows)), lengths)
+                mask_cols = self.seen_indices[_concat_ranges(starts, lengths)]
+                scores[mask_rows, mask_cols] = -np.inf
+            tops = _top_indices_2d(scores, n)
+            for k, user_id in enumerate(chunk):
+                row_scores = scores[k]
+                results[user_id] = [(self.item_ids[i], self._clip(row_scores[i]))
+                                    for i in tops[k] if np.isfinite(row_scores[i])]
+        return results
+
+    def _clip(self, score) -> float:
+        low, high = self.rating_scale
+        return float(min(max(score, low), high))
+
+
+def build_seen_index(user_ids, user_history: dict, item_index: dict):
+    """
+    ユーザーごとのレビュー済み番組を CSR 形式 (indptr, indices) にする
+    """
+    indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+    indices = []
+    for row, uid in enumerate(user_ids):
+        items = sorted(item_index[i] for i in user_history.get(uid, ()) if i in item_index)
+        indices.extend(items)
+        indptr[row + 1] = len(indices)
+    return indptr, np.asarray(indices, dtype=np.int32)
+
+
+def _top_indices(scores, n: int):
+    n = min(n, len(scores))
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _top_indices_2d(scores, n: int):
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _concat_ranges(starts, lengths):
+    """
+    [starts[k], starts[k] + lengths[k]) をつなげたインデックス配列を作る
+    """
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return offsets + np.arange(total)
+
@@ -0,0 +1,386 @@
+# scrape_scheduler.py
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import config
+from rate_limit import HostRateLimiter, backoff_delay
+from scraper import normalize_query, prefetch_search, refresh_program, search_url, search_cache, \
+    search_cache_key
+from search_index import search_index, answer_from_index
+
+# ジョブの状態: queued (待ち) / running (実行中) / done (完了) / failed (再試行の上限に達した)
+STATUSES = ("queued", "running", "done", "failed")
+
+
+class ScrapeJob:
+    def __init__(self, kind: str, target: str, priority: float, attempts: int = 0,
+                 next_run_at: float = 0.0, status: str = "queued", last_error: str = None):
+        self.kind = kind
+        self.target = target
+        self.priority = priority
+        self.attempts = attempts
+        self.next_run_at = next_run_at
+        self.status = status
+        self.last_error = last_error
+        self.seq = 0
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.target}"
+
+
+class JobStore:
+    """
+    ジョブの状態と検索されたクエリの回数を SQLite のファイルに保存する (再起動後も続きから実行する)
+    - scrape_jobs: ジョブごとの状態・試行回数・次に実行する時刻
+    - search_queries: クエリごとの検索回数 (時間とともに減衰させる)
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scrape_jobs ("
+            " key TEXT PRIMARY KEY, kind TEXT NOT NULL, target TEXT NOT NULL,"
+            " priority REAL NOT NULL, attempts INTEGER NOT NULL, next_run_at REAL NOT NULL,"
+            " status TEXT NOT NULL, last_error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_queries ("
+            " query TEXT PRIMARY KEY, score REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def save(self, job: ScrapeJob):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scrape_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.key, job.kind, job.target, job.priority, job.attempts, job.next_run_at,
+                 job.status, job.last_error, time.time()),
+            )
+
+    def load_pending(self):
+        """
+        待ち・実行中 (前回の停止で中断した) のジョブを返す
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, target, priority, attempts, next_run_at, last_error FROM scrape_jobs"
+                " WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        return [ScrapeJob(kind, target, priority, attempts, next_run_at, "queued", last_error)
+                for kind, target, priority, attempts, next_run_at, last_error in rows]
+
+    def prune(self, older_than: float):
+        """
+        older_than (UNIX 時刻) より前に終わったジョブを消す
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM scrape_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                               (older_than,))
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM scrape_jobs GROUP BY status").fetchall()
+        return {status: dict(rows).get(status, 0) for status in STATUSES}
+
+    def add_queries(self, counts: dict, decay: float, max_queries: int = 10000):
+        """
+        これまでの回数に decay を掛けてから、今回の回数を足す。上位 max_queries 件だけを残す
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("UPDATE search_queries SET score = score * ?", (decay,))
+                self._conn.executemany(
+                    "INSERT INTO search_queries VALUES (?, ?, ?)"
+                    " ON CONFLICT(query) DO UPDATE SET score = score + excluded.score, updated_at = excluded.updated_at",
+                    [(query, float(count), now) for query, count in counts.items()],
+                )
+                self._conn.execute(
+                    "DELETE FROM search_queries WHERE query IN ("
+                    " SELECT query FROM search_queries ORDER BY score DESC LIMIT -1 OFFSET ?)",
+                    (max_queries,),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def top_queries(self, n: int):
+        """
+        [(query, score)] を検索回数の多い順に返す
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT query, score FROM search_queries ORDER BY score DESC LIMIT ?", (n,)
+            ).fetchall()
+
+
+class JobKind:
+    """
+    ジョブの種類ごとの処理。run(target) を実行する前に、url(target) のホストから cost(target) 個のトークンを取る
+    (1つのジョブで読み込むページ数)
+    """
+
+    def __init__(self, run, url, cost=lambda target: 1):
+        self.run = run
+        self.url = url
+        self.cost = cost
+
+
+class ScrapeScheduler:
+    """
+    スクレイピングのジョブを裏のスレッドで実行する。
+    - ジョブは (kind, target) で重複を除き、優先度 (小さいほど先) の順に実行する。
+      待ちのジョブを高い優先度で追加し直すと優先度だけを上げる
+    - 実行前にホストごとのトークンバケットで、ページの読み込み数を limiter の rate 件/秒に抑える
+    - 失敗したら指数バックオフ (ジッター付き) の後で再試行し、max_attempts 回失敗したら諦める (failed)
+    - ジョブの状態は JobStore に保存し、再起動後は待ち・実行中だったジョブから続ける。
+      store に JobStore を作る関数を渡すと、初めて使うとき (start など) に作る (import しただけではファイルを開かない)
+    - plan_interval 秒ごとに planner(self) を呼び、先読みのジョブを追加する
+    """
+
+    def __init__(self, kinds: dict, store, limiter: HostRateLimiter, planner=None,
+                 workers: int = 1, max_attempts: int = 5, retry_base: float = 30.0, retry_max: float = 3600.0,
+                 plan_interval: float = 300.0, query_half_life: float = 86400.0):
+        self.kinds = kinds
+        self._store = None if callable(store) else store
+        self._store_factory = store if callable(store) else None
+        self._store_lock = threading.Lock()
+        self.limiter = limiter
+        self.planner = planner
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.plan_interval = plan_interval
+        self.query_half_life = query_half_life
+        self.stats = Counter()
+        self._jobs = {}          # key -> 待ち・実行中のジョブ
+        self._ready = []         # (priority, seq, key): 実行できるジョブ
+        self._delayed = []       # (next_run_at, seq, key): 再試行を待っているジョブ
+        self._seq = itertools.count()
+        self._queries = Counter()
+        self._queries_flushed = time.time()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = self._store_factory()
+        return self._store
+
+    # -------------------
+    # ジョブの追加
+    # -------------------
+    def enqueue(self, kind: str, target: str, priority: float = 0.0) -> bool:
+        """
+        ジョブを追加する。同じジョブが実行中、または同じか高い優先度で待っている場合は何もしない (False)
+        """
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = ScrapeJob(kind, target, priority, next_run_at=time.time())
+        with self._cond:
+            current = self._jobs.get(job.key)
+            if current is not None:
+                if current.status == "running" or current.priority <= priority:
+                    self.stats["deduplicated"] += 1
+                    return False
+                current.priority = priority
+                job = current
+            self._jobs[job.key] = job
+            self._push(job)
+            self.store.save(job)
+            self.stats["enqueued"] += 1
+            self._cond.notify()
+        return True
+
+    def record_query(self, query: str):
+        """
+        /search で検索されたクエリを数える (plan_interval ごとに JobStore に保存する)
+        """
+        query = normalize_query(query)
+        if query:
+            with self._cond:
+                self._queries[query] += 1
+
+    def _push(self, job: ScrapeJob):
+        # 古いエントリは取り出すときに seq で見分けて捨てる
+        job.seq = next(self._seq)
+        if job.next_run_at > time.time():
+            heapq.heappush(self._delayed, (job.next_run_at, job.seq, job.key))
+        else:
+            heapq.heappush(self._ready, (job.priority, job.seq, job.key))
+
+    # -------------------
+    # 実行
+    # -------------------
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        with self._cond:
+            for job in self.store.load_pending():
+                if job.kind in self.kinds and job.key not in self._jobs:
+                    self._jobs[job.key] = job
+                    self._push(job)
+        self._threads = [threading.Thread(target=self._work, name=f"scrape-job-{i}", daemon=True)
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._plan, name="scrape-plan", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _next(self):
+        """
+        実行できるジョブを優先度順に取り出して running にする。停止したら None
+        """
+        with self._cond:
+            while not self._stop.is_set():
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, seq, key = heapq.heappop(self._delayed)
+                    job = self._jobs.get(key)
+                    if job is not None and job.seq == seq:
+                        heapq.heappush(self._ready, (job.priority, seq, key))
+                while self._ready:
+                    _, seq, key = heapq.heappop(self._ready)
+                    job = self._jobs.get(key)
+                    if job is not None and job.seq == seq and job.status == "queued":
+                        job.status = "running"
+                        self.store.save(job)
+                        return job
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+        return None
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            kind = self.kinds[job.kind]
+            # トークンが無ければ待つ (停止の確認のため1秒ごとに起きる)
+            while not self.limiter.acquire(kind.url(job.target), kind.cost(job.target), timeout=1.0):
+                if self._stop.is_set():
+                    self._finish(job, "queued")
+                    return
+            try:
+                kind.run(job.target)
+            except Exception as e:
+                self._failed(job, e)
+            else:
+                self._finish(job, "done")
+
+    def _failed(self, job: ScrapeJob, error: Exception):
+        job.attempts += 1
+        job.last_error = str(error)
+        if job.attempts >= self.max_attempts:
+            print(f"スクレイピングのジョブを諦めました ({job.key}, {job.attempts}回失敗): {error}")
+            self._finish(job, "failed")
+            return
+        delay = backoff_delay(job.attempts - 1, base=self.retry_base, cap=self.retry_max)
+        print(f"スクレイピングのジョブに失敗しました ({job.key}, {job.attempts}回目, {delay:.0f}s後に再試行): {error}")
+        job.next_run_at = time.time() + delay
+        self.stats["retried"] += 1
+        self._finish(job, "queued")
+
+    def _finish(self, job: ScrapeJob, status: str):
+        with self._cond:
+            job.status = status
+            self.store.save(job)
+            if status == "queued":
+                self._push(job)
+                self._cond.notify()
+            else:
+                self._jobs.pop(job.key, None)
+                self.stats[status] += 1
+
+    # -------------------
+    # 先読みの計画
+    # -------------------
+    def _plan(self):
+        while not self._stop.wait(self.plan_interval):
+            try:
+                self.plan_now()
+            except Exception as e:
+                print(f"先読みのジョブの追加に失敗しました: {e}")
+
+    def plan_now(self):
+        """
+        数えたクエリを保存し、planner で先読みのジョブを追加する。1日より前に終わったジョブの記録は消す
+        """
+        with self._cond:
+            queries, self._queries = self._queries, Counter()
+        now = time.time()
+        decay = 0.5 ** ((now - self._queries_flushed) / self.query_half_life)
+        self._queries_flushed = now
+        self.store.add_queries(queries, decay)
+        self.store.prune(now - 86400)
+        if self.planner is not None:
+            self.planner(self)
+
+    def info(self) -> dict:
+        with self._cond:
+            queued = sum(job.status == "queued" for job in self._jobs.values())
+            info = {"queued": queued, "running": len(self._jobs) - queued, **self.stats}
+        info["rate_limit_waited"] = round(self.limiter.waited, 3)
+        # 使っていなければ (SCHEDULER_ENABLED=0 など) JobStore は作らない
+        info["store"] = self._store.counts() if self._store is not None else {}
+        return info
+
+
+def plan_prefetch(scheduler: ScrapeScheduler):
+    """
+    よく検索されるクエリと、検索結果としてよく返す番組のうち、もうすぐ古くなるものを先に取り直す。
+    - クエリ: キャッシュも索引もしばらく使える状態なら追加しない。検索回数の多い順に優先度を付ける
+    - 番組: SEARCH_INDEX_MAX_AGE の SCHEDULER_REFRESH_MARGIN の割合を過ぎた番組を、クエリより後に実行する
+    """
+    limit = config.SEARCH_DEFAULT_RESULTS
+    margin = config.SCHEDULER_REFRESH_MARGIN
+    for rank, (query, _) in enumerate(scheduler.store.top_queries(config.SCHEDULER_PREFETCH_QUERIES)):
+        age = search_cache.age(search_cache_key(query, limit))
+        if age is not None and age < search_cache.ttl * margin:
+            continue
+        # 計画のための確認は検索として数えない (数えると stale_programs が計画自体の確認に偏る)
+        if answer_from_index(search_index, query, limit, config.SEARCH_INDEX_MAX_AGE * margin, count=False) is not None:
+            continue
+        scheduler.enqueue("search", query, priority=rank)
+    stale = search_index.stale_programs(config.SEARCH_INDEX_MAX_AGE * margin, config.SCHEDULER_REFRESH_PROGRAMS)
+    for rank, program in enumerate(stale):
+        scheduler.enqueue("program", program["url"], priority=config.SCHEDULER_PREFETCH_QUERIES + rank)
+
+
+scrape_scheduler = ScrapeScheduler(
+    kinds={
+        # 検索ページ1枚と詳細ページ SEARCH_DEFAULT_RESULTS 枚
+        "search": JobKind(prefetch_search, search_url, lambda query: 1 + config.SEARCH_DEFAULT_RESULTS),
+        "program": JobKind(refresh_program, lambda url: url),
+    },
+    store=lambda: JobStore(config.SCHEDULER_PATH),
+    limiter=HostRateLimiter(config.SCHEDULER_RATE_LIMIT, config.SCHEDULER_RATE_BURST),
+    planner=plan_prefetch,
+    workers=config.SCHEDULER_WORKERS,
+    max_attempts=config.SCHEDULER_MAX_ATTEMPTS,
+    retry_base=config.SCHEDULER_RETRY_BASE,
+    retry_max=config.SCHEDULER_RETRY_MAX,
+    plan_interval=config.SCHEDULER_PLAN_INTERVAL,
+    query_half_life=config.SCHEDULER_QUERY_HALF_LIFE_HOURS * 3600,
+)
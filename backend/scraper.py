@@ -1,14 +1,52 @@
 # backend/scraper.py
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from webdriver_manager.chrome import ChromeDriverManager
-
-def get_program_details(search_query: str):
+import queue
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache
+
+import config
+from browser_pool import BrowserPool, PoolExhaustedError
+from metrics import REGISTRY, span, timed
+from cache import TTLCache, MemoryBackend, SqliteBackend
+from program_catalog import program_id_from_url, save_programs, save_programs_async
+from rate_limit import backoff_delay
+
+# selenium・webdriver_manager は import に時間がかかるので、ブラウザを使うときに関数の中で読み込む
+# (HTTP エンジンだけで動かす場合や、起動直後のリクエストを遅らせないため)
+
+# 各エンジンが使う CSS セレクタ
+PROGRAM_LINK_SELECTOR = "li > a[href*='/tv_events/']"
+TITLE_SELECTOR = ".program_title"
+SUPPLEMENT_SELECTOR = ".program_supplement"
+CAST_SELECTOR = ".addition li h2.heading + p a"
+
+# 起動時の準備 (WARMUP_BROWSER_POOL=1) か、初めてブラウザを使うときに init_browser_pool() で作成される
+browser_pool = None
+_pool_lock = threading.Lock()
+# 詳細ページの並列読み込み用
+_detail_executor = ThreadPoolExecutor(max_workers=max(config.BROWSER_POOL_SIZE, config.SCRAPE_MAX_CONCURRENCY) * 2,
+                                      thread_name_prefix="scrape-detail")
+
+
+@lru_cache(maxsize=1)
+def _chromedriver_path() -> str:
+    """
+    ChromeDriver のダウンロードはプロセスにつき1回だけ行う
+    """
+    from webdriver_manager.chrome import ChromeDriverManager
+    return ChromeDriverManager().install()
+
+
+@timed("browser.start")
+def create_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
     options = Options()
     options.add_argument('--headless')
     options.add_argument('--disable-gpu')
@@ -16,45 +54,354 @@ def get_program_details(search_query: str):
     options.add_argument('--disable-dev-shm-usage')
     options.add_argument('--window-size=1920,1080')
 
-    service = ChromeService(ChromeDriverManager().install())
+    service = ChromeService(_chromedriver_path())
     driver = webdriver.Chrome(service=service, options=options)
-    driver.set_page_load_timeout(30)  # タイムアウト設定
+    driver.set_page_load_timeout(config.BROWSER_PAGE_LOAD_TIMEOUT)  # タイムアウト設定
+    return driver
 
-    result = []
-    try:
-        url = f"https://bangumi.org/search?q={search_query}&area_code=23"
-        safe_get(driver, url)
 
-        program_links = WebDriverWait(driver, 30).until(
-            EC.presence_of_all_elements_located((By.CSS_SELECTOR, "li > a[href*='/tv_events/']"))
-        )
-        links = [link.get_attribute('href') for link in program_links]
-
-        for link in links[:3]:
-            try:
-                safe_get(driver, link)
-                title = driver.find_element(By.CLASS_NAME, 'program_title').text
-                supplement = driver.find_element(By.CLASS_NAME, 'program_supplement').text
-                cast_elements = driver.find_elements(By.CSS_SELECTOR, ".addition li h2.heading + p a")
-                cast_names = [c.text for c in cast_elements if c.text]
-                result.append({
-                    "url": link,
-                    "title": title,
-                    "supplement": supplement,
-                    "cast_names": cast_names
-                })
-            except Exception as e:
-                print(f"エラーが発生しました: {e}")
-    finally:
-        driver.quit()
+def init_browser_pool(size: int = None):
+    """
+    ブラウザプールを作成し、ブラウザを起動しておく
+    """
+    global browser_pool
+    with _pool_lock:
+        if browser_pool is None:
+            pool = BrowserPool(
+                create_driver,
+                size=size or config.BROWSER_POOL_SIZE,
+                max_pages=config.BROWSER_MAX_PAGES,
+                acquire_timeout=config.BROWSER_ACQUIRE_TIMEOUT,
+            )
+            pool.start()
+            browser_pool = pool
+    return browser_pool
+
+
+def shutdown_browser_pool():
+    global browser_pool
+    with _pool_lock:
+        if browser_pool is not None:
+            browser_pool.close()
+            browser_pool = None
+
+
+class ScraperEngine:
+    """
+    スクレイピング方式の共通インターフェース。
+    - collect_links: 検索ページから詳細ページの URL 一覧を集める
+    - session: 詳細ページを取得する関数 fetch(link) を貸し出す (with で使う)
+    - max_concurrency: 1つの検索で同時に使える session の数
+    """
+    name = ""
+
+    def collect_links(self, search_query: str, deadline_at: float):
+        raise NotImplementedError
+
+    def session(self, deadline_at: float):
+        raise NotImplementedError
+
+    def max_concurrency(self) -> int:
+        return config.SCRAPE_MAX_CONCURRENCY
+
+
+class SeleniumEngine(ScraperEngine):
+    """
+    ブラウザプールの headless Chrome でページを描画して取得する方式
+    """
+    name = "selenium"
+
+    @property
+    def pool(self):
+        # プール未作成の場合 (スクリプトからの直接実行など) はその場でプールを作る
+        return browser_pool or init_browser_pool()
+
+    def collect_links(self, search_query: str, deadline_at: float):
+        pool = self.pool
+        with pool.borrow(timeout=_remaining(deadline_at, pool.acquire_timeout)) as driver:
+            return _collect_program_links(driver, search_query, deadline_at)
+
+    @contextmanager
+    def session(self, deadline_at: float):
+        pool = self.pool
+        with pool.borrow(timeout=_remaining(deadline_at, pool.acquire_timeout)) as driver:
+            yield lambda link: _scrape_detail(driver, link, deadline_at)
+
+    def max_concurrency(self) -> int:
+        return min(config.SCRAPE_MAX_CONCURRENCY, self.pool.size)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name: str = None) -> ScraperEngine:
+    """
+    SCRAPER_ENGINE (selenium / http) に応じたエンジンを返す
+    """
+    name = name or config.SCRAPER_ENGINE
+    with _engines_lock:
+        if name not in _engines:
+            if name == "selenium":
+                _engines[name] = SeleniumEngine()
+            elif name == "http":
+                from http_scraper import HttpEngine
+                _engines[name] = HttpEngine(fallback=SeleniumEngine())
+            else:
+                raise ValueError(f"Unknown scraper engine: {name}")
+        return _engines[name]
+
+
+def get_program_details(search_query: str, limit: int = None, deadline: float = None):
+    """
+    検索結果の番組詳細をリストで返す (期限切れで途中までの場合も含む)
+    """
+    return scrape_programs(search_query, limit=limit, deadline=deadline)["programs"]
+
+
+def _create_search_cache() -> TTLCache:
+    if config.SEARCH_CACHE_BACKEND == "sqlite":
+        backend = SqliteBackend(config.SEARCH_CACHE_PATH, max_size=config.SEARCH_CACHE_SIZE,
+                                table="search_cache")
+    else:
+        backend = MemoryBackend(max_size=config.SEARCH_CACHE_SIZE)
+    return TTLCache(backend, ttl=config.SEARCH_CACHE_TTL,
+                    stale_ttl=config.SEARCH_CACHE_STALE_TTL, name="search")
+
+
+search_cache = _create_search_cache()
+
+
+def _pool_usage():
+    pool = browser_pool
+    if pool is None:
+        return None
+    return {("size",): pool.size, ("in_use",): pool.in_use, ("recycled",): pool.recycled}
 
+
+def _cache_lookups():
+    info = search_cache.stats.as_dict()
+    return {("search", result): info[result] for result in ("hits", "stale_hits", "misses", "coalesced")}
+
+
+REGISTRY.gauge("tvsearch_browser_pool", "Browser pool size, browsers in use and browsers recycled.",
+               _pool_usage, ("state",))
+REGISTRY.gauge("tvsearch_cache_lookups_total", "Cache lookups by result.", _cache_lookups,
+               ("cache", "result"), kind="counter")
+REGISTRY.gauge("tvsearch_cache_hit_ratio", "Share of cache lookups answered without loading.",
+               lambda: {("search",): search_cache.stats.as_dict()["hit_rate"]}, ("cache",))
+
+
+def normalize_query(search_query: str) -> str:
+    """
+    全角/半角・大文字/小文字・空白の違いを吸収したクエリを返す
+    """
+    return " ".join(unicodedata.normalize("NFKC", search_query).lower().split())
+
+
+def cached_scrape_programs(search_query: str, limit: int = None):
+    """
+    scrape_programs の結果をキャッシュして返す。
+    キーは (地域コード, 件数, 正規化したクエリ)。同じクエリの同時リクエストは1回のスクレイピングを共有する。
+    期限切れで途中までしか取れなかった結果はキャッシュしない。
+    """
+    limit = limit or config.SEARCH_DEFAULT_RESULTS
+    query = normalize_query(search_query)
+    return search_cache.get_or_load(
+        search_cache_key(query, limit),
+        lambda: scrape_programs(query, limit=limit),
+        should_cache=lambda result: not result["partial"],
+    )
+
+
+def search_cache_key(query: str, limit: int) -> str:
+    return f"{config.BANGUMI_AREA_CODE}:{limit}:{normalize_query(query)}"
+
+
+def prefetch_search(search_query: str, limit: int = None):
+    """
+    検索結果を取り直してキャッシュに入れる (裏のジョブから呼ぶ)。番組は番組カタログと検索の索引にも入る。
+    期限切れで途中までしか取れなかった場合は例外 (後で再試行する)
+    """
+    limit = limit or config.SEARCH_DEFAULT_RESULTS
+    query = normalize_query(search_query)
+    result = scrape_programs(query, limit=limit)
+    if result["partial"]:
+        raise TimeoutError(f"Scraping did not finish before the deadline: {query}")
+    search_cache.put(search_cache_key(query, limit), result)
     return result
 
-def safe_get(driver, url, retries=3):
+
+def refresh_program(url: str):
+    """
+    詳細ページを取り直して番組カタログに保存する (裏のジョブから呼ぶ)。取得できなければ例外
+    """
+    engine = get_engine()
+    deadline_at = time.monotonic() + config.SCRAPE_DEADLINE
+    with engine.session(deadline_at) as fetch:
+        program = fetch(url)
+    if program is None:
+        raise RuntimeError(f"Failed to fetch program page: {url}")
+    program["program_id"] = program_id_from_url(program["url"])
+    program["scraped_at"] = datetime.utcnow()
+    save_programs([program])
+    return program
+
+
+@timed("scrape.search")
+def scrape_programs(search_query: str, limit: int = None, deadline: float = None,
+                    engine: ScraperEngine = None):
+    """
+    検索結果をスクレイピングする。
+    - 検索ページで詳細ページのリンクを集める
+    - 詳細ページは最大 SCRAPE_MAX_CONCURRENCY 並列で読み込む
+    - deadline 秒を過ぎたら、それまでに取れた結果だけを返す (partial=True)
+    取得できた番組は番組カタログ (Datastore の Program) に裏で保存する。
+    """
+    engine = engine or get_engine()
+    limit = limit or config.SEARCH_DEFAULT_RESULTS
+    deadline_at = time.monotonic() + (deadline or config.SCRAPE_DEADLINE)
+
+    with span("scrape.collect_links"):
+        links = engine.collect_links(search_query, deadline_at)[:limit]
+
+    with span("scrape.fetch_details"):
+        results = _fetch_details_concurrently(engine, links, deadline_at)
+    programs = [results[i] for i in range(len(links)) if results.get(i)]
+    scraped_at = datetime.utcnow()
+    for program in programs:
+        program["program_id"] = program_id_from_url(program["url"])
+        program["scraped_at"] = scraped_at
+    save_programs_async(programs)
+    # 検索ページ自体が期限内に読み込めなかった場合も途中まで (キャッシュしない)
+    partial = len(results) < len(links) or (not links and time.monotonic() >= deadline_at)
+    if partial:
+        print(f"期限内に処理できたのは {len(results)}/{len(links)} 件です: {search_query}")
+    return {"programs": programs, "partial": partial}
+
+
+def _remaining(deadline_at: float, cap: float = None) -> float:
+    remaining = max(0.0, deadline_at - time.monotonic())
+    return remaining if cap is None else min(remaining, cap)
+
+
+def search_url(search_query: str) -> str:
+    return f"{config.BANGUMI_BASE_URL}/search?q={search_query}&area_code={config.BANGUMI_AREA_CODE}"
+
+
+def _collect_program_links(driver, search_query: str, deadline_at: float = None):
+    """
+    検索ページから詳細ページのリンクを集める。deadline_at までに読み込めなければ空のリストを返す
+    """
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    timeout = 30 if deadline_at is None else _remaining(deadline_at, 30)
+    try:
+        safe_get(driver, search_url(search_query), deadline_at=deadline_at)
+        program_links = WebDriverWait(driver, timeout).until(
+            EC.presence_of_all_elements_located((By.CSS_SELECTOR, PROGRAM_LINK_SELECTOR))
+        )
+    except TimeoutException as e:
+        print(f"検索ページを期限内に読み込めませんでした: {e}")
+        return []
+    return [link.get_attribute('href') for link in program_links]
+
+
+def _fetch_details_concurrently(engine: ScraperEngine, links, deadline_at: float):
+    """
+    詳細ページを並列に読み込み、{リンクの順番: 番組情報 (失敗時は None)} を返す。
+    各タスクは session を1つ借り、キューが空になるか期限が来るまでリンクを処理する。
+    """
+    results = {}
+    results_lock = threading.Lock()
+    pending = queue.Queue()
+    for item in enumerate(links):
+        pending.put(item)
+
+    def worker():
+        try:
+            with engine.session(deadline_at) as fetch:
+                while time.monotonic() < deadline_at:
+                    try:
+                        index, link = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    detail = fetch(link)
+                    # 取得に失敗したページも None として記録し、期限切れと区別する
+                    if time.monotonic() < deadline_at:
+                        with results_lock:
+                            results[index] = detail
+        except PoolExhaustedError:
+            # 他のタスクが借りたブラウザで残りを処理する
+            pass
+        except Exception as e:
+            # ブラウザが壊れた場合など。借りたブラウザはプールが作り直し、残りは他のタスクが処理する
+            print(f"詳細ページの取得を中断しました: {e}")
+
+    concurrency = max(1, min(engine.max_concurrency(), len(links)))
+    futures = [_detail_executor.submit(worker) for _ in range(concurrency)]
+    wait(futures, timeout=_remaining(deadline_at))
+    with results_lock:
+        return dict(results)
+
+
+def _scrape_detail(driver, link: str, deadline_at: float = None):
+    """
+    詳細ページを読み込んで番組情報を返す。読み込みのタイムアウトや要素が見つからない場合は None。
+    ブラウザ自体の故障 (セッションが落ちたなど) は送出して、ブラウザプールに作り直させる
+    """
+    from selenium.common.exceptions import (NoSuchElementException, StaleElementReferenceException,
+                                            TimeoutException, WebDriverException)
+    from selenium.webdriver.common.by import By
+
+    try:
+        safe_get(driver, link, deadline_at=deadline_at)
+        title = driver.find_element(By.CSS_SELECTOR, TITLE_SELECTOR).text
+        supplement = driver.find_element(By.CSS_SELECTOR, SUPPLEMENT_SELECTOR).text
+        cast_elements = driver.find_elements(By.CSS_SELECTOR, CAST_SELECTOR)
+        cast_names = [c.text for c in cast_elements if c.text]
+        return {
+            "url": link,
+            "title": title,
+            "supplement": supplement,
+            "cast_names": cast_names
+        }
+    except (TimeoutException, NoSuchElementException, StaleElementReferenceException) as e:
+        print(f"エラーが発生しました: {e}")
+        return None
+    except WebDriverException:
+        raise
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        return None
+
+def safe_get(driver, url, retries=3, deadline_at: float = None):
+    """
+    ページを読み込む。タイムアウトしたら間隔を空けて retries 回まで試す。
+    deadline_at を指定すると、1回の読み込みも期限までで打ち切り (BROWSER_PAGE_LOAD_TIMEOUT との短い方)、期限を過ぎたら再試行しない
+    """
+    from selenium.common.exceptions import TimeoutException
+
     for attempt in range(retries):
+        timeout = config.BROWSER_PAGE_LOAD_TIMEOUT
+        if deadline_at is not None:
+            timeout = _remaining(deadline_at, timeout)
+            if timeout <= 0:
+                break
+        driver.set_page_load_timeout(timeout)
         try:
-            driver.get(url)
+            with span("selenium.page_load"):
+                driver.get(url)
             return
         except TimeoutException:
             print(f"Attempt {attempt + 1} failed. Retrying...")
-    raise TimeoutException(f"Failed to load {url} after {retries} attempts.")
+            if attempt + 1 < retries:
+                # 失敗が続くほど間隔を空ける (同時に失敗したブラウザが揃って再試行しないよう揺らす)
+                delay = backoff_delay(attempt, base=1.0, cap=8.0)
+                if deadline_at is not None and _remaining(deadline_at) <= delay:
+                    break
+                time.sleep(delay)
+    raise TimeoutException(f"Failed to load {url} after {attempt + 1} attempts.")
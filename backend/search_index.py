@@ -0,0 +1,241 @@
+# search_index.py
+import heapq
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import config
+from content import normalize_cast, text_ngrams
+from storage import to_utc_naive
+
+# フィールドごとの重み (タイトルに一致するほど上位にする)
+FIELD_WEIGHTS = {"title": 3.0, "cast": 2.0, "supplement": 1.0, "review": 0.5}
+
+
+class SearchIndex:
+    """
+    保存済みの番組とレビューの全文検索用の転置索引 (文字 bigram、メモリ上)。
+    - 番組ごとに タイトル / 出演者 / 補足 / レビュー本文 の bigram をフィールドの重み付きで数え、
+      postings[bigram] = {program_id: 重み付きの出現数} を持つ
+    - 番組の保存 (add_programs) とレビューの保存 (add_review) のたびに、その番組の分だけ更新する。
+      同じ番組は上書き、同じ review_id は1回だけ数える
+    - 検索は BM25 でスコアを付け、クエリの bigram のうち min_match の割合以上を含む番組だけを返す
+    """
+
+    def __init__(self, ngram: int = 2, min_match: float = 0.8, k1: float = 1.2, b: float = 0.75):
+        self.ngram = ngram
+        self.min_match = min_match
+        self.k1 = k1
+        self.b = b
+        self.programs = {}       # program_id -> 番組情報 (レビューだけの番組は url が無い)
+        self.fields = {}         # program_id -> {フィールド: Counter}
+        self.postings = {}       # bigram -> {program_id: 重み付きの出現数}
+        self.lengths = {}        # program_id -> 重み付きの bigram 数
+        self._total_length = 0.0
+        self._review_ids = set()
+        # program_id -> 検索結果として返した回数 (先読みで取り直す番組を選ぶのに使う)
+        self.hits = Counter()
+        self._lock = threading.Lock()
+        # 最初の読み込み (load) が終わったらセットされる
+        self.ready = threading.Event()
+
+    def __len__(self):
+        return len(self.programs)
+
+    # -------------------
+    # 更新
+    # -------------------
+    def add_programs(self, programs):
+        """
+        スクレイピングした番組を追加・上書きする (手元の方が新しい番組は上書きしない)
+        """
+        for program in programs:
+            pid = program["program_id"]
+            fields = {
+                "title": self._grams(program.get("title")),
+                "supplement": self._grams(program.get("supplement")),
+                "cast": sum((self._grams(normalize_cast(name)) for name in program.get("cast_names") or []),
+                            Counter()),
+            }
+            info = {
+                "program_id": pid,
+                "url": program.get("url"),
+                "title": program.get("title"),
+                "supplement": program.get("supplement"),
+                "cast_names": list(program.get("cast_names") or []),
+                "updated_at": to_utc_naive(program.get("scraped_at") or program.get("updated_at")
+                                           or datetime.utcnow()),
+            }
+            with self._lock:
+                current = self.programs.get(pid)
+                if current and current["updated_at"] and current["updated_at"] > info["updated_at"]:
+                    continue
+                self.programs[pid] = info
+                self._set_fields(pid, fields)
+
+    def add_review(self, review: dict):
+        """
+        レビュー本文を番組のレビューのフィールドに足す。まだ番組が無ければレビューのタイトルで仮に作る
+        """
+        review_id = review.get("review_id")
+        pid = review.get("program_id")
+        if not pid:
+            return
+        grams = self._grams(review.get("review_text"))
+        weight = FIELD_WEIGHTS["review"]
+        with self._lock:
+            if review_id is not None:
+                if review_id in self._review_ids:
+                    return
+                self._review_ids.add(review_id)
+            if pid not in self.programs:
+                self.programs[pid] = {"program_id": pid, "url": None, "title": review.get("program_title"),
+                                      "supplement": None, "cast_names": [], "updated_at": None}
+            # レビューは足すだけなので、他のフィールドは計算し直さずに postings に加算する
+            fields = self.fields.setdefault(pid, {})
+            fields.setdefault("review", Counter()).update(grams)
+            for gram, count in grams.items():
+                postings = self.postings.setdefault(gram, {})
+                postings[pid] = postings.get(pid, 0.0) + weight * count
+            added = weight * sum(grams.values())
+            self.lengths[pid] = self.lengths.get(pid, 0.0) + added
+            self._total_length += added
+
+    def _grams(self, text) -> Counter:
+        return Counter(text_ngrams(text, self.ngram))
+
+    def _set_fields(self, pid: str, fields: dict):
+        """
+        番組のフィールドを差し替え、変わった bigram の postings だけを更新する (ロックを持って呼ぶ)
+        """
+        old = self.fields.get(pid, {})
+        if "review" in old and "review" not in fields:
+            fields["review"] = old["review"]
+        before = self._weighted(old)
+        after = self._weighted(fields)
+        for gram in before.keys() - after.keys():
+            postings = self.postings[gram]
+            postings.pop(pid, None)
+            if not postings:
+                del self.postings[gram]
+        for gram, weight in after.items():
+            if before.get(gram) != weight:
+                self.postings.setdefault(gram, {})[pid] = weight
+        length = sum(after.values())
+        self._total_length += length - self.lengths.get(pid, 0.0)
+        self.lengths[pid] = length
+        self.fields[pid] = fields
+
+    @staticmethod
+    def _weighted(fields: dict) -> dict:
+        weighted = {}
+        for name, counts in fields.items():
+            weight = FIELD_WEIGHTS[name]
+            for gram, count in counts.items():
+                weighted[gram] = weighted.get(gram, 0.0) + weight * count
+        return weighted
+
+    # -------------------
+    # 検索
+    # -------------------
+    def search(self, query: str, n: int = 10, count: bool = True):
+        """
+        スコアの高い順に最大 n 件の [(番組情報, score)] を返す。url の無い (スクレイピングしていない) 番組は含めない。
+        1文字のクエリは bigram で引けないので空のリスト (スクレイピングする)。
+        count=False なら返した番組の回数 (hits) を数えない (先読みの計画など、利用者の検索ではない場合)
+        """
+        grams = set(text_ngrams(query, self.ngram))
+        if not grams or any(len(gram) < self.ngram for gram in grams):
+            return []
+        required = math.ceil(self.min_match * len(grams))
+        with self._lock:
+            n_docs = len(self.lengths) or 1
+            average = (self._total_length / n_docs) or 1.0
+            scores, matched = {}, Counter()
+            for gram in grams:
+                postings = self.postings.get(gram)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for pid, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[pid] / average)
+                    scores[pid] = scores.get(pid, 0.0) + idf * tf * (self.k1 + 1) / norm
+                    matched[pid] += 1
+            candidates = [(score, pid) for pid, score in scores.items()
+                          if matched[pid] >= required and self.programs[pid]["url"]]
+            top = heapq.nlargest(n, candidates)
+            if count:
+                self.hits.update(pid for _, pid in top)
+            return [(dict(self.programs[pid]), score) for score, pid in top]
+
+    def stale_programs(self, max_age: float, limit: int):
+        """
+        検索結果として返したことがあり、max_age 秒より前に取得した番組を、返した回数の多い順に最大 limit 件返す
+        """
+        oldest = datetime.utcnow() - timedelta(seconds=max_age)
+        with self._lock:
+            stale = [(count, pid) for pid, count in self.hits.items()
+                     if self.programs[pid]["url"] and (self.programs[pid]["updated_at"] or oldest) < oldest]
+            top = heapq.nlargest(limit, stale)
+            return [dict(self.programs[pid]) for _, pid in top]
+
+    # -------------------
+    # 読み込み
+    # -------------------
+    def load(self, scan_programs, scan_reviews):
+        """
+        保存済みの全番組と全レビューを読み込む (起動時に裏で1回)。読み込み中の更新はそのまま反映される
+        """
+        start = time.monotonic()
+        for programs in scan_programs():
+            self.add_programs(programs)
+        n_reviews = 0
+        for rows, _ in scan_reviews():
+            for row in rows:
+                self.add_review(row)
+            n_reviews += len(rows)
+        self.ready.set()
+        print(f"検索の索引を作りました: {len(self)} programs, {n_reviews} reviews, "
+              f"{len(self.postings)} bigrams ({time.monotonic() - start:.2f}s)")
+
+    def load_async(self, scan_programs, scan_reviews):
+        def run():
+            try:
+                self.load(scan_programs, scan_reviews)
+            except Exception as e:
+                print(f"検索の索引の作成に失敗しました: {e}")
+
+        thread = threading.Thread(target=run, name="search-index-load", daemon=True)
+        thread.start()
+        return thread
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"programs": len(self.programs), "bigrams": len(self.postings),
+                    "reviews": len(self._review_ids), "ready": self.ready.is_set()}
+
+
+def answer_from_index(index: SearchIndex, query: str, limit: int, max_age: float, count: bool = True):
+    """
+    索引だけで答えられるなら検索結果を返す。
+    索引の読み込み前、一致が limit 件未満 (未知のクエリ)、または max_age 秒より古い番組を含む場合は None
+    (その場合はスクレイピングする)。count は SearchIndex.search と同じ
+    """
+    if not index.ready.is_set():
+        return None
+    hits = index.search(query, limit, count=count)
+    if len(hits) < limit:
+        return None
+    oldest = datetime.utcnow() - timedelta(seconds=max_age)
+    programs = []
+    for program, _ in hits:
+        updated_at = program.pop("updated_at")
+        if updated_at is None or updated_at < oldest:
+            return None
+        programs.append(program)
+    return programs
+
+
+search_index = SearchIndex(min_match=config.SEARCH_INDEX_MIN_MATCH)
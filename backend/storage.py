@@ -0,0 +1,225 @@
+# storage.py
+"""
+保存先の共通インターフェース。
+STORAGE_BACKEND (datastore / sqlite) で実装を選び、最初に使うときに作る。
+"""
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+import config
+
+# 1回の書き込み・読み込みで扱う件数の上限 (Datastore の put_multi / get_multi の制限に合わせる)
+PUT_BATCH_SIZE = 500
+GET_BATCH_SIZE = 1000
+
+# put_records / scan_rows で扱うレコードの種類
+RECORD_KINDS = ("user", "review", "favorite")
+
+
+class RatingBatch(NamedTuple):
+    """
+    レビューの (user_id, program_id, rating) を列ごとにまとめたもの。
+    review_ids / created_ats は各行の review_id と created_at (差分読み込みで読み直した範囲の重複を除くのに使う)
+    """
+    user_ids: List[str]
+    program_ids: List[str]
+    ratings: np.ndarray  # float32
+    max_created_at: Optional[datetime]
+    review_ids: Optional[List[str]] = None
+    created_ats: Optional[List[datetime]] = None
+
+    def __len__(self):
+        return len(self.ratings)
+
+
+def new_review(program_id: str, program_title: str, user_id: str, rating: int, review_text: str) -> dict:
+    """
+    review_id と created_at を付けたレビューの内容を作る (まだ保存しない)
+    review_id は UUID を使用
+    """
+    return {
+        'review_id': str(uuid.uuid4()),
+        'program_id': program_id,
+        'program_title': program_title,
+        'user_id': user_id,
+        'rating': rating,
+        'review_text': review_text,
+        'created_at': datetime.utcnow()
+    }
+
+
+def record_key(kind: str, fields: dict) -> tuple:
+    """
+    レコードを一意に決めるキー。同じキーの書き込みは後のものが残る
+    """
+    if kind == "user":
+        return (kind, fields["user_id"])
+    if kind == "review":
+        return (kind, fields["review_id"])
+    if kind == "favorite":
+        return (kind, fields["user_id"], fields["program_id"])
+    raise ValueError(f"Unknown record kind: {kind}")
+
+
+def dedupe_records(records):
+    """
+    同じキーのレコードは後のものだけを残す (1回の put_multi に同じキーは1つしか入れられない)
+    """
+    latest = {}
+    for kind, fields in records:
+        latest[record_key(kind, fields)] = (kind, fields)
+    return list(latest.values())
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class Storage:
+    """
+    保存先の実装が持つ操作。レコードは dict でやり取りする
+    - user: user_id, user_name
+    - review: review_id, program_id, program_title, user_id, rating, review_text, created_at
+    - favorite: user_id, program_id
+    - program: program_id, url, title, supplement, cast_names, updated_at
+    """
+
+    name = ""
+
+    # ----- ユーザー -----
+    def create_user(self, user_id: str, user_name: str):
+        """
+        ユーザーが無ければ追加する (確認と追加は1回のトランザクション)
+        (user_id, user_name, 追加したかどうか) を返す。既にいる場合は保存済みの user_name を返す
+        """
+        raise NotImplementedError
+
+    def get_user(self, user_id: str):
+        """
+        (user_id, user_name) を返す。いなければ None
+        """
+        raise NotImplementedError
+
+    # ----- 書き込み -----
+    def put_records(self, records: List[tuple]):
+        """
+        [(kind, fields)] をまとめて保存する (同じキーは上書き)
+        """
+        raise NotImplementedError
+
+    # ----- レビュー -----
+    def get_reviews_by_program(self, program_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    def get_review_page(self, program_id: str, limit: int, cursor: Optional[str] = None):
+        """
+        レビューを新しい順に limit 件取得し、(レビューのリスト, 次のページのカーソル) を返す
+        最後のページでは次のカーソルは None。不正なカーソルには ValueError
+        """
+        raise NotImplementedError
+
+    def get_user_ratings(self, user_id: str) -> List[tuple]:
+        """
+        ユーザーのレビューの [(program_id, rating)] を返す
+        """
+        raise NotImplementedError
+
+    # ----- お気に入り -----
+    def get_favorites(self, user_id: str) -> List[str]:
+        raise NotImplementedError
+
+    # ----- 番組 -----
+    def upsert_programs(self, programs: List[dict]):
+        raise NotImplementedError
+
+    def get_programs(self, program_ids: List[str]) -> Dict[str, dict]:
+        raise NotImplementedError
+
+    def scan_programs(self, batch_size: int = 1000) -> Iterator[List[dict]]:
+        """
+        全番組を batch_size 件ずつ返す (番組情報は get_programs と同じ形)
+        """
+        raise NotImplementedError
+
+    # ----- 読み込み (集計・学習・エクスポート用) -----
+    def iter_review_events(self) -> Iterator[tuple]:
+        """
+        全レビューの (review_id, program_id, program_title, created_at) を1件ずつ返す
+        """
+        raise NotImplementedError
+
+    def scan_ratings(self, batch_size: int = 1000, since: Optional[datetime] = None) -> Iterator[RatingBatch]:
+        """
+        レビューを作成順に batch_size 件ずつ RatingBatch として返す。
+        since を指定すると、その時刻より後に作成されたレビューだけを返す
+        """
+        raise NotImplementedError
+
+    def scan_rows(self, kind: str, batch_size: int = 1000, cursor: Optional[str] = None):
+        """
+        kind の全レコードを batch_size 件ずつ、(行のリスト, このページの後ろのカーソル) として返す
+        """
+        raise NotImplementedError
+
+    def get_watermark(self, name: str) -> Optional[datetime]:
+        raise NotImplementedError
+
+    def set_watermark(self, name: str, created_at: datetime):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def create_storage(backend: str = None) -> Storage:
+    backend = backend or config.STORAGE_BACKEND
+    if backend == "datastore":
+        from storage_datastore import DatastoreStorage
+        return DatastoreStorage()
+    if backend == "sqlite":
+        from storage_sqlite import SqliteStorage
+        return SqliteStorage(config.SQLITE_PATH, pool_size=config.SQLITE_POOL_SIZE)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+_storage = None
+_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    設定された保存先を返す (最初に呼ばれたときに作る)
+    """
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
+
+
+def close_storage():
+    """
+    保存先を閉じる (アプリの終了時)。次に get_storage() を呼ぶと作り直す
+    """
+    global _storage
+    with _lock:
+        previous, _storage = _storage, None
+    if previous is not None:
+        previous.close()
+
+
+def set_storage(storage: Optional[Storage]) -> Optional[Storage]:
+    """
+    保存先を差し替え、前の保存先を返す (ベンチマークや移行ツール用)
+    """
+    global _storage
+    with _lock:
+        previous, _storage = _storage, storage
+    return previous
@@ -0,0 +1,257 @@
+# storage_datastore.py
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from google.api_core.exceptions import BadRequest
+from google.cloud import datastore
+
+from storage import GET_BATCH_SIZE, PUT_BATCH_SIZE, RatingBatch, Storage, dedupe_records
+
+# レコードの種類ごとの Kind
+KIND_NAMES = {"user": "User", "review": "Review", "favorite": "Favorite"}
+
+
+def _decode_cursor(token) -> Optional[str]:
+    if token is None:
+        return None
+    return token.decode() if isinstance(token, bytes) else token
+
+
+class DatastoreStorage(Storage):
+    """
+    Cloud Datastore に保存する。
+    - User: key=user_id
+    - Review: key=review_id
+    - Favorite: User > Favorite (key=program_id) の親子キー
+    - Program: key=program_id
+    """
+
+    name = "datastore"
+
+    def __init__(self, client=None):
+        if client is None:
+            emulator = os.getenv("DATASTORE_EMULATOR_HOST")
+            print(f"Datastore に接続します{f' (エミュレータ: {emulator})' if emulator else ''}")
+            client = datastore.Client()
+        self.client = client
+
+    # -------------------
+    # ユーザー関連
+    # -------------------
+    def create_user(self, user_id: str, user_name: str):
+        client = self.client
+        key = client.key('User', user_id)
+        with client.transaction():
+            entity = client.get(key)
+            if entity is not None:
+                return (entity.key.name, entity.get('user_name'), False)
+            entity = datastore.Entity(key=key)
+            entity.update({
+                'user_name': user_name
+            })
+            client.put(entity)
+        return (user_id, user_name, True)
+
+    def get_user(self, user_id: str):
+        entity = self.client.get(self.client.key('User', user_id))
+        if entity:
+            return (entity.key.name, entity.get('user_name'))
+        else:
+            return None
+
+    # -------------------
+    # 書き込み
+    # -------------------
+    def put_records(self, records: List[tuple]):
+        entities = [self._entity(kind, fields) for kind, fields in dedupe_records(records)]
+        for i in range(0, len(entities), PUT_BATCH_SIZE):
+            self.client.put_multi(entities[i:i + PUT_BATCH_SIZE])
+
+    def _entity(self, kind: str, fields: dict):
+        client = self.client
+        if kind == "user":
+            entity = datastore.Entity(key=client.key('User', fields['user_id']))
+            entity.update({'user_name': fields['user_name']})
+        elif kind == "review":
+            entity = datastore.Entity(key=client.key('Review', fields['review_id']))
+            entity.update(fields)  # review_id もフィールドとして保存
+        elif kind == "favorite":
+            # パスの設定: User > Favorite
+            parent_key = client.key('User', fields['user_id'])
+            entity = datastore.Entity(key=client.key('Favorite', fields['program_id'], parent=parent_key))
+            entity.update({'program_id': fields['program_id']})
+        else:
+            raise ValueError(f"Unknown record kind: {kind}")
+        return entity
+
+    # -------------------
+    # レビュー関連
+    # -------------------
+    def _program_reviews_query(self, program_id: str):
+        query = self.client.query(kind='Review')
+        query.add_filter('program_id', '=', program_id)
+        query.order = ['-created_at']  # 新しい順
+        return query
+
+    def get_reviews_by_program(self, program_id: str) -> List[dict]:
+        return [dict(entity) for entity in self._program_reviews_query(program_id).fetch()]
+
+    def get_review_page(self, program_id: str, limit: int, cursor: Optional[str] = None):
+        iterator = self._program_reviews_query(program_id).fetch(limit=limit, start_cursor=cursor)
+        try:
+            page = next(iterator.pages, None)
+        except BadRequest as e:
+            if cursor is None:
+                raise
+            raise ValueError(f"Invalid cursor: {e}")
+        results = [dict(entity) for entity in page] if page is not None else []
+        return results, _decode_cursor(iterator.next_page_token)
+
+    def get_user_ratings(self, user_id: str) -> List[tuple]:
+        query = self.client.query(kind='Review')
+        query.add_filter('user_id', '=', user_id)
+        return [(entity.get('program_id'), entity.get('rating')) for entity in query.fetch()]
+
+    # -------------------
+    # お気に入り関連
+    # -------------------
+    def get_favorites(self, user_id: str) -> List[str]:
+        parent_key = self.client.key('User', user_id)
+        query = self.client.query(kind='Favorite', ancestor=parent_key)
+        query.keys_only()
+        return [entity.key.name for entity in query.fetch()]
+
+    # -------------------
+    # 番組関連
+    # -------------------
+    def upsert_programs(self, programs: List[dict]):
+        entities = []
+        for program in programs:
+            key = self.client.key('Program', program['program_id'])
+            entity = datastore.Entity(key=key, exclude_from_indexes=('supplement', 'cast_names'))
+            entity.update({
+                'program_id': program['program_id'],
+                'url': program.get('url'),
+                'title': program.get('title'),
+                'supplement': program.get('supplement'),
+                'cast_names': program.get('cast_names', []),
+                'updated_at': program.get('scraped_at') or datetime.utcnow()
+            })
+            entities.append(entity)
+        for i in range(0, len(entities), PUT_BATCH_SIZE):
+            self.client.put_multi(entities[i:i + PUT_BATCH_SIZE])
+
+    def get_programs(self, program_ids: List[str]) -> Dict[str, dict]:
+        programs = {}
+        unique_ids = list(dict.fromkeys(program_ids))
+        for i in range(0, len(unique_ids), GET_BATCH_SIZE):
+            keys = [self.client.key('Program', pid) for pid in unique_ids[i:i + GET_BATCH_SIZE]]
+            for entity in self.client.get_multi(keys):
+                programs[entity.key.name] = self._program(entity)
+        return programs
+
+    def scan_programs(self, batch_size: int = 1000):
+        cursor = None
+        while True:
+            iterator = self.client.query(kind='Program').fetch(limit=batch_size, start_cursor=cursor)
+            page = next(iterator.pages, None)
+            programs = [self._program(entity) for entity in page or []]
+            if programs:
+                yield programs
+            cursor = iterator.next_page_token
+            if cursor is None or not programs:
+                return
+
+    @staticmethod
+    def _program(entity) -> dict:
+        return {
+            'program_id': entity.key.name,
+            'url': entity.get('url'),
+            'title': entity.get('title'),
+            'supplement': entity.get('supplement'),
+            'cast_names': list(entity.get('cast_names') or []),
+            'updated_at': entity.get('updated_at')
+        }
+
+    # -------------------
+    # 読み込み (集計・学習・エクスポート用)
+    # -------------------
+    def iter_review_events(self):
+        """
+        - 射影クエリで (program_id, program_title, created_at) とキーだけを読み、review_text などは読まない
+        射影クエリには index.yaml の複合インデックスが必要。
+        """
+        query = self.client.query(kind='Review')
+        query.projection = ['program_id', 'program_title', 'created_at']
+        for r in query.fetch():
+            yield (r.key.name, r.get('program_id'), r.get('program_title'), r.get('created_at'))
+
+    def scan_ratings(self, batch_size: int = 1000, since: Optional[datetime] = None):
+        """
+        - 射影クエリで (user_id, program_id, rating, created_at) だけを読み、review_text などは読まない
+        射影クエリには index.yaml の複合インデックスが必要。
+        """
+        cursor = None
+        while True:
+            query = self.client.query(kind='Review')
+            query.projection = ['created_at', 'user_id', 'program_id', 'rating']
+            if since is not None:
+                query.add_filter('created_at', '>', since)
+            query.order = ['created_at']
+            iterator = query.fetch(limit=batch_size, start_cursor=cursor)
+            page = next(iterator.pages, None)
+            user_ids, program_ids, ratings, review_ids, created_ats = [], [], [], [], []
+            max_created_at = None
+            for r in page or []:
+                user_id = r.get('user_id')
+                program_id = r.get('program_id')
+                rating = r.get('rating')
+                if user_id and program_id and rating:
+                    user_ids.append(user_id)
+                    program_ids.append(program_id)
+                    ratings.append(rating)
+                    review_ids.append(r.key.name)
+                    created_ats.append(r.get('created_at'))
+                max_created_at = r.get('created_at') or max_created_at
+            if user_ids:
+                yield RatingBatch(user_ids, program_ids, np.asarray(ratings, dtype=np.float32), max_created_at,
+                                  review_ids, created_ats)
+            cursor = iterator.next_page_token
+            if cursor is None or page is None:
+                return
+
+    def scan_rows(self, kind: str, batch_size: int = 1000, cursor: Optional[str] = None):
+        if kind not in KIND_NAMES:
+            raise ValueError(f"Unknown record kind: {kind}")
+        while True:
+            query = self.client.query(kind=KIND_NAMES[kind])
+            iterator = query.fetch(limit=batch_size, start_cursor=cursor)
+            page = next(iterator.pages, None)
+            rows = [self._row(entity) for entity in page or []]
+            cursor = _decode_cursor(iterator.next_page_token)
+            if rows:
+                yield rows, cursor
+            if cursor is None or not rows:
+                return
+
+    @staticmethod
+    def _row(entity) -> dict:
+        kind = entity.key.kind
+        if kind == 'User':
+            return {'user_id': entity.key.name, 'user_name': entity.get('user_name')}
+        if kind == 'Favorite':
+            return {'user_id': entity.key.parent.name, 'program_id': entity.key.name}
+        row = dict(entity)
+        row['review_id'] = entity.key.name
+        return row
+
+    def get_watermark(self, name: str) -> Optional[datetime]:
+        entity = self.client.get(self.client.key('Watermark', name))
+        return entity.get('created_at') if entity else None
+
+    def set_watermark(self, name: str, created_at: datetime):
+        entity = datastore.Entity(key=self.client.key('Watermark', name))
+        entity.update({'created_at': created_at, 'updated_at': datetime.utcnow()})
+        self.client.put(entity)
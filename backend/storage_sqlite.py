@@ -0,0 +1,387 @@
+# storage_sqlite.py
+import base64
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from storage import GET_BATCH_SIZE, RECORD_KINDS, RatingBatch, Storage, dedupe_records, to_utc_naive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    user_name TEXT
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id TEXT PRIMARY KEY,
+    program_id TEXT NOT NULL,
+    program_title TEXT,
+    user_id TEXT NOT NULL,
+    rating INTEGER,
+    review_text TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_program_created ON reviews (program_id, created_at);
+CREATE INDEX IF NOT EXISTS reviews_user ON reviews (user_id);
+CREATE INDEX IF NOT EXISTS reviews_created ON reviews (created_at, review_id);
+CREATE TABLE IF NOT EXISTS favorites (
+    user_id TEXT NOT NULL,
+    program_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, program_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS programs (
+    program_id TEXT PRIMARY KEY,
+    url TEXT,
+    title TEXT,
+    supplement TEXT,
+    cast_names TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    created_at TEXT,
+    updated_at TEXT
+);
+"""
+
+# SQLite の1文に渡せる変数の数の上限 (古い版は 999)
+_MAX_VARIABLES = 900
+
+# scan_rows のページ送りに使う列 (主キー)
+_SCAN_KEYS = {
+    "user": ("users", ("user_id",)),
+    "review": ("reviews", ("review_id",)),
+    "favorite": ("favorites", ("user_id", "program_id")),
+}
+
+
+def _encode_time(value: Optional[datetime]) -> Optional[str]:
+    """
+    UTC の "YYYY-MM-DD HH:MM:SS.ffffff" にする (文字列の順序が時刻の順序になる)
+    """
+    if value is None:
+        return None
+    return to_utc_naive(value).isoformat(sep=" ", timespec="microseconds")
+
+
+def _decode_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def _decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+class ConnectionPool:
+    """
+    SQLite の接続を使い回す。接続は最大 size 本まで必要になったときに作る
+    """
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._idle.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        書き込み用。BEGIN IMMEDIATE で書き込みロックを先に取り、例外が出たらロールバックする
+        """
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SqliteStorage(Storage):
+    """
+    1台で動かす場合や、ベンチマーク用の SQLite への保存 (WAL モード)。
+    レビューは (program_id, created_at) と user_id に索引を持ち、一覧と学習用の読み込みは
+    (created_at, review_id) を位置にしたページ送りで行う。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "tvapp.db", pool_size: int = 8):
+        self.path = path
+        self.pool = ConnectionPool(path, size=pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def close(self):
+        self.pool.close()
+
+    # -------------------
+    # ユーザー関連
+    # -------------------
+    def create_user(self, user_id: str, user_name: str):
+        with self.pool.transaction() as conn:
+            inserted = conn.execute(
+                "INSERT INTO users (user_id, user_name) VALUES (?, ?) ON CONFLICT (user_id) DO NOTHING",
+                (user_id, user_name),
+            ).rowcount
+            if inserted:
+                return (user_id, user_name, True)
+            row = conn.execute("SELECT user_id, user_name FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return (row["user_id"], row["user_name"], False)
+
+    def get_user(self, user_id: str):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT user_id, user_name FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return (row["user_id"], row["user_name"]) if row else None
+
+    # -------------------
+    # 書き込み
+    # -------------------
+    def put_records(self, records: List[tuple]):
+        users, reviews, favorites = [], [], []
+        for kind, fields in dedupe_records(records):
+            if kind == "user":
+                users.append((fields["user_id"], fields["user_name"]))
+            elif kind == "review":
+                reviews.append((fields["review_id"], fields["program_id"], fields.get("program_title"),
+                                fields["user_id"], fields.get("rating"), fields.get("review_text"),
+                                _encode_time(fields["created_at"])))
+            elif kind == "favorite":
+                favorites.append((fields["user_id"], fields["program_id"]))
+            else:
+                raise ValueError(f"Unknown record kind: {kind}")
+        with self.pool.transaction() as conn:
+            if users:
+                conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?)", users)
+            if reviews:
+                conn.executemany("INSERT OR REPLACE INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?)", reviews)
+            if favorites:
+                conn.executemany("INSERT OR IGNORE INTO favorites VALUES (?, ?)", favorites)
+
+    # -------------------
+    # レビュー関連
+    # -------------------
+    @staticmethod
+    def _review(row) -> dict:
+        review = dict(row)
+        review["created_at"] = _decode_time(review["created_at"])
+        return review
+
+    def get_reviews_by_program(self, program_id: str) -> List[dict]:
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM reviews WHERE program_id = ? ORDER BY created_at DESC, review_id DESC",
+                (program_id,),
+            ).fetchall()
+        return [self._review(row) for row in rows]
+
+    def get_user_ratings(self, user_id: str) -> List[tuple]:
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT program_id, rating FROM reviews WHERE user_id = ?", (user_id,)).fetchall()
+        return [(row["program_id"], row["rating"]) for row in rows]
+
+    def get_review_page(self, program_id: str, limit: int, cursor: Optional[str] = None):
+        sql = "SELECT * FROM reviews WHERE program_id = ?"
+        params = [program_id]
+        if cursor is not None:
+            created_at, review_id = _decode_cursor(cursor, 2)
+            sql += " AND (created_at, review_id) < (?, ?)"
+            params += [created_at, review_id]
+        sql += " ORDER BY created_at DESC, review_id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor((rows[-1]["created_at"], rows[-1]["review_id"]))
+        return [self._review(row) for row in rows], next_cursor
+
+    # -------------------
+    # お気に入り関連
+    # -------------------
+    def get_favorites(self, user_id: str) -> List[str]:
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT program_id FROM favorites WHERE user_id = ?", (user_id,)).fetchall()
+        return [row["program_id"] for row in rows]
+
+    # -------------------
+    # 番組関連
+    # -------------------
+    def upsert_programs(self, programs: List[dict]):
+        rows = [(p["program_id"], p.get("url"), p.get("title"), p.get("supplement"),
+                 json.dumps(p.get("cast_names", []), ensure_ascii=False),
+                 _encode_time(p.get("scraped_at") or datetime.utcnow()))
+                for p in programs]
+        with self.pool.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO programs VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def get_programs(self, program_ids: List[str]) -> Dict[str, dict]:
+        programs = {}
+        unique_ids = list(dict.fromkeys(program_ids))
+        step = min(GET_BATCH_SIZE, _MAX_VARIABLES)
+        with self.pool.connection() as conn:
+            for i in range(0, len(unique_ids), step):
+                chunk = unique_ids[i:i + step]
+                rows = conn.execute(
+                    f"SELECT * FROM programs WHERE program_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for row in rows:
+                    programs[row["program_id"]] = self._program(row)
+        return programs
+
+    def scan_programs(self, batch_size: int = 1000):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT * FROM programs")
+            while True:
+                chunk = rows.fetchmany(batch_size)
+                if not chunk:
+                    return
+                yield [self._program(row) for row in chunk]
+
+    @staticmethod
+    def _program(row) -> dict:
+        return {
+            'program_id': row["program_id"],
+            'url': row["url"],
+            'title': row["title"],
+            'supplement': row["supplement"],
+            'cast_names': json.loads(row["cast_names"] or "[]"),
+            'updated_at': _decode_time(row["updated_at"])
+        }
+
+    # -------------------
+    # 読み込み (集計・学習・エクスポート用)
+    # -------------------
+    def iter_review_events(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT review_id, program_id, program_title, created_at FROM reviews")
+            while True:
+                chunk = rows.fetchmany(10000)
+                if not chunk:
+                    return
+                for row in chunk:
+                    yield (row[0], row[1], row[2], _decode_time(row[3]))
+
+    def scan_ratings(self, batch_size: int = 1000, since: Optional[datetime] = None):
+        # (since, 最大の文字) から始めると、created_at が since と同じレビューも読み飛ばす
+        position = (_encode_time(since), "\uffff") if since is not None else None
+        while True:
+            sql = "SELECT created_at, review_id, user_id, program_id, rating FROM reviews"
+            params = []
+            if position is not None:
+                sql += " WHERE (created_at, review_id) > (?, ?)"
+                params += list(position)
+            sql += " ORDER BY created_at, review_id LIMIT ?"
+            params.append(batch_size)
+            with self.pool.connection() as conn:
+                rows = conn.execute(sql, params).fetchall()
+            if not rows:
+                return
+            position = (rows[-1][0], rows[-1][1])
+            user_ids, program_ids, ratings, review_ids, created_ats = [], [], [], [], []
+            for created_at, review_id, user_id, program_id, rating in rows:
+                if user_id and program_id and rating:
+                    user_ids.append(user_id)
+                    program_ids.append(program_id)
+                    ratings.append(rating)
+                    review_ids.append(review_id)
+                    created_ats.append(_decode_time(created_at))
+            if user_ids:
+                yield RatingBatch(user_ids, program_ids, np.asarray(ratings, dtype=np.float32),
+                                  _decode_time(position[0]), review_ids, created_ats)
+            if len(rows) < batch_size:
+                return
+
+    def scan_rows(self, kind: str, batch_size: int = 1000, cursor: Optional[str] = None):
+        if kind not in RECORD_KINDS:
+            raise ValueError(f"Unknown record kind: {kind}")
+        table, keys = _SCAN_KEYS[kind]
+        key_list = ", ".join(keys)
+        position = _decode_cursor(cursor, len(keys)) if cursor is not None else None
+        while True:
+            sql = f"SELECT * FROM {table}"
+            params = []
+            if position is not None:
+                sql += f" WHERE ({key_list}) > ({', '.join('?' * len(keys))})"
+                params += list(position)
+            sql += f" ORDER BY {key_list} LIMIT ?"
+            params.append(batch_size)
+            with self.pool.connection() as conn:
+                rows = conn.execute(sql, params).fetchall()
+            if not rows:
+                return
+            position = [rows[-1][key] for key in keys]
+            more = len(rows) == batch_size
+            yield ([self._review(row) if kind == "review" else dict(row) for row in rows],
+                   _encode_cursor(position) if more else None)
+            if not more:
+                return
+
+    def get_watermark(self, name: str) -> Optional[datetime]:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT created_at FROM watermarks WHERE name = ?", (name,)).fetchone()
+        return _decode_time(row["created_at"]) if row else None
+
+    def set_watermark(self, name: str, created_at: datetime):
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                         (name, _encode_time(created_at), _encode_time(datetime.utcnow())))
@@ -0,0 +1,193 @@
+# training_data.py
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from database import get_watermark, scan_ratings, set_watermark
+
+# 全件の読み直しが必要になった時刻を書く watermark の名前
+RESET_MARKER = "ratings_reset"
+
+
+def mark_ratings_reset():
+    """
+    古い created_at のレビューを入れた (一括インポートなど) ことを保存先に記録する。
+    どのプロセスの RatingsTable も、次の refresh() で全件を読み直す
+    """
+    set_watermark(RESET_MARKER, datetime.utcnow())
+
+
+def _not_after_now(watermark):
+    # 未来の created_at のレビュー (インポートなど) で位置が先に進みすぎると、その時刻まで新しいレビューを読まなくなる
+    return None if watermark is None else min(watermark, datetime.utcnow())
+
+
+class RatingsTable:
+    """
+    学習用のレビューを列ごとの配列で持つ。
+    - user_id / program_id は整数コードに置き換え、文字列はコード表に1回だけ持つ
+    - refresh() は前回読んだ位置 (watermark) から overlap 秒さかのぼって読み直し、まだ持っていないレビューだけを追加する。
+      レビューが created_at の順に保存されるとは限らない (書き込みのまとめ・他の worker の書き込み) ので、
+      少し前まで読み直し、その範囲は review_id で重複を除く
+    - 一括インポートなどで古い created_at のレビューが入ったら mark_ratings_reset() で保存先に印を付ける。
+      印が前回の全件の読み込みより新しければ、次の refresh() で全件を読み直す (別のプロセスで入れた場合も)。
+      full_rescan_interval 秒ごとにも全件を読み直す (overlap より遅れて保存されたレビューも拾う)
+    - watermark はメモリ上の配列と対になる位置なので保存先には書かない。プロセスを起動し直したときは配列が空なので、
+      最初の refresh() で全件を読む
+    """
+
+    def __init__(self, batch_size: int = 1000, overlap: float = 0.0, full_rescan_interval: float = 0.0):
+        self.batch_size = batch_size
+        self.overlap = timedelta(seconds=overlap)
+        self.full_rescan_interval = full_rescan_interval
+        self.user_ids = []
+        self.program_ids = []
+        self.user_index = {}
+        self.program_index = {}
+        self.user_codes = np.empty(0, dtype=np.int32)
+        self.program_codes = np.empty(0, dtype=np.int32)
+        self.ratings = np.empty(0, dtype=np.float32)
+        self.watermark = None
+        self._recent = {}          # 読み直す範囲 (watermark - overlap より後) のレビュー: review_id -> created_at
+        self._last_full = None     # 最後に全件を読んだ時刻 (time.monotonic)
+        self._reset_seen = None    # 最後に全件を読んだ時点の印 (mark_ratings_reset の時刻)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def refresh(self, scan=None, full: bool = False) -> int:
+        """
+        新しいレビューを読み込み、追加した件数を返す。
+        full=True か、mark_ratings_reset() の後・full_rescan_interval 秒が過ぎた後は全件を読み直す
+        """
+        with self._lock:
+            # scan を差し替えた場合 (保存先を使わない場合) は印を見ない
+            reset = get_watermark(RESET_MARKER) if scan is None else None
+            scan = scan or scan_ratings
+            due = (self.full_rescan_interval and self._last_full is not None
+                   and time.monotonic() - self._last_full >= self.full_rescan_interval)
+            if (full or due or self._last_full is None
+                    or (reset is not None and (self._reset_seen is None or reset > self._reset_seen))):
+                return self._load_all(scan, reset)
+            return self._load_since(scan)
+
+    def _load_all(self, scan, reset) -> int:
+        user_ids, program_ids, user_index, program_index = [], [], {}, {}
+        user_chunks, program_chunks, rating_chunks = [], [], []
+        recent, watermark = {}, None
+        for batch in scan(batch_size=self.batch_size, since=None):
+            user_chunks.append(self._encode(batch.user_ids, user_index, user_ids))
+            program_chunks.append(self._encode(batch.program_ids, program_index, program_ids))
+            rating_chunks.append(batch.ratings)
+            self._remember(recent, batch)
+            if batch.max_created_at is not None:
+                watermark = batch.max_created_at
+        # 読み込みが最後まで成功したときだけ差し替える
+        before = len(self.ratings)
+        self.user_ids, self.program_ids = user_ids, program_ids
+        self.user_index, self.program_index = user_index, program_index
+        self.user_codes = np.concatenate([np.empty(0, dtype=np.int32)] + user_chunks)
+        self.program_codes = np.concatenate([np.empty(0, dtype=np.int32)] + program_chunks)
+        self.ratings = np.concatenate([np.empty(0, dtype=np.float32)] + rating_chunks)
+        self.watermark = _not_after_now(watermark)
+        self._recent = self._prune(recent, self.watermark)
+        self._last_full = time.monotonic()
+        self._reset_seen = reset
+        return max(0, len(self.ratings) - before)
+
+    def _load_since(self, scan) -> int:
+        user_chunks, program_chunks, rating_chunks = [], [], []
+        # 新しく出てきた user_id / program_id のコード表は、読み込みが成功するまで別に持つ
+        new_user_ids, new_program_ids, new_user_index, new_program_index = [], [], {}, {}
+        added = 0
+        watermark = self.watermark
+        recent = dict(self._recent)
+        since = self.watermark - self.overlap if self.watermark is not None else None
+        for batch in scan(batch_size=self.batch_size, since=since):
+            if batch.review_ids is not None:
+                # 前回までに読んだレビューを除く
+                keep = [i for i, review_id in enumerate(batch.review_ids) if review_id not in recent]
+                user_ids = [batch.user_ids[i] for i in keep]
+                program_ids = [batch.program_ids[i] for i in keep]
+                ratings = batch.ratings[keep]
+                self._remember(recent, batch)
+            else:
+                user_ids, program_ids, ratings = batch.user_ids, batch.program_ids, batch.ratings
+            user_chunks.append(self._encode(user_ids, new_user_index, new_user_ids,
+                                            self.user_index, len(self.user_ids)))
+            program_chunks.append(self._encode(program_ids, new_program_index, new_program_ids,
+                                               self.program_index, len(self.program_ids)))
+            rating_chunks.append(ratings)
+            added += len(ratings)
+            if batch.max_created_at is not None and (watermark is None or batch.max_created_at > watermark):
+                watermark = batch.max_created_at
+        # 読み込みが最後まで成功したときだけコード表・配列と watermark を進める
+        self.user_ids.extend(new_user_ids)
+        self.user_index.update(new_user_index)
+        self.program_ids.extend(new_program_ids)
+        self.program_index.update(new_program_index)
+        if added:
+            self.user_codes = np.concatenate([self.user_codes] + user_chunks)
+            self.program_codes = np.concatenate([self.program_codes] + program_chunks)
+            self.ratings = np.concatenate([self.ratings] + rating_chunks)
+        self.watermark = _not_after_now(watermark)
+        self._recent = self._prune(recent, self.watermark)
+        return added
+
+    @staticmethod
+    def _remember(recent: dict, batch):
+        if batch.review_ids is not None and batch.created_ats is not None:
+            recent.update(zip(batch.review_ids, batch.created_ats))
+
+    def _prune(self, recent: dict, watermark):
+        if watermark is None:
+            return recent
+        cutoff = watermark - self.overlap
+        return {review_id: created_at for review_id, created_at in recent.items()
+                if created_at is None or created_at > cutoff}
+
+    def to_columns(self):
+        """
+        (user_id の配列, program_id の配列, rating の配列) を返す
+        """
+        with self._lock:
+            users = np.asarray(self.user_ids, dtype=object)[self.user_codes]
+            programs = np.asarray(self.program_ids, dtype=object)[self.program_codes]
+            return users, programs, self.ratings
+
+    def to_matrix(self):
+        """
+        全レビューをユーザー×番組の CSR 行列 (factorization.RatingMatrix) にする。
+        行・列のコードは読み込み時に付けた整数コードをそのまま使う
+        """
+        from factorization import RatingMatrix
+
+        with self._lock:
+            return RatingMatrix.from_codes(self.user_codes, self.program_codes, self.ratings,
+                                           list(self.user_ids), list(self.program_ids))
+
+    def to_tuples(self):
+        """
+        [(user_id, program_id, rating)] のリストにする
+        """
+        users, programs, ratings = self.to_columns()
+        return list(zip(users.tolist(), programs.tolist(), ratings.astype(float).tolist()))
+
+    @staticmethod
+    def _encode(values, index: dict, vocab: list, known: dict = None, offset: int = 0):
+        """
+        values を整数コードにする。known (既存のコード表) にない値は index / vocab に offset から続く番号で追加する
+        """
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = known.get(value) if known is not None else None
+            if code is None:
+                code = index.get(value)
+            if code is None:
+                code = index[value] = offset + len(vocab)
+                vocab.append(value)
+            codes[i] = code
+        return codes
@@ -0,0 +1,80 @@
+# warmup.py
+"""
+起動時の準備 (ウォームアップ) と、その状態に応じた readiness。
+アプリの起動 (lifespan) では準備を待たず、裏のスレッドで登録した順に1つずつ実行する
+(保存先のクライアントの作成・推薦モデルの読み込み・ブラウザの起動など)。
+WARMUP_BEFORE_READY=1 なら、全部終わるまで ready にならない (/readyz が 503 を返す)。
+"""
+import threading
+import time
+
+
+class Warmup:
+    """
+    add_step(name, fn) で準備を登録し、start() で裏のスレッドで実行する。
+    失敗した準備は記録して次に進む (初回のリクエストでもう一度作られる)。その場合も最後には ready になる
+    """
+
+    def __init__(self, wait_before_ready: bool = True):
+        self.wait_before_ready = wait_before_ready
+        self.steps = []
+        self.status = {}           # name -> {"state": pending / running / done / failed, "seconds", "error"}
+        self.ready = threading.Event()
+        self.finished = threading.Event()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_step(self, name: str, fn):
+        self.steps.append((name, fn))
+        with self._lock:
+            self.status[name] = {"state": "pending", "seconds": None, "error": None}
+
+    def start(self):
+        self.started_at = time.time()
+        if not self.wait_before_ready:
+            self.ready.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def run(self):
+        start = time.monotonic()
+        for name, fn in self.steps:
+            self._update(name, state="running")
+            step_start = time.monotonic()
+            try:
+                fn()
+                self._update(name, state="done", seconds=time.monotonic() - step_start)
+            except Exception as e:
+                print(f"起動時の準備に失敗しました ({name}): {e}")
+                self._update(name, state="failed", seconds=time.monotonic() - step_start, error=str(e))
+        self.finished.set()
+        self.ready.set()
+        print(f"起動時の準備が終わりました ({time.monotonic() - start:.2f}s)")
+
+    def _update(self, name: str, **values):
+        with self._lock:
+            self.status[name].update(values)
+
+    def info(self) -> dict:
+        with self._lock:
+            steps = {name: dict(values) for name, values in self.status.items()}
+        failed = any(step["state"] == "failed" for step in steps.values())
+        if not self.ready.is_set():
+            status = "starting"
+        elif failed:
+            status = "degraded"
+        else:
+            status = "ready"
+        return {
+            "status": status,
+            "warmup_finished": self.finished.is_set(),
+            "uptime_seconds": time.time() - self.started_at,
+            "steps": steps,
+        }
@@ -0,0 +1,373 @@
+# write_pipeline.py
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+import config
+import database
+from storage import RECORD_KINDS
+
+_STOP = object()
+
+
+class WriteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.entities = 0
+        self.errors = 0
+
+    def record(self, size: int, error: bool = False):
+        with self._lock:
+            self.batches += 1
+            self.entities += size
+            if error:
+                self.errors += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "entities": self.entities,
+                "errors": self.errors,
+                "mean_batch_size": self.entities / self.batches if self.batches else 0.0,
+            }
+
+
+class WriteBatcher:
+    """
+    保存するレコード (kind, fields) を最大 window 秒だけ溜め、put_records 1回でまとめて保存する。
+    submit() は Future を返し、保存が終わると None、失敗すると例外が入る。
+    まとめた書き込みは flush_workers 個のスレッドで保存するので、保存中も次のバッチを溜められる。
+    on_written(kind, fields) は保存できた書き込みごとに、Future に結果が入る前に呼ばれる。
+    """
+
+    def __init__(self, put_records, max_batch: int = 500, window: float = 0.005, flush_workers: int = 4,
+                 on_written=None):
+        self.put_records = put_records
+        self.on_written = on_written
+        self.max_batch = max_batch
+        self.window = window
+        self.flush_workers = flush_workers
+        self.stats = WriteStats()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._flush_executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._flush_executor = ThreadPoolExecutor(max_workers=self.flush_workers,
+                                                          thread_name_prefix="write-flush")
+                self._thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """
+        溜まっている書き込みを保存してから止める
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout=10)
+        self._flush_executor.shutdown(wait=True)
+        self._flush_executor = None
+
+    def submit(self, kind: str, fields: dict) -> Future:
+        if self._thread is None:
+            self.start()
+        future = Future()
+        self._queue.put((kind, fields, future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush_executor.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        try:
+            self.put_records([(kind, fields) for kind, fields, _ in batch])
+        except Exception as e:
+            self.stats.record(len(batch), error=True)
+            print(f"書き込みのバッチ保存に失敗しました ({len(batch)}件): {e}")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.stats.record(len(batch))
+        for kind, fields, future in batch:
+            if self.on_written is not None:
+                try:
+                    self.on_written(kind, fields)
+                except Exception as e:
+                    print(f"書き込み完了の通知に失敗しました: {e}")
+            future.set_result(None)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value)}")
+
+
+def _decode(obj: dict):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class WriteBehindQueue:
+    """
+    書き込みを SQLite のファイル (WAL, synchronous=FULL) に記録した時点で完了とし、
+    裏のスレッドが保存先にまとめて保存する。保存できた行から消すので、
+    プロセスが落ちても次の起動時に残りを保存し直す。
+    同じファイルを複数のプロセス (uvicorn の worker) で使っても同じ行を二重に保存しないよう、
+    保存する行は BEGIN IMMEDIATE の中で claimed_by に自分の印を付けてから読む。
+    claim_timeout 秒たっても消されない印 (保存中に落ちたプロセスのもの) は無視して取り直す。
+    """
+
+    def __init__(self, path: str, put_records, batch_size: int = 500,
+                 poll_interval: float = 0.05, max_retry_interval: float = 60.0, claim_timeout: float = 300.0):
+        self.put_records = put_records
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_retry_interval = max_retry_interval
+        self.claim_timeout = claim_timeout
+        self.stats = WriteStats()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_writes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL, enqueued_at REAL NOT NULL)"
+        )
+        # 印の列が無い古いファイルには列を足す
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pending_writes)")}
+        if "claimed_by" not in columns:
+            self._conn.execute("ALTER TABLE pending_writes ADD COLUMN claimed_by TEXT")
+            self._conn.execute("ALTER TABLE pending_writes ADD COLUMN claimed_at REAL")
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, fn):
+        """
+        fn(kind, payload) を保存先に保存できた書き込みごとに呼ぶ
+        """
+        self._listeners.append(fn)
+
+    def enqueue(self, kind: str, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False, default=_encode)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pending_writes (kind, payload, enqueued_at) VALUES (?, ?, ?)",
+                (kind, data, time.time()),
+            )
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                written = self.drain_once()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                # 失敗が続くほど間隔を空けて再試行する (全ワーカーが同時に再試行しないよう揺らす)
+                delay = min(self.max_retry_interval, self.poll_interval * 2 ** failures)
+                print(f"書き込みキューの保存に失敗しました ({failures}回目, {delay:.1f}s後に再試行): {e}")
+                self._stop.wait(delay * random.uniform(0.5, 1.0))
+                continue
+            if not written:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def drain_once(self) -> int:
+        """
+        たまっている書き込みを最大 batch_size 件保存し、保存した件数を返す
+        """
+        rows, claim = self._claim()
+        if not rows:
+            return 0
+        items, done, broken = [], [], []
+        for row_id, kind, data in rows:
+            try:
+                if kind not in RECORD_KINDS:
+                    raise ValueError(f"Unknown record kind: {kind}")
+                items.append((kind, json.loads(data, object_hook=_decode)))
+                done.append(row_id)
+            except Exception as e:
+                # 読めない行はいつまでも保存できないので捨てる
+                print(f"書き込みキューの不正な行を捨てます (id={row_id}): {e}")
+                broken.append(row_id)
+        if items:
+            try:
+                self.put_records(items)
+            except Exception:
+                self.stats.record(len(items), error=True)
+                # 印を外して、次の再試行 (どのプロセスでもよい) で取り直せるようにする
+                with self._lock:
+                    self._conn.execute("UPDATE pending_writes SET claimed_by = NULL, claimed_at = NULL"
+                                       " WHERE claimed_by = ?", (claim,))
+                raise
+            self.stats.record(len(items))
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending_writes WHERE id = ?",
+                                   [(row_id,) for row_id in done + broken])
+        for kind, payload in items:
+            for listener in self._listeners:
+                try:
+                    listener(kind, payload)
+                except Exception as e:
+                    print(f"書き込み完了の通知に失敗しました: {e}")
+        return len(rows)
+
+    def _claim(self):
+        """
+        印の付いていない行を最大 batch_size 件、自分の印を付けて取り出す。(行, 印) を返す
+        """
+        claim = f"{os.getpid()}:{uuid.uuid4().hex}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE pending_writes SET claimed_by = ?, claimed_at = ? WHERE id IN ("
+                    " SELECT id FROM pending_writes WHERE claimed_by IS NULL OR claimed_at < ?"
+                    " ORDER BY id LIMIT ?)",
+                    (claim, now, now - self.claim_timeout, self.batch_size),
+                )
+                rows = self._conn.execute(
+                    "SELECT id, kind, payload FROM pending_writes WHERE claimed_by = ? ORDER BY id", (claim,)
+                ).fetchall()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows, claim
+
+
+def _done_future():
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class WritePipeline:
+    """
+    レビュー・お気に入りの書き込みの入口。mode によって保存の仕方を切り替える。
+    - direct: リクエストごとに put する
+    - batched: WriteBatcher でまとめて put し、保存が終わってから応答する
+    - write_behind: WriteBehindQueue に記録した時点で応答し、保存は裏で行う
+    submit() は Future を返す。保存できた書き込みごとに add_listener() の関数が呼ばれる。
+    """
+
+    def __init__(self, mode: str = "batched", window: float = 0.005, max_batch: int = 500,
+                 flush_workers: int = 4, queue_path: str = "write_behind.db"):
+        if mode not in ("direct", "batched", "write_behind"):
+            raise ValueError(f"Unknown write mode: {mode}")
+        self.mode = mode
+        self._listeners = []
+        self.batcher = None
+        self.queue = None
+        if mode == "batched":
+            self.batcher = WriteBatcher(database.put_records, max_batch=max_batch, window=window,
+                                        flush_workers=flush_workers, on_written=self._notify)
+        elif mode == "write_behind":
+            self.queue = WriteBehindQueue(queue_path, database.put_records, batch_size=max_batch)
+            self.queue.add_listener(self._notify)
+
+    def start(self):
+        if self.batcher is not None:
+            self.batcher.start()
+        if self.queue is not None:
+            self.queue.start()
+
+    def stop(self):
+        if self.batcher is not None:
+            self.batcher.stop()
+        if self.queue is not None:
+            self.queue.stop()
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def submit(self, kind: str, payload: dict) -> Future:
+        if self.queue is not None:
+            self.queue.enqueue(kind, payload)
+            return _done_future()
+        if self.batcher is None:
+            database.put_records([(kind, payload)])
+            self._notify(kind, payload)
+            return _done_future()
+        return self.batcher.submit(kind, payload)
+
+    def info(self) -> dict:
+        info = {"mode": self.mode}
+        if self.batcher is not None:
+            info.update(self.batcher.stats.as_dict())
+        if self.queue is not None:
+            info.update(self.queue.stats.as_dict())
+            info["pending"] = self.queue.pending()
+        return info
+
+    def _notify(self, kind: str, payload: dict):
+        for listener in self._listeners:
+            try:
+                listener(kind, payload)
+            except Exception as e:
+                print(f"書き込み完了の通知に失敗しました: {e}")
+
+
+write_pipeline = WritePipeline(
+    mode=config.WRITE_MODE,
+    window=config.WRITE_BATCH_WINDOW,
+    max_batch=config.WRITE_BATCH_SIZE,
+    flush_workers=config.WRITE_FLUSH_WORKERS,
+    queue_path=config.WRITE_BEHIND_PATH,
+)
@@ -47,28 +47,86 @@ if "search_results" not in st.session_state:
     st.session_state.search_results = []
 if "search_query" not in st.session_state:
     st.session_state.search_query = ""
+if "flash" not in st.session_state:
+    st.session_state.flash = None  # 再描画後に表示するメッセージ
+if "data_version" not in st.session_state:
+    st.session_state.data_version = 0  # 投稿のたびに進め、このユーザーの /batch のキャッシュを使わないようにする
+
+@st.cache_resource
+def get_http():
+    """
+    バックエンドへの接続を使い回す Session (再描画やユーザーをまたいで共有する)
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=20)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_search(search_query):
+    """
+    検索結果の番組一覧 (失敗した場合は例外になり、キャッシュされない)
+    """
+    res = get_http().get(f"{BACKEND_URL}/search", params={"q": search_query}, timeout=60)
+    res.raise_for_status()
+    return res.json().get("programs", [])
+
+@st.cache_data(ttl=60, max_entries=1000, show_spinner=False)
+def fetch_batch(program_ids, user_id, data_version):
+    """
+    番組ごとのレビュー一覧・お気に入り・おすすめを /batch で1回で取得する。
+    data_version はキャッシュのキーにだけ使う。投稿したら clear_user_data で進め、このユーザーの分だけ読み直す
+    """
+    params = {"program_ids": list(program_ids), "user_id": user_id}
+    res = get_http().get(f"{BACKEND_URL}/batch", params=params, timeout=30)
+    res.raise_for_status()
+    return res.json()
+
+def clear_user_data(message):
+    """
+    レビュー・お気に入りを投稿したあと、キャッシュを使わずに描画し直す (古いレビュー一覧などを表示しないように)。
+    fetch_batch.clear() は他のユーザーの分まで捨てるので、このユーザーの data_version だけを進める
+    """
+    st.session_state.data_version += 1
+    st.session_state.flash = message
+    st.rerun()
+
+def program_id_of(program):
+    # URL末尾から番組IDを推定する例（実際はバックエンドの返却値などにより調整）
+    return program.get("program_id") or program["url"].split("/tv_events/")[-1]
 
 def show_app_features():
     """
     ログイン済みユーザー向けに検索やレビュー投稿、お気に入り登録などのUIをまとめて表示する関数
     """
     st.header("番組検索＆レビュー投稿")
+    email = st.session_state.google_user.get("email")
+    http = get_http()
+    if st.session_state.flash:
+        st.success(st.session_state.flash)
+        st.session_state.flash = None
 
     # --- 検索UIと動作 ---
     search_query = st.text_input("番組の検索ワード", st.session_state.search_query)
     if st.button("検索"):
         st.session_state.search_query = search_query
-        params = {"q": search_query}
-        res = requests.get(f"{BACKEND_URL}/search", params=params)
-        if res.status_code == 200:
-            data = res.json()
-            st.session_state.search_results = data.get("programs", [])
-        else:
+        try:
+            st.session_state.search_results = fetch_search(search_query)
+        except requests.RequestException:
             st.error("検索に失敗しました。")
             st.session_state.search_results = []
 
+    # --- 表示に必要なレビュー一覧・お気に入り・おすすめをまとめて取得 ---
+    program_ids = tuple(program_id_of(program) for program in st.session_state.search_results)
+    try:
+        batch = fetch_batch(program_ids, email, st.session_state.data_version)
+    except requests.RequestException:
+        st.error("レビュー・お気に入り・おすすめの取得に失敗")
+        batch = None
+
     # --- 検索結果の表示とレビュー機能 ---
-    for program in st.session_state.search_results:
+    for program, program_id in zip(st.session_state.search_results, program_ids):
         st.subheader(program["title"])
         st.write(program["supplement"])
 
@@ -77,9 +135,6 @@ def show_app_features():
             for cast_name in program.get("cast_names", []):
                 st.write(f" - {cast_name}")
 
-        # URL末尾から番組IDを推定する例（実際はバックエンドの返却値などにより調整）
-        program_id = program["url"].split("/tv_events/")[-1]
-
         # レビュー投稿フォーム
         with st.form(key=f"review_form_{program_id}"):
             rating = st.slider("評価", 1, 5, 3)
@@ -89,29 +144,27 @@ def show_app_features():
                 payload = {
                     "program_id": program_id,
                     "program_title": program["title"],
-                    "user_id": st.session_state.google_user.get("email"),  # GoogleアカウントのメールをユーザーID扱い例
+                    "user_id": email,  # GoogleアカウントのメールをユーザーID扱い例
                     "rating": rating,
                     "review_text": review_text
                 }
-                r = requests.post(f"{BACKEND_URL}/reviews", json=payload)
+                r = http.post(f"{BACKEND_URL}/reviews", json=payload, timeout=30)
                 if r.status_code in (200, 201):
-                    st.success("レビューを投稿しました。")
+                    clear_user_data("レビューを投稿しました。")
                 else:
                     st.error("レビュー投稿に失敗")
 
         # お気に入り登録
         if st.button(f"お気に入り登録: {program_id}"):
-            fav_url = f"{BACKEND_URL}/favorites/{st.session_state.google_user.get('email')}/{program_id}"
-            fav_res = requests.post(fav_url)
+            fav_res = http.post(f"{BACKEND_URL}/favorites/{email}/{program_id}", timeout=30)
             if fav_res.status_code in (200, 201):
-                st.success("お気に入りに追加しました。")
+                clear_user_data("お気に入りに追加しました。")
             else:
                 st.error("お気に入り登録に失敗")
 
         # レビュー一覧の表示
-        rev_res = requests.get(f"{BACKEND_URL}/reviews/program/{program_id}")
-        if rev_res.status_code == 200:
-            reviews_data = rev_res.json()  # List[Review]
+        if batch is not None:
+            reviews_data = batch.get("reviews", {}).get(program_id, [])
             st.write("### レビュー一覧")
             if reviews_data:
                 for rev in reviews_data:
@@ -124,38 +177,29 @@ def show_app_features():
                     """)
             else:
                 st.write("まだレビューはありません。")
-        else:
-            st.error("レビュー取得に失敗")
 
         st.write("---")
 
+    if batch is None:
+        return
+
     # ユーザーのお気に入り一覧を表示
     if st.button("自分のお気に入りを表示"):
-        email = st.session_state.google_user.get("email")
-        fav_res = requests.get(f"{BACKEND_URL}/favorites/" + email)
-        if fav_res.status_code == 200:
-            fav_data = fav_res.json()
-            fav_programs = fav_data.get("favorite_programs", [])
-            if fav_programs:
-                st.write("お気に入り番組ID:", fav_programs)
-            else:
-                st.write("お気に入りはありません。")
+        # favorites / recommendations は user_id を渡したときだけ返ってくる
+        fav_programs = batch.get("favorites", {}).get("favorite_programs", [])
+        if fav_programs:
+            st.write("お気に入り番組ID:", fav_programs)
         else:
-            st.error("お気に入り取得に失敗")
+            st.write("お気に入りはありません。")
 
     # レコメンド表示 (例)
     st.subheader("おすすめの番組")
-    rec_res = requests.get(f"{BACKEND_URL}/recommendations/{st.session_state.google_user.get('email')}")
-    if rec_res.status_code == 200:
-        rec_data = rec_res.json()
-        recommendations = rec_data.get("recommendations", [])
-        if recommendations:
-            for rec in recommendations:
-                st.write(f" - {rec['title']}: {rec['supplement']}")
-        else:
-            st.write("おすすめ番組がありません")
+    recommendations = batch.get("recommendations", {}).get("recommendations", [])
+    if recommendations:
+        for rec in recommendations:
+            st.write(f" - {rec['title']}: {rec['supplement']}")
     else:
-        st.error("レコメンド取得に失敗")
+        st.write("おすすめ番組がありません")
 
 
 # ===============================